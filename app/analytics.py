@@ -0,0 +1,711 @@
+"""
+Analytics engine for history and reconciliation queries.
+Daily rollups, per-family sums, APY distributions and the family_totals check scan
+the whole snapshot history, so they run in an embedded DuckDB over a columnar
+archive instead of competing with the dashboard on SQLite. The archive is a set of
+Parquet files per month of pool_snapshots and metrics_snapshots in
+ASRSV_ANALYTICS_DIR; rows newer than the archive are read from the live database
+through a read-only connection. Nothing here writes to the live database.
+
+refresh_archive() extends the archive: new rows become small Parquet segments,
+closed months are compacted into one file, and months whose rows changed under it
+(a fee recompute, a restore) are exported again. Sealed pool_snapshots partitions
+(app/partitions.py) are exported from their own files, once per file version.
+Queries start a refresh in the background once the archive is
+ASRSV_ANALYTICS_REFRESH_SECONDS old.
+
+ASRSV_ANALYTICS_ENGINE=auto uses DuckDB when it is installed and the archive is
+built, SQLite otherwise; duckdb and sqlite force one engine.
+"""
+import csv
+import datetime
+import fcntl
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from app import partitions
+from app.db import DB_PATH, DEFAULT_ASSET_KEY, _connect, hot_floor, next_month, partition_uri, q, q_routed, sealed_partitions
+from app.metrics import ANALYTICS_QUERY_SECONDS
+
+try:
+	import duckdb
+except ImportError:  # every query falls back to SQLite
+	duckdb = None
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ENGINE = os.getenv("ASRSV_ANALYTICS_ENGINE", "auto")
+ANALYTICS_DIR = os.getenv("ASRSV_ANALYTICS_DIR", "analytics")
+ANALYTICS_REFRESH_SECONDS = float(os.getenv("ASRSV_ANALYTICS_REFRESH_SECONDS", "300"))
+# Rows this recent are left to the live read: a snapshot may still be publishing
+ANALYTICS_SETTLE_SECONDS = float(os.getenv("ASRSV_ANALYTICS_SETTLE_SECONDS", "900"))
+# Past this many rows newer than the archive, auto serves from SQLite until a refresh
+ANALYTICS_FRESH_ROWS = int(os.getenv("ASRSV_ANALYTICS_FRESH_ROWS", "20000"))
+# Segments an open month collects before they are compacted
+ANALYTICS_SEGMENTS = int(os.getenv("ASRSV_ANALYTICS_SEGMENTS", "24"))
+
+ENGINES = ("auto", "duckdb", "sqlite")
+ARCHIVE_TABLES = ("pool_snapshots", "metrics_snapshots")
+BUCKETS = {"day": 10, "month": 7}
+
+_DUCK_TYPES = {"TEXT": "VARCHAR", "REAL": "DOUBLE", "INTEGER": "BIGINT"}
+_BATCH = 10000
+
+
+def _quote(value: str) -> str:
+	return "'" + value.replace("'", "''") + "'"
+
+
+def _source() -> sqlite3.Connection:
+	"""Read-only connection to the live database."""
+	uri = pathlib.Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+	conn = sqlite3.connect(uri, uri=True, timeout=30, isolation_level=None)
+	conn.row_factory = sqlite3.Row
+	conn.execute("PRAGMA busy_timeout=30000;")
+	return conn
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[List[str]]:
+	return [[r[1], _DUCK_TYPES.get((r[2] or "").upper(), "VARCHAR")] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def load_manifest(directory: Optional[str] = None) -> Dict[str, Any]:
+	"""The archive's file list per table, its watermark and when it was last refreshed."""
+	path = os.path.join(directory or ANALYTICS_DIR, "manifest.json")
+	try:
+		with open(path, encoding="utf-8") as fh:
+			return json.load(fh)
+	except FileNotFoundError:
+		return {"tables": {}, "recompute_at": 0, "refreshed_at": 0}
+
+
+def _write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+	tmp = os.path.join(directory, ".manifest.json.tmp")
+	with open(tmp, "w", encoding="utf-8") as fh:
+		json.dump(manifest, fh, indent=1)
+		fh.flush()
+		os.fsync(fh.fileno())
+	os.replace(tmp, os.path.join(directory, "manifest.json"))
+
+
+def _to_csv(cur: sqlite3.Cursor, directory: str) -> Tuple[str, int]:
+	fd, path = tempfile.mkstemp(prefix=".export-", suffix=".csv", dir=directory)
+	n = 0
+	try:
+		with os.fdopen(fd, "w", newline="", encoding="utf-8") as fh:
+			writer = csv.writer(fh)
+			while True:
+				batch = cur.fetchmany(_BATCH)
+				if not batch:
+					break
+				writer.writerows(batch)
+				n += len(batch)
+	except BaseException:
+		os.unlink(path)
+		raise
+	return path, n
+
+
+def _sweep_exports(directory: str) -> None:
+	# CSV exports left by a refresh whose process exited mid-export; callers hold .lock
+	for name in os.listdir(directory):
+		if name.startswith(".export-"):
+			os.unlink(os.path.join(directory, name))
+
+
+def _read_csv(path: str, columns: List[List[str]]) -> str:
+	types = ", ".join(f"{_quote(c)}: {_quote(t)}" for c, t in columns)
+	return f"read_csv({_quote(path)}, header = false, columns = {{{types}}})"
+
+
+def _export(src: sqlite3.Connection, directory: str, table: str, columns: List[List[str]], month: str,
+		where: str, params: Sequence[Any], source: Optional[str] = None) -> Optional[Dict[str, Any]]:
+	"""Write one month's rows of `source` (the table itself by default) matching `where` to a new Parquet file."""
+	cur = src.execute(
+		f"""
+		SELECT {", ".join(c for c, _ in columns)} FROM {source or table}
+		WHERE ts_utc >= ? AND ts_utc < ? AND {where}
+		ORDER BY ts_utc
+		""",
+		(month, next_month(month), *params),
+	)
+	csv_path, rows = _to_csv(cur, directory)
+	try:
+		if not rows:
+			return None
+		name = f"{table}/{month}-{uuid.uuid4().hex[:8]}.parquet"
+		con = duckdb.connect()
+		try:
+			con.execute(f"COPY (SELECT * FROM {_read_csv(csv_path, columns)}) TO {_quote(os.path.join(directory, name))} (FORMAT parquet)")
+			last_ts = con.execute(f"SELECT MAX(ts_utc) FROM read_parquet({_quote(os.path.join(directory, name))})").fetchone()[0]
+		finally:
+			con.close()
+	finally:
+		os.unlink(csv_path)
+	return {"file": name, "month": month, "rows": rows, "last_ts": last_ts}
+
+
+def _compact(directory: str, table: str, month: str, files: List[Dict[str, Any]]) -> Dict[str, Any]:
+	name = f"{table}/{month}-{uuid.uuid4().hex[:8]}.parquet"
+	paths = ", ".join(_quote(os.path.join(directory, f["file"])) for f in files)
+	con = duckdb.connect()
+	try:
+		con.execute(f"COPY (SELECT * FROM read_parquet([{paths}]) ORDER BY ts_utc) TO {_quote(os.path.join(directory, name))} (FORMAT parquet)")
+	finally:
+		con.close()
+	return {"file": name, "month": month, "rows": sum(f["rows"] for f in files), "last_ts": max(f["last_ts"] for f in files)}
+
+
+def _recompute_at(src: sqlite3.Connection) -> float:
+	try:
+		row = src.execute("SELECT MAX(updated_at) FROM fee_recompute_jobs WHERE status = 'done'").fetchone()
+	except sqlite3.OperationalError:
+		return 0
+	return row[0] or 0
+
+
+def _sync_sealed(directory: str, table: str, columns: List[List[str]], files: List[Dict[str, Any]],
+		sealed: List[Any], floor: str, changes: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+	"""Archive each sealed partition once per file version; drop months whose partition is gone."""
+	registered = {p["month"]: p for p in sealed}
+	for month in sorted(set(registered) | {f["month"] for f in files if f["month"] < floor}):
+		current = [f for f in files if f["month"] == month]
+		part = registered.get(month)
+		if part is None:
+			if current:
+				files = [f for f in files if f["month"] != month]
+				changes["exported"].append(month)
+			continue
+		if current and all(f.get("sha256") == part["sha256"] for f in current):
+			continue
+		if current and not any("sha256" in f for f in current) and sum(f["rows"] for f in current) == part["rows"]:
+			# Just sealed: the archived rows are the ones that went into the file
+			for f in current:
+				f["sha256"] = part["sha256"]
+			continue
+		files = [f for f in files if f["month"] != month]
+		conn = sqlite3.connect(partition_uri(part["file"]), uri=True)
+		try:
+			exported = _export(conn, directory, table, columns, month, "1", ())
+		finally:
+			conn.close()
+		if exported:
+			exported["sha256"] = part["sha256"]
+			files.append(exported)
+		changes["exported"].append(month)
+	return files
+
+
+def _refresh_table(src: sqlite3.Connection, directory: str, manifest: Dict[str, Any], table: str,
+		cutoff: str, reset: bool, sealed: Optional[List[Any]] = None, floor: Optional[str] = None) -> Dict[str, List[str]]:
+	"""Bring one table's archive up to date.
+
+	For pool_snapshots, months before `floor` live in the `sealed` partitions, which are
+	archived from their files; every other read here is limited to the live months.
+	"""
+	changes: Dict[str, List[str]] = {"exported": [], "compacted": []}
+	columns = _columns(src, table)
+	entry = manifest["tables"].get(table)
+	if entry is None or entry["columns"] != columns or reset:
+		# New table, a schema change or rewritten history: export everything again
+		entry = {"columns": columns, "watermark": None, "files": []}
+		manifest["tables"][table] = entry
+	os.makedirs(os.path.join(directory, table), exist_ok=True)
+	watermark = entry["watermark"]
+	files = entry["files"]
+	floor = floor or ""
+	source = f"(SELECT * FROM {table} WHERE ts_utc >= {_quote(floor)})" if floor else table
+	if sealed is not None:
+		files = _sync_sealed(directory, table, columns, files, sealed, floor, changes)
+
+	if watermark is not None:
+		archived = sum(f["rows"] for f in files if f["month"] >= floor)
+		live = src.execute(f"SELECT COUNT(*) FROM {source} WHERE ts_utc <= ?", (watermark,)).fetchone()[0]
+		if live != archived:
+			# Rows under the watermark were added or removed since they were archived
+			per_month: Dict[str, int] = {}
+			for f in files:
+				if f["month"] >= floor:
+					per_month[f["month"]] = per_month.get(f["month"], 0) + f["rows"]
+			live_months = dict(src.execute(
+				f"SELECT substr(ts_utc, 1, 7), COUNT(*) FROM {source} WHERE ts_utc <= ? GROUP BY 1", (watermark,),
+			).fetchall())
+			for month in sorted(set(per_month) | set(live_months)):
+				if per_month.get(month, 0) == live_months.get(month, 0):
+					continue
+				files = [f for f in files if f["month"] != month]
+				exported = _export(src, directory, table, columns, month, "ts_utc <= ?", (watermark,), source)
+				if exported:
+					files.append(exported)
+				changes["exported"].append(month)
+
+	new_watermark = src.execute(f"SELECT MAX(ts_utc) FROM {source} WHERE ts_utc <= ?", (cutoff,)).fetchone()[0]
+	if new_watermark is not None and new_watermark != watermark:
+		months = [r[0] for r in src.execute(
+			f"SELECT DISTINCT substr(ts_utc, 1, 7) FROM {source} WHERE ts_utc > ? AND ts_utc <= ?",
+			(watermark or "", new_watermark),
+		)]
+		for month in sorted(months):
+			exported = _export(src, directory, table, columns, month, "ts_utc > ? AND ts_utc <= ?",
+				(watermark or "", new_watermark), source)
+			if exported:
+				files.append(exported)
+				changes["exported"].append(month)
+		watermark = new_watermark
+
+	if watermark is not None:
+		open_month = watermark[:7]
+		by_month: Dict[str, List[Dict[str, Any]]] = {}
+		for f in files:
+			by_month.setdefault(f["month"], []).append(f)
+		for month, parts in sorted(by_month.items()):
+			if len(parts) > 1 and (month < open_month or len(parts) > ANALYTICS_SEGMENTS):
+				files = [f for f in files if f["month"] != month] + [_compact(directory, table, month, parts)]
+				changes["compacted"].append(month)
+
+	entry["watermark"] = watermark
+	entry["files"] = sorted(files, key=lambda f: (f["month"], f["last_ts"]))
+	return changes
+
+
+def _remove_unreferenced(directory: str, manifest: Dict[str, Any]) -> None:
+	keep = {f["file"] for entry in manifest["tables"].values() for f in entry["files"]}
+	for table in ARCHIVE_TABLES:
+		folder = os.path.join(directory, table)
+		if not os.path.isdir(folder):
+			continue
+		for name in os.listdir(folder):
+			if name.endswith(".parquet") and f"{table}/{name}" not in keep:
+				os.unlink(os.path.join(folder, name))
+
+
+def refresh_archive(directory: Optional[str] = None) -> Dict[str, Any]:
+	"""Bring the Parquet archive up to date with the live database; returns what changed."""
+	if duckdb is None:
+		raise RuntimeError("duckdb is not installed")
+	directory = directory or ANALYTICS_DIR
+	os.makedirs(directory, exist_ok=True)
+	started = time.perf_counter()
+	cutoff = (datetime.datetime.now(datetime.timezone.utc)
+		- datetime.timedelta(seconds=ANALYTICS_SETTLE_SECONDS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+	with open(os.path.join(directory, ".lock"), "w") as lock:
+		# One exporter at a time across processes; the others find the work done
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		_sweep_exports(directory)
+		manifest = load_manifest(directory)
+		src = _source()
+		try:
+			# Every count and export below reads the same snapshot of the database
+			src.execute("BEGIN")
+			recompute_at = _recompute_at(src)
+			recomputed = recompute_at > manifest.get("recompute_at", 0)
+			sealed, floor = sealed_partitions(src), hot_floor(src)
+			changes = {
+				table: _refresh_table(src, directory, manifest, table, cutoff, recomputed and table == "pool_snapshots",
+					*((sealed, floor) if table == "pool_snapshots" else ()))
+				for table in ARCHIVE_TABLES
+			}
+			src.execute("COMMIT")
+		finally:
+			src.close()
+		manifest["recompute_at"] = recompute_at
+		manifest["refreshed_at"] = time.time()
+		_write_manifest(directory, manifest)
+		_remove_unreferenced(directory, manifest)
+	seconds = round(time.perf_counter() - started, 3)
+	if any(c["exported"] or c["compacted"] for c in changes.values()):
+		logger.info(f"Analytics archive refreshed in {seconds}s: {changes}")
+	return {"tables": changes, "watermarks": {t: manifest["tables"][t]["watermark"] for t in ARCHIVE_TABLES},
+		"seconds": seconds}
+
+
+class AnalyticsEngine:
+	"""Runs analytics queries in DuckDB over the archive plus recent rows, or in SQLite."""
+
+	def __init__(self, directory: Optional[str] = None, engine: Optional[str] = None) -> None:
+		self.directory = directory or ANALYTICS_DIR
+		self.engine = engine or ANALYTICS_ENGINE
+		if self.engine not in ENGINES:
+			raise ValueError(f"ASRSV_ANALYTICS_ENGINE must be one of {ENGINES}, got '{self.engine}'")
+		self._lock = threading.Lock()
+		self._reset()
+
+	def _reset(self) -> None:
+		self._pid = os.getpid()
+		self._con = None
+		self._manifest: Dict[str, Any] = {}
+		self._manifest_mtime: Optional[float] = None
+		# table -> (watermark, rows, newest ts) of the recent rows loaded into DuckDB
+		self._fresh: Dict[str, Tuple[Any, ...]] = {}
+		self._refresher: Optional[threading.Thread] = None
+		self._refresh_started = 0.0
+		self._last_error: Optional[str] = None
+
+	def _refresh_in_background(self) -> None:
+		if self._refresher is not None and self._refresher.is_alive():
+			return
+		if time.time() - self._refresh_started < ANALYTICS_REFRESH_SECONDS:
+			return
+		self._refresh_started = time.time()
+
+		def refresh() -> None:
+			try:
+				refresh_archive(self.directory)
+				self._last_error = None
+			except Exception as e:
+				self._last_error = str(e)
+				logger.exception("Analytics archive refresh failed")
+
+		self._refresher = threading.Thread(target=refresh, name="analytics-refresh", daemon=True)
+		self._refresher.start()
+
+	def _load_manifest(self) -> bool:
+		"""Reload the manifest if another refresh replaced it; True when it changed."""
+		try:
+			mtime = os.path.getmtime(os.path.join(self.directory, "manifest.json"))
+		except FileNotFoundError:
+			mtime = None
+		if mtime == self._manifest_mtime:
+			return False
+		self._manifest = load_manifest(self.directory)
+		self._manifest_mtime = mtime
+		return True
+
+	def _sync_fresh(self, src: sqlite3.Connection, table: str, entry: Dict[str, Any]) -> bool:
+		"""Mirror the rows newer than the archive into DuckDB; False if there are too many."""
+		watermark = entry["watermark"] or ""
+		count, newest = src.execute(f"SELECT COUNT(*), MAX(ts_utc) FROM {table} WHERE ts_utc > ?", (watermark,)).fetchone()
+		key = (watermark, count, newest)
+		if self._fresh.get(table) == key:
+			return True
+		if count > ANALYTICS_FRESH_ROWS and self.engine == "auto":
+			return False
+		columns = entry["columns"]
+		self._con.execute(f"CREATE OR REPLACE TABLE fresh_{table} ({', '.join(f'{c} {t}' for c, t in columns)})")
+		if count:
+			cur = src.execute(f"SELECT {', '.join(c for c, _ in columns)} FROM {table} WHERE ts_utc > ?", (watermark,))
+			csv_path, _ = _to_csv(cur, self.directory)
+			try:
+				self._con.execute(f"INSERT INTO fresh_{table} SELECT * FROM {_read_csv(csv_path, columns)}")
+			finally:
+				os.unlink(csv_path)
+		self._fresh[table] = key
+		return True
+
+	def _create_views(self) -> None:
+		for table in ARCHIVE_TABLES:
+			paths = [os.path.join(self.directory, f["file"]) for f in self._manifest["tables"][table]["files"]]
+			archived = f"SELECT * FROM read_parquet([{', '.join(_quote(p) for p in paths)}]) UNION ALL " if paths else ""
+			self._con.execute(f"CREATE OR REPLACE VIEW {table} AS {archived}SELECT * FROM fresh_{table}")
+
+	def _duck(self) -> Optional[Any]:
+		"""A DuckDB cursor over archive + recent rows, or None when SQLite should answer."""
+		if self.engine == "sqlite" or duckdb is None:
+			return None
+		with self._lock:
+			if self._pid != os.getpid():
+				self._reset()  # forked: DuckDB handles do not survive fork
+			changed = self._load_manifest()
+			if time.time() - self._manifest.get("refreshed_at", 0) >= ANALYTICS_REFRESH_SECONDS:
+				if self.engine == "duckdb" and not self._manifest.get("tables"):
+					refresh_archive(self.directory)
+					changed = self._load_manifest()
+				else:
+					self._refresh_in_background()
+			tables = self._manifest.get("tables", {})
+			if not all(t in tables for t in ARCHIVE_TABLES):
+				return None
+			if self._con is None:
+				self._con = duckdb.connect()
+				changed = True
+			if changed:
+				self._fresh = {}
+			src = _source()
+			try:
+				src.execute("BEGIN")
+				ready = all(self._sync_fresh(src, t, tables[t]) for t in ARCHIVE_TABLES)
+				src.execute("COMMIT")
+			finally:
+				src.close()
+			if not ready:
+				self._refresh_in_background()
+				return None
+			if changed:
+				self._create_views()
+			return self._con.cursor()
+
+	def _query_duck(self, sql: str, params: Sequence[Any]) -> Optional[List[Dict[str, Any]]]:
+		for attempt in range(2):
+			try:
+				cur = self._duck()
+				if cur is None:
+					return None
+				try:
+					cur.execute(sql, list(params))
+					names = [d[0] for d in cur.description]
+					return [dict(zip(names, r)) for r in cur.fetchall()]
+				finally:
+					cur.close()
+			except duckdb.IOException as e:
+				# A refresh replaced files named by the manifest we loaded; reload it and retry once
+				with self._lock:
+					self._manifest_mtime = None
+				if attempt:
+					logger.warning(f"Analytics archive unreadable, answering from SQLite: {e}")
+					self._last_error = str(e)
+		return None
+
+	def run(self, name: str, sql: str, params: Sequence[Any] = (),
+			sqlite: Union[str, Callable[[], List[Dict[str, Any]]], None] = None) -> List[Dict[str, Any]]:
+		"""Rows of `sql` as dicts, from DuckDB when it can serve them, else from SQLite.
+
+		`sqlite` replaces `sql` on the SQLite path: a statement tuned for SQLite, or a
+		callable returning the rows when the query has no SQLite equivalent.
+		"""
+		started = time.perf_counter()
+		engine = "duckdb"
+		try:
+			rows = self._query_duck(sql, params)
+			if rows is not None:
+				return rows
+			engine = "sqlite"
+			if callable(sqlite):
+				return sqlite()
+			return [dict(r) for r in q(sqlite or sql, params)]
+		finally:
+			ANALYTICS_QUERY_SECONDS.labels(name, engine).observe(time.perf_counter() - started)
+
+	def status(self) -> Dict[str, Any]:
+		manifest = load_manifest(self.directory)
+		tables = manifest.get("tables", {})
+		return {
+			"engine": self.engine,
+			"duckdb_installed": duckdb is not None,
+			"directory": self.directory,
+			"refreshed_at": manifest.get("refreshed_at") or None,
+			"refreshing": self._refresher is not None and self._refresher.is_alive(),
+			"last_error": self._last_error,
+			"tables": {
+				t: {"watermark": e["watermark"], "files": len(e["files"]), "rows": sum(f["rows"] for f in e["files"])}
+				for t, e in tables.items()
+			},
+		}
+
+
+analytics_engine = AnalyticsEngine()
+
+
+def _range(start: Optional[str], end: Optional[str]) -> Tuple[str, List[Any]]:
+	filters, params = "", []
+	if start:
+		filters += " AND ts_utc >= ?"
+		params.append(start)
+	if end:
+		filters += " AND ts_utc <= ?"
+		params.append(end)
+	return filters, params
+
+
+def history_summaries(asset: str = DEFAULT_ASSET_KEY) -> List[Dict[str, Any]]:
+	"""Daily volume, real yield and APY averages from metrics_snapshots."""
+	return analytics_engine.run(
+		"history_summaries",
+		"""
+		SELECT substr(ts_utc, 1, 10) AS day,
+		       SUM(COALESCE(volume_24h_usd, 0)) AS vol_sum,
+		       SUM(0) AS fees_placeholder,
+		       AVG(COALESCE(real_yield_daily, 0)) AS real_yield_avg,
+		       AVG(COALESCE(apy_simple, 0)) AS apy_simple_avg
+		FROM metrics_snapshots
+		WHERE asset_key = ?
+		GROUP BY day
+		ORDER BY day
+		""",
+		(asset,),
+	)
+
+
+def history_pool_apy(asset: str = DEFAULT_ASSET_KEY) -> List[Dict[str, Any]]:
+	"""Average over pools of each pool's daily mean simple APY."""
+	return analytics_engine.run(
+		"history_pool_apy",
+		"""
+		SELECT day, COALESCE(AVG(apy_simple_avg), 0) AS apy_avg
+		FROM (
+		  SELECT substr(ts_utc, 1, 10) AS day, pool_address, family, AVG(apy_simple) AS apy_simple_avg
+		  FROM pool_snapshots
+		  WHERE asset_key = ?
+		  GROUP BY day, pool_address, family
+		) AS per_pool
+		GROUP BY day
+		ORDER BY day
+		""",
+		(asset,),
+		sqlite=lambda: [dict(r) for r in q_routed(
+			"""
+			SELECT day, COALESCE(AVG(apy_simple_avg), 0) AS apy_avg
+			FROM (
+			  SELECT date(substr(ts_utc,1,19)) AS day, pool_address, family, AVG(apy_simple) AS apy_simple_avg
+			  FROM {pool_snapshots}
+			  WHERE +asset_key = ?  -- unary +: a table scan beats a per-row lookup through idx_pool_asset_ts
+			  GROUP BY day, pool_address, family
+			)
+			GROUP BY day
+			ORDER BY day
+			""",
+			(asset,),
+			# Sealed months keep the per-pool daily means precomputed
+			sealed_sql="""
+			SELECT day, COALESCE(AVG(apy_simple_avg), 0) AS apy_avg
+			FROM sealed.pool_daily
+			WHERE asset_key = ?
+			GROUP BY day
+			ORDER BY day
+			""",
+		)],
+	)
+
+
+def family_rollup(asset: str = DEFAULT_ASSET_KEY, bucket: str = "day", start: Optional[str] = None,
+		end: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Per family and day (or month): average TVL, 24h volume and 24h fees per snapshot, mean APY."""
+	filters, params = _range(start, end)
+	sql = f"""
+		SELECT substr(ts_utc, 1, {BUCKETS[bucket]}) AS period, family,
+		       COUNT(DISTINCT ts_utc) AS snapshots,
+		       SUM(COALESCE(real_tvl_usd, 0)) / COUNT(DISTINCT ts_utc) AS avg_tvl_usd,
+		       SUM(COALESCE(volume_24h_usd, 0)) / COUNT(DISTINCT ts_utc) AS avg_volume_24h_usd,
+		       SUM(COALESCE(fee_24h_usd, 0)) / COUNT(DISTINCT ts_utc) AS avg_fee_24h_usd,
+		       AVG(apy_simple) AS avg_apy_simple
+		FROM {{pool_snapshots}}
+		WHERE asset_key = ?{filters}
+		GROUP BY period, family
+		ORDER BY period, family
+		"""
+	return analytics_engine.run(
+		f"family_rollup_{bucket}",
+		sql.replace("{pool_snapshots}", "pool_snapshots"),
+		[asset, *params],
+		# Periods never span a month, so each partition answers for its own
+		sqlite=lambda: [dict(r) for r in q_routed(sql, [asset, *params], start, end)],
+	)
+
+
+def apy_distribution(asset: str = DEFAULT_ASSET_KEY, start: Optional[str] = None,
+		end: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Spread of per-pool simple APY samples per family: min, p10, median, p90, max and mean."""
+	filters, params = _range(start, end)
+	params = [asset, *params]
+
+	def from_sqlite() -> List[Dict[str, Any]]:
+		import numpy as np
+		samples: Dict[str, List[float]] = {}
+		for r in q_routed(
+			f"SELECT family, apy_simple FROM {{pool_snapshots}} WHERE asset_key = ?{filters} AND apy_simple IS NOT NULL",
+			params, start, end,
+		):
+			samples.setdefault(r[0], []).append(r[1])
+		out = []
+		for family in sorted(samples):
+			a = np.asarray(samples[family])
+			p10, p50, p90 = np.percentile(a, [10, 50, 90])
+			out.append({"family": family, "samples": int(a.size), "min": float(a.min()), "p10": float(p10),
+				"p50": float(p50), "p90": float(p90), "max": float(a.max()), "mean": float(a.mean())})
+		return out
+
+	return analytics_engine.run(
+		"apy_distribution",
+		f"""
+		SELECT family, COUNT(*) AS samples, MIN(apy_simple) AS min,
+		       quantile_cont(apy_simple, 0.1) AS p10, quantile_cont(apy_simple, 0.5) AS p50,
+		       quantile_cont(apy_simple, 0.9) AS p90, MAX(apy_simple) AS max, AVG(apy_simple) AS mean
+		FROM pool_snapshots
+		WHERE asset_key = ?{filters} AND apy_simple IS NOT NULL
+		GROUP BY family
+		ORDER BY family
+		""",
+		params,
+		sqlite=from_sqlite,
+	)
+
+
+def reconcile_family_totals(asset: str = DEFAULT_ASSET_KEY) -> List[Dict[str, Any]]:
+	"""family_totals next to the same counters recomputed from the full pool_snapshots history.
+
+	Dropped partitions count with the totals they were sealed with; the history still on
+	disk continues from their last pool volumes.
+	"""
+	conn = _connect()
+	try:
+		dropped, boundary = partitions.dropped_totals(conn, asset)
+	finally:
+		conn.close()
+
+	def from_sqlite() -> List[Dict[str, Any]]:
+		conn = _connect()
+		try:
+			totals = partitions.recomputed_totals(conn, include_dropped=False)
+		finally:
+			conn.close()
+		return [{"family": f, "volume_usd": v, "fees_usd": fees} for (a, f), (v, fees) in totals.items() if a == asset]
+
+	if boundary:
+		last_volumes = f"(VALUES {', '.join(['(?, ?)'] * len(boundary))}) AS b(pool_address, vol)"
+	else:
+		last_volumes = "(SELECT NULL::VARCHAR AS pool_address, NULL::DOUBLE AS vol WHERE false) AS b"
+	recomputed = analytics_engine.run(
+		"reconcile_family_totals",
+		f"""
+		SELECT family, SUM(delta) AS volume_usd,
+		       SUM(delta * COALESCE(fee_rate, 0) * (1.0 - COALESCE(protocol_cut, 0))) AS fees_usd
+		FROM (
+		  SELECT family, fee_rate, protocol_cut,
+		         CASE WHEN vol >= prev THEN vol - prev WHEN vol > 0 THEN vol ELSE 0.0 END AS delta
+		  FROM (
+		    SELECT p.family, p.fee_rate, p.protocol_cut, COALESCE(p.volume_24h_usd, 0) AS vol,
+		           COALESCE(LAG(COALESCE(p.volume_24h_usd, 0)) OVER (PARTITION BY p.pool_address ORDER BY p.ts_utc),
+		                    b.vol, 0) AS prev
+		    FROM pool_snapshots p
+		    LEFT JOIN {last_volumes} ON b.pool_address = p.pool_address
+		    WHERE p.asset_key = ?
+		  ) AS windowed
+		) AS deltas
+		GROUP BY family
+		""",
+		[*(x for item in boundary.items() for x in item), asset],
+		sqlite=from_sqlite,
+	)
+	recomputed = {r["family"]: dict(r) for r in recomputed}
+	for family, (volume, fees) in dropped.items():
+		r = recomputed.setdefault(family, {"family": family, "volume_usd": 0.0, "fees_usd": 0.0})
+		r["volume_usd"] += volume
+		r["fees_usd"] += fees
+	recomputed = list(recomputed.values())
+	stored = {
+		r["family"]: r for r in q(
+			"SELECT family, all_time_volume_usd, all_time_fees_usd FROM family_totals WHERE asset_key = ?", (asset,),
+		)
+	}
+	out = []
+	for r in sorted(recomputed, key=lambda r: r["family"] or ""):
+		s = stored.pop(r["family"], None)
+		volume = s["all_time_volume_usd"] if s else None
+		fees = s["all_time_fees_usd"] if s else None
+		out.append({
+			"family": r["family"],
+			"stored_volume_usd": volume, "recomputed_volume_usd": r["volume_usd"],
+			"stored_fees_usd": fees, "recomputed_fees_usd": r["fees_usd"],
+			"fees_diff_usd": None if fees is None else r["fees_usd"] - fees,
+		})
+	for family, s in sorted(stored.items()):
+		out.append({"family": family, "stored_volume_usd": s["all_time_volume_usd"], "recomputed_volume_usd": None,
+			"stored_fees_usd": s["all_time_fees_usd"], "recomputed_fees_usd": None, "fees_diff_usd": None})
+	return out
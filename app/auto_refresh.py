@@ -6,15 +6,26 @@ import asyncio
 import threading
 import time
 import logging
-from datetime import datetime, timedelta
+import random
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 import sqlite3
 import os
 
+from app.db import q
+from app.leader import SchedulerLease
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MISSED_RUN_POLICIES = ("catch_up", "skip")
+
+
+def _parse_ts_utc(ts: str) -> datetime:
+    return datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+
 class AutoRefreshManager:
     """Manages automatic data refresh for the dashboard"""
     
@@ -23,6 +34,16 @@ class AutoRefreshManager:
         self.is_running = False
         self.thread: Optional[threading.Thread] = None
         self.last_refresh: Optional[datetime] = None
+        self.next_run: Optional[datetime] = None
+        self.lease = SchedulerLease()
+        # Random delay added to each wall-clock tick, capped at half an interval
+        self.jitter_seconds = int(os.getenv("ASRSV_REFRESH_JITTER_SECONDS", "30"))
+        # What to do on startup when the slot we are in has no snapshot yet
+        self.missed_run_policy = os.getenv("ASRSV_MISSED_RUN_POLICY", "catch_up")
+        if self.missed_run_policy not in MISSED_RUN_POLICIES:
+            logger.warning(f"Unknown ASRSV_MISSED_RUN_POLICY '{self.missed_run_policy}', using catch_up")
+            self.missed_run_policy = "catch_up"
+        self._stop_event = threading.Event()
         
     def start(self):
         """Start the auto-refresh background thread"""
@@ -31,6 +52,10 @@ class AutoRefreshManager:
             return
             
         self.is_running = True
+        self._stop_event.clear()
+        self.next_run = None
+        self.lease.acquire()
+        self.lease.start_heartbeat()
         self.thread = threading.Thread(target=self._refresh_loop, daemon=True)
         self.thread.start()
         logger.info(f"Auto-refresh started (interval: {self.refresh_interval // 60} minutes)")
@@ -38,36 +63,98 @@ class AutoRefreshManager:
     def stop(self):
         """Stop the auto-refresh background thread"""
         self.is_running = False
+        self._stop_event.set()
         if self.thread:
             self.thread.join(timeout=5)
+        self.lease.stop_heartbeat(release=True)
         logger.info("Auto-refresh stopped")
-        
+
+    def _poll_seconds(self) -> float:
+        return max(self.lease.ttl / 3.0, 1.0)
+
+    def _next_tick(self, after: datetime) -> datetime:
+        """Next wall-clock boundary after `after` (multiples of the interval since the UTC epoch)."""
+        interval = max(self.refresh_interval, 1)
+        tick = (int(after.timestamp()) // interval + 1) * interval
+        return datetime.fromtimestamp(tick, tz=timezone.utc)
+
+    def _with_jitter(self, tick: datetime) -> datetime:
+        bound = min(self.jitter_seconds, self.refresh_interval // 2)
+        if bound <= 0:
+            return tick
+        return tick + timedelta(seconds=random.uniform(0, bound))
+
+    def _last_snapshot_time(self) -> Optional[datetime]:
+        try:
+            # The slot counts as covered only once every asset has been snapshotted in it
+            rows = q("SELECT MIN(ts) AS ts FROM (SELECT MAX(ts_utc) AS ts FROM metrics_snapshots GROUP BY asset_key)")
+            if rows and rows[0]["ts"]:
+                return _parse_ts_utc(rows[0]["ts"])
+        except Exception as e:
+            logger.warning(f"Could not read last snapshot time: {e}")
+        return None
+
+    def _first_run_time(self, now: datetime) -> datetime:
+        """Decide when to run after startup or after taking over leadership."""
+        current_slot = self._next_tick(now) - timedelta(seconds=self.refresh_interval)
+        last = self._last_snapshot_time()
+        if last is not None and last >= current_slot:
+            # This slot is already covered (e.g. a restart right after a run)
+            return self._with_jitter(self._next_tick(now))
+        if self.missed_run_policy == "skip" and last is not None:
+            logger.info(f"Missed slot {current_slot.isoformat()} skipped; waiting for next tick")
+            return self._with_jitter(self._next_tick(now))
+        return now
+
     def _refresh_loop(self):
         """Main refresh loop running in background thread"""
         while self.is_running:
+            # Only the lease holder collects; followers keep polling so they
+            # can take over once the leader stops heartbeating.
+            if not self.lease.is_leader:
+                self.next_run = None
+                if self._stop_event.wait(self._poll_seconds()):
+                    break
+                continue
+
+            now = datetime.now(timezone.utc)
+            if self.next_run is None:
+                self.next_run = self._first_run_time(now)
+
+            delay = (self.next_run - now).total_seconds()
+            if delay > 0:
+                # Wake up at least once per lease period to notice lost leadership
+                if self._stop_event.wait(min(delay, self._poll_seconds())):
+                    break
+                continue
+
+            # Re-check the lease right before collecting
+            if not self.lease.acquire():
+                continue
+
             try:
                 self._run_snapshot()
                 self.last_refresh = datetime.now()
                 logger.info(f"Auto-refresh completed at {self.last_refresh}")
             except Exception as e:
                 logger.error(f"Auto-refresh failed: {e}")
-                
-            # Wait for next refresh
-            time.sleep(self.refresh_interval)
+
+            # Slots that elapsed while the snapshot ran are coalesced into the next tick
+            self.next_run = self._with_jitter(self._next_tick(datetime.now(timezone.utc)))
             
     def _run_snapshot(self):
-        """Run a snapshot and update the database"""
+        """Snapshot every enabled asset and update the database"""
         try:
             # Import here to avoid circular imports
-            from core.snapshot import snapshot_once
+            from core.snapshot import snapshot_all
             
             logger.info("Running automatic snapshot...")
-            result = snapshot_once()
+            result = snapshot_all()
             
-            if result and result.get('ts_utc'):
-                logger.info(f"Snapshot completed: {result['ts_utc']}")
-            else:
-                logger.warning("Snapshot completed but no timestamp returned")
+            for asset_key, res in result["assets"].items():
+                logger.info(f"Snapshot of {asset_key} completed: {res.get('ts_utc')}")
+            if result["errors"]:
+                raise RuntimeError(f"snapshot failed for {', '.join(sorted(result['errors']))}")
                 
         except Exception as e:
             logger.error(f"Snapshot failed: {e}")
@@ -77,18 +164,23 @@ class AutoRefreshManager:
         """Get the current status of auto-refresh"""
         return {
             "is_running": self.is_running,
+            "is_leader": self.lease.is_leader,
+            "instance_id": self.lease.holder,
+            "leader_id": (self.lease.current_holder() or {}).get("holder"),
             "refresh_interval_minutes": self.refresh_interval // 60,
             "last_refresh": self.last_refresh.isoformat() if self.last_refresh else None,
+            "next_refresh": self.next_run.isoformat() if self.next_run else None,
+            "missed_run_policy": self.missed_run_policy,
             "next_refresh_in_seconds": self._get_next_refresh_seconds()
         }
         
     def _get_next_refresh_seconds(self) -> Optional[int]:
         """Calculate seconds until next refresh"""
-        if not self.last_refresh:
+        if not self.next_run:
             return None
             
-        next_refresh = self.last_refresh + timedelta(seconds=self.refresh_interval)
-        now = datetime.now()
+        next_refresh = self.next_run
+        now = datetime.now(timezone.utc)
         
         if next_refresh > now:
             return int((next_refresh - now).total_seconds())
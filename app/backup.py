@@ -0,0 +1,322 @@
+"""
+Online backups.
+create_backup() copies the live database with the SQLite backup API, reading one
+WAL snapshot ASRSV_BACKUP_PAGES pages at a time with ASRSV_BACKUP_SLEEP_MS between
+steps. Readers and the writer carry on while it runs. The copy is checked, gzipped
+into ASRSV_BACKUP_DIR with a .json sidecar (sha256, snapshot range per asset) and the
+newest ASRSV_BACKUP_KEEP backups are kept.
+
+restore() verifies a backup and copies it back, optionally trimmed to a chosen
+snapshot: later rows are dropped and the all-time totals rebuilt from what is left.
+The sealed pool_snapshots partitions a backup's registry lists are hard-linked into
+<backup>.partitions/ (they never change, so a link costs no space). A fee recompute
+replaces those files in ASRSV_PARTITION_DIR; restore() puts the backup's copies back,
+and marks a month dropped if its file cannot be found anywhere.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import partitions, publish
+from app.db import DB_PATH, PARTITION_DIR, _connect, hot_floor, sealed_partitions
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.getenv("ASRSV_BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("ASRSV_BACKUP_KEEP", "7"))
+BACKUP_PAGES = int(os.getenv("ASRSV_BACKUP_PAGES", "256"))
+BACKUP_SLEEP_MS = float(os.getenv("ASRSV_BACKUP_SLEEP_MS", "5"))
+BACKUP_GZIP_LEVEL = int(os.getenv("ASRSV_BACKUP_GZIP_LEVEL", "6"))
+
+# Tables trimmed by a point-in-time restore
+SNAPSHOT_TABLES = ("pool_snapshots", "metrics_snapshots", "composition_snapshots")
+
+_CHUNK = 1024 * 1024
+
+
+def _sha256(path: str) -> str:
+	digest = hashlib.sha256()
+	with open(path, "rb") as fh:
+		for block in iter(lambda: fh.read(_CHUNK), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+
+def _snapshot_range(conn: sqlite3.Connection) -> Dict[str, Dict[str, str]]:
+	return {
+		r[0]: {"first_ts": r[1], "last_ts": r[2]}
+		for r in conn.execute("SELECT asset_key, MIN(ts_utc), MAX(ts_utc) FROM metrics_snapshots GROUP BY asset_key")
+	}
+
+
+def _check(conn: sqlite3.Connection) -> None:
+	result = conn.execute("PRAGMA quick_check;").fetchone()[0]
+	if result != "ok":
+		raise RuntimeError(f"integrity check failed: {result}")
+
+
+def _partitions_dir(path: str) -> str:
+	return path + ".partitions"
+
+
+def _link(src: str, dst: str) -> None:
+	try:
+		os.link(src, dst)
+	except FileNotFoundError:
+		raise
+	except OSError:
+		shutil.copy2(src, dst)  # another file system
+
+
+def _link_partitions(parts: List[sqlite3.Row], dest: str) -> None:
+	os.makedirs(dest)
+	for p in parts:
+		try:
+			_link(os.path.join(PARTITION_DIR, p["file"]), os.path.join(dest, p["file"]))
+		except FileNotFoundError:
+			raise RuntimeError(f"partition {p['month']} was replaced while it was being backed up; take the backup again")
+
+
+def list_backups(directory: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Backup metadata, newest first."""
+	directory = directory or BACKUP_DIR
+	if not os.path.isdir(directory):
+		return []
+	out = []
+	for name in os.listdir(directory):
+		if not name.endswith(".json"):
+			continue
+		with open(os.path.join(directory, name), encoding="utf-8") as fh:
+			meta = json.load(fh)
+		meta["path"] = os.path.join(directory, meta["file"])
+		out.append(meta)
+	return sorted(out, key=lambda m: m["created_at"], reverse=True)
+
+
+def _rotate(directory: str, keep: int) -> List[str]:
+	removed = []
+	for meta in list_backups(directory)[max(keep, 1):]:
+		for path in (meta["path"], meta["path"] + ".json"):
+			if os.path.exists(path):
+				os.unlink(path)
+		shutil.rmtree(_partitions_dir(meta["path"]), ignore_errors=True)
+		removed.append(meta["file"])
+	return removed
+
+
+def create_backup(directory: Optional[str] = None, keep: Optional[int] = None) -> Dict[str, Any]:
+	"""Copy the live database into a verified, compressed backup and rotate old ones."""
+	directory = directory or BACKUP_DIR
+	keep = BACKUP_KEEP if keep is None else keep
+	os.makedirs(directory, exist_ok=True)
+	started = time.perf_counter()
+	stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+	# Two backups in the same second (maintenance and cron) must not share a name
+	name = f"asrsv-{stamp}-{uuid.uuid4().hex[:8]}.sqlite.gz"
+
+	fd, copy_path = tempfile.mkstemp(prefix=".backup-", suffix=".sqlite", dir=directory)
+	os.close(fd)
+	parts_tmp = os.path.join(directory, f".{name}.partitions")
+	try:
+		src = _connect()
+		dst = sqlite3.connect(copy_path)
+		try:
+			steps = 0
+
+			def progress(status, remaining, total):
+				nonlocal steps
+				steps += 1
+				time.sleep(BACKUP_SLEEP_MS / 1000.0)
+
+			# Copy from one read snapshot. Otherwise every commit by another connection
+			# restarts the backup, and a busy writer keeps it from ever finishing. Under
+			# WAL the open read transaction does not block writers.
+			src.execute("BEGIN")
+			src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+			# Link the partitions this snapshot's registry lists before a recompute can replace them
+			parts = sealed_partitions(src)
+			_link_partitions(parts, parts_tmp)
+			src.backup(dst, pages=BACKUP_PAGES, progress=progress)
+			src.execute("COMMIT")
+			dst.execute("PRAGMA journal_mode=DELETE;")
+			_check(dst)
+			snapshots = _snapshot_range(dst)
+		finally:
+			dst.close()
+			src.close()
+		db_bytes = os.path.getsize(copy_path)
+
+		gz_tmp = os.path.join(directory, f".{name}.tmp")
+		with open(copy_path, "rb") as raw, gzip.open(gz_tmp, "wb", compresslevel=BACKUP_GZIP_LEVEL) as gz:
+			shutil.copyfileobj(raw, gz, _CHUNK)
+		with open(gz_tmp, "rb") as fh:
+			os.fsync(fh.fileno())
+		os.replace(parts_tmp, _partitions_dir(os.path.join(directory, name)))
+		os.replace(gz_tmp, os.path.join(directory, name))
+	finally:
+		if os.path.exists(copy_path):
+			os.unlink(copy_path)
+		shutil.rmtree(parts_tmp, ignore_errors=True)
+
+	path = os.path.join(directory, name)
+	meta = {
+		"file": name,
+		"created_at": time.time(),
+		"sha256": _sha256(path),
+		"bytes": os.path.getsize(path),
+		"db_bytes": db_bytes,
+		"steps": steps,
+		"seconds": round(time.perf_counter() - started, 3),
+		"snapshots": snapshots,
+		"partitions": [{"month": p["month"], "file": p["file"], "sha256": p["sha256"]} for p in parts],
+	}
+	with open(path + ".json", "w", encoding="utf-8") as fh:
+		json.dump(meta, fh, indent=2)
+	meta["rotated"] = _rotate(directory, keep)
+	meta["path"] = path
+	logger.info(f"Backup {name}: {db_bytes} bytes in {meta['seconds']}s, compressed to {meta['bytes']}")
+	return meta
+
+
+def _decompress(path: str, directory: str) -> str:
+	fd, out = tempfile.mkstemp(prefix=".restore-", suffix=".sqlite", dir=directory)
+	with os.fdopen(fd, "wb") as raw, gzip.open(path, "rb") as gz:
+		shutil.copyfileobj(gz, raw, _CHUNK)
+	return out
+
+
+def verify_backup(path: str) -> Dict[str, Any]:
+	"""Check a backup's sha256 against its sidecar and run an integrity check on its contents."""
+	with open(path + ".json", encoding="utf-8") as fh:
+		meta = json.load(fh)
+	actual = _sha256(path)
+	result = {"file": meta["file"], "sha256_ok": actual == meta["sha256"], "integrity_ok": False,
+		"missing_partitions": [p["month"] for p in meta.get("partitions", [])
+			if not os.path.exists(os.path.join(_partitions_dir(path), p["file"]))]}
+	if not result["sha256_ok"]:
+		result["error"] = f"sha256 mismatch: expected {meta['sha256']}, got {actual}"
+		return result
+	copy_path = _decompress(path, os.path.dirname(path) or ".")
+	try:
+		conn = sqlite3.connect(copy_path)
+		try:
+			_check(conn)
+			result["integrity_ok"] = True
+		except (RuntimeError, sqlite3.DatabaseError) as e:
+			result["error"] = str(e)
+		finally:
+			conn.close()
+	finally:
+		os.unlink(copy_path)
+	return result
+
+
+def _ts_epoch(ts: str) -> float:
+	return datetime.datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def trim_to(conn: sqlite3.Connection, ts: str) -> Dict[str, int]:
+	"""Drop everything recorded after snapshot `ts` and rebuild pools_state and family_totals."""
+	floor = hot_floor(conn)
+	if floor and ts < floor:
+		# Sealed partitions are shared with the live database and never trimmed
+		raise ValueError(f"{ts} is inside a sealed partition; pool history before {floor} cannot be trimmed")
+	cutoff = _ts_epoch(ts)
+	deleted = {}
+	conn.execute("BEGIN IMMEDIATE")
+	try:
+		for table in SNAPSHOT_TABLES:
+			deleted[table] = conn.execute(f"DELETE FROM {table} WHERE ts_utc > ?", (ts,)).rowcount
+		deleted["snapshot_runs"] = conn.execute(
+			"DELETE FROM snapshot_runs WHERE ts_utc > ? OR (ts_utc IS NULL AND started_at > ?)", (ts, cutoff),
+		).rowcount
+		conn.execute("UPDATE snapshot_runs SET status = 'abandoned' WHERE status IN ('fetching', 'staged')")
+		conn.execute("DELETE FROM snapshot_staging")
+		conn.execute("DELETE FROM snapshot_staging_pools")
+		# Collector payloads newer than the snapshot are refetched by the next run
+		conn.execute("DELETE FROM collector_cache WHERE fetched_at > ?", (cutoff,))
+
+		partitions.rebuild_totals(conn)
+		conn.execute("COMMIT")
+	except Exception:
+		conn.execute("ROLLBACK")
+		raise
+	return deleted
+
+
+def pick_backup(ts: str, directory: Optional[str] = None) -> Optional[Dict[str, Any]]:
+	"""The oldest backup that already holds snapshot `ts` for every asset it tracks."""
+	candidates = [
+		m for m in list_backups(directory)
+		if m["snapshots"] and all(r["last_ts"] >= ts for r in m["snapshots"].values())
+	]
+	return candidates[-1] if candidates else None
+
+
+def _restore_partitions(conn: sqlite3.Connection, path: str) -> Tuple[List[str], List[str]]:
+	"""Put back the partition files the restored registry needs from the backup.
+
+	Months whose file is in neither place (backups taken before partitions were saved)
+	are marked dropped: their rows leave history queries, all-time sums keep them.
+	"""
+	restored, dropped = [], []
+	for p in sealed_partitions(conn):
+		live = os.path.join(PARTITION_DIR, p["file"])
+		if os.path.exists(live):
+			continue
+		saved = os.path.join(_partitions_dir(path), p["file"])
+		if os.path.exists(saved) and _sha256(saved) == p["sha256"]:
+			os.makedirs(PARTITION_DIR, exist_ok=True)
+			_link(saved, live)
+			restored.append(p["month"])
+		else:
+			conn.execute("UPDATE pool_partitions SET dropped_at = ? WHERE month = ?", (time.time(), p["month"]))
+			dropped.append(p["month"])
+	if dropped:
+		logger.warning(f"Backup {os.path.basename(path)} has no file for partitions {', '.join(dropped)}; marked dropped")
+	return restored, dropped
+
+
+def restore(path: str, ts: Optional[str] = None, target: Optional[str] = None) -> Dict[str, Any]:
+	"""Restore a backup into `target` (the live database by default), trimmed to snapshot `ts` if given.
+
+	The copy is prepared beside the backup and written into the target with the backup
+	API, so connections open on the target see either the old or the restored database.
+	"""
+	target = target or DB_PATH
+	check = verify_backup(path)
+	if not (check["sha256_ok"] and check["integrity_ok"]):
+		raise RuntimeError(f"backup {path} failed verification: {check.get('error')}")
+	started = time.perf_counter()
+	copy_path = _decompress(path, os.path.dirname(path) or ".")
+	try:
+		src = sqlite3.connect(copy_path, isolation_level=None)
+		src.row_factory = sqlite3.Row
+		try:
+			trimmed = trim_to(src, ts) if ts else {}
+			restored, dropped = _restore_partitions(src, path)
+			dst = sqlite3.connect(target, timeout=30)
+			try:
+				dst.execute("PRAGMA busy_timeout=30000;")
+				src.backup(dst)
+			finally:
+				dst.close()
+		finally:
+			src.close()
+	finally:
+		os.unlink(copy_path)
+	logger.info(f"Restored {path} into {target}" + (f" as of {ts}" if ts else ""))
+	if target == DB_PATH:
+		# Published pages may show snapshots the restored database no longer has
+		publish.publish_all()
+	return {"backup": os.path.basename(path), "target": target, "ts": ts, "deleted": trimmed,
+		"restored_partitions": restored, "dropped_partitions": dropped, "seconds": round(time.perf_counter() - started, 3)}
@@ -0,0 +1,234 @@
+"""
+Dashboard data.
+The queries behind the main page and its two JSON payloads, shared by the routes in
+app/main.py and by app/publish.py, which renders them to static files after each
+snapshot. Importing this module has no side effects.
+"""
+from typing import Any, Dict
+
+from app.db import DEFAULT_ASSET_KEY, _connect, hot_floor, partition_totals, q
+
+DASHBOARD_TEMPLATE = "minimal-with-pools-table-test.html"
+
+
+def latest_metrics(asset: str = DEFAULT_ASSET_KEY):
+	rows = q("""
+		SELECT ts_utc, price_usd, fdv_usd, market_cap_usd, circulating_supply, 
+		       real_tvl_total_usd, volume_24h_usd, real_yield_daily, apy_simple, apy_compound
+		FROM metrics_snapshots 
+		WHERE asset_key = ?
+		ORDER BY ts_utc DESC LIMIT 1
+	""", (asset,))
+	if rows:
+		# Convert Row object to regular dict for template compatibility
+		row = rows[0]
+		return {
+			'ts_utc': row['ts_utc'],
+			'price_usd': row['price_usd'],
+			'fdv_usd': row['fdv_usd'],
+			'market_cap_usd': row['market_cap_usd'],
+			'circulating_supply': row['circulating_supply'],
+			'real_tvl_total_usd': row['real_tvl_total_usd'],
+			'volume_24h_usd': row['volume_24h_usd'],
+			'real_yield_daily': row['real_yield_daily'],
+			'apy_simple': row['apy_simple'],
+			'apy_compound': row['apy_compound']
+		}
+	return None
+
+
+def pools_for_ts(ts_utc: str, asset: str = DEFAULT_ASSET_KEY):
+	return q(
+		"""
+		SELECT family, source, quote_symbol, real_tvl_usd, volume_24h_usd,
+		       fee_24h_usd, daily_yield, apy_simple, quote_units
+		FROM pool_snapshots
+		WHERE asset_key = ? AND ts_utc = ?
+		ORDER BY apy_simple DESC
+		""",
+		(asset, ts_utc),
+	)
+
+
+def _sealed_totals(asset: str) -> tuple:
+	"""First ts_utc the live pool_snapshots table answers for, and the sums of the sealed months before it."""
+	conn = _connect()
+	try:
+		return hot_floor(conn) or "", partition_totals(conn, asset)
+	finally:
+		conn.close()
+
+
+def fee_metrics(asset: str = DEFAULT_ASSET_KEY):
+	"""Get simple fee metrics: 8hr = 24h/3, all-time = sum of all 8hr fees"""
+	# Get latest 24h fees
+	latest_24h = q("""
+		SELECT COALESCE(SUM(fee_24h_usd), 0) as total_24h_fees
+		FROM pool_snapshots
+		WHERE asset_key = ? AND ts_utc = (SELECT MAX(ts_utc) FROM pool_snapshots WHERE asset_key = ?)
+	""", (asset, asset))
+	
+	latest_24h_fees = latest_24h[0]['total_24h_fees'] if latest_24h else 0.0
+	fees_8hr = latest_24h_fees / 3.0  # Simple: 8hr = 24h / 3
+	
+	# Get all-time fees (sum of all 8hr fees), sealed partitions included
+	floor, sealed = _sealed_totals(asset)
+	all_time = q("""
+		SELECT COALESCE(SUM(fee_24h_usd / 3.0), 0) as all_time_fees
+		FROM pool_snapshots
+		WHERE asset_key = ? AND ts_utc >= ?
+	""", (asset, floor))
+	
+	all_time_fees = (all_time[0]['all_time_fees'] if all_time else 0.0) + sealed['fee_24h_usd'] / 3.0
+	
+	return {
+		'latest_8hr_fees': fees_8hr,
+		'latest_24h_fees': latest_24h_fees,
+		'all_time_fees': all_time_fees
+	}
+
+
+def volume_metrics(asset: str = DEFAULT_ASSET_KEY):
+	"""Get volume metrics: 8hr = 24h/3, all-time = sum of all 8hr volumes"""
+	# Get latest 24h volume
+	latest_24h = q("""
+		SELECT COALESCE(SUM(volume_24h_usd), 0) as total_24h_volume
+		FROM pool_snapshots
+		WHERE asset_key = ? AND ts_utc = (SELECT MAX(ts_utc) FROM pool_snapshots WHERE asset_key = ?)
+	""", (asset, asset))
+	
+	latest_24h_volume = latest_24h[0]['total_24h_volume'] if latest_24h else 0.0
+	volume_8hr = latest_24h_volume / 3.0  # Simple: 8hr = 24h / 3
+	
+	# Get all-time volume (sum of all 8hr volumes), sealed partitions included
+	floor, sealed = _sealed_totals(asset)
+	all_time = q("""
+		SELECT COALESCE(SUM(volume_24h_usd / 3.0), 0) as all_time_volume
+		FROM pool_snapshots
+		WHERE asset_key = ? AND ts_utc >= ?
+	""", (asset, floor))
+	
+	all_time_volume = (all_time[0]['all_time_volume'] if all_time else 0.0) + sealed['volume_24h_usd'] / 3.0
+	
+	return {
+		'latest_8hr_volume': volume_8hr,
+		'latest_24h_volume': latest_24h_volume,
+		'all_time_volume': all_time_volume
+	}
+
+
+def composition_for_ts(ts_utc: str, asset: str = DEFAULT_ASSET_KEY):
+	"""Composition rows for one snapshot; aggregates pool_snapshots if it was never materialized."""
+	rows = q(
+		"""
+		SELECT quote_symbol, units, price_usd, value_usd, percentage
+		FROM composition_snapshots
+		WHERE asset_key = ? AND ts_utc = ?
+		ORDER BY value_usd DESC
+		""",
+		(asset, ts_utc),
+	)
+	if rows:
+		return rows
+	return q(
+		"""
+		SELECT quote_symbol, units, value / units AS price_usd, value AS value_usd,
+		       100.0 * value / SUM(value) OVER () AS percentage
+		FROM (
+		  SELECT quote_symbol, SUM(quote_units) AS units, SUM(quote_units * quote_price_usd) AS value
+		  FROM pool_snapshots
+		  WHERE asset_key = ? AND ts_utc = ? AND quote_units > 0 AND quote_price_usd > 0
+		  GROUP BY quote_symbol
+		)
+		ORDER BY value_usd DESC
+		""",
+		(asset, ts_utc),
+	)
+
+
+def dashboard_context(asset: str = DEFAULT_ASSET_KEY) -> Dict[str, Any]:
+	"""Template context of the main dashboard page, without the request."""
+	from core.assets import get_asset
+	info = get_asset(asset)
+	asset_mint = info["mint"] if info else ""
+	m = latest_metrics(asset)
+	if not m:
+		return {"asset": asset, "asset_mint": asset_mint, "summary": None, "pools": [], "fees_8hr": 0, "fees_24h": 0, "fees_all_time": 0, "volume_8hr": 0, "volume_24h": 0, "volume_all_time": 0, "liquidity_deployed": 0, "daily_yield": 0, "apy_simple": 0, "apy_compound": 0, "no_data": True}
+
+	pools = pools_for_ts(m["ts_utc"], asset) if m else []
+	fees = fee_metrics(asset)
+	volume = volume_metrics(asset)
+
+	# Calculate liquidity deployed (market cap + real TVL)
+	liquidity_deployed = (m.get('market_cap_usd', 0) or 0) + (m.get('real_tvl_total_usd', 0) or 0)
+
+	return {
+		"asset": asset,
+		"asset_mint": asset_mint,
+		"summary": m,
+		"pools": pools,
+		"fees_8hr": fees['latest_8hr_fees'],
+		"fees_24h": fees['latest_24h_fees'],
+		"fees_all_time": fees['all_time_fees'],
+		"volume_8hr": volume['latest_8hr_volume'],
+		"volume_24h": volume['latest_24h_volume'],
+		"volume_all_time": volume['all_time_volume'],
+		"liquidity_deployed": liquidity_deployed,
+		"daily_yield": m['real_yield_daily'] if m and 'real_yield_daily' in m else 0,
+		"apy_simple": m['apy_simple'] if m and 'apy_simple' in m else 0,
+		"apy_compound": m['apy_compound'] if m and 'apy_compound' in m else 0,
+		"no_data": False
+	}
+
+
+def portfolio_composition_payload(asset: str = DEFAULT_ASSET_KEY) -> Dict[str, Any]:
+	"""Body of /api/portfolio-composition: the latest snapshot's composition by quote asset."""
+	latest = q("SELECT MAX(ts_utc) AS ts FROM pool_snapshots WHERE asset_key = ?", (asset,))
+	ts = latest[0]["ts"] if latest else None
+	composition = []
+	total_value = 0.0
+	if ts:
+		for row in composition_for_ts(ts, asset):
+			total_value += row["value_usd"]
+			composition.append({
+				"symbol": row["quote_symbol"],
+				"units": row["units"],
+				"price": row["price_usd"],
+				"value": row["value_usd"],
+				"percentage": row["percentage"],
+			})
+
+	return {
+		"asset": asset,
+		"ts_utc": ts,
+		"composition": composition,
+		"total_value": total_value
+	}
+
+
+def time_series_payload(asset: str = DEFAULT_ASSET_KEY) -> Dict[str, Any]:
+	"""Body of /api/time-series: price, market cap, volume and supply for the chart."""
+	rows = q("""
+		SELECT ts_utc, price_usd, market_cap_usd, volume_24h_usd, circulating_supply
+		FROM metrics_snapshots
+		WHERE asset_key = ?
+		ORDER BY ts_utc ASC
+		LIMIT 100
+	""", (asset,))
+
+	time_series_data = {
+		"timestamps": [],
+		"price": [],
+		"market_cap": [],
+		"volume_24h": [],
+		"circulating_supply": []
+	}
+
+	for row in rows:
+		time_series_data["timestamps"].append(row["ts_utc"])
+		time_series_data["price"].append(row["price_usd"] or 0)
+		time_series_data["market_cap"].append(row["market_cap_usd"] or 0)
+		time_series_data["volume_24h"].append(row["volume_24h_usd"] or 0)
+		time_series_data["circulating_supply"].append(row["circulating_supply"] or 0)
+
+	return time_series_data
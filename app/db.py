@@ -1,29 +1,184 @@
+import json
+import logging
 import os
+import pathlib
+import re
 import sqlite3
+import time
 from sqlite3 import Row
-from typing import Any, Iterable, List, Optional, Sequence, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.metrics import DB_QUERY_SECONDS
+from app.profiling import explain_if_slow
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = os.getenv("ASSET_DB_PATH", "asset_reserve_metrics.sqlite")
 
+# Asset that pre-multi-asset rows belong to, and the default scope of every API
+DEFAULT_ASSET_KEY = os.getenv("ASRSV_DEFAULT_ASSET", "asset")
+
+# Sealed monthly pool_snapshots partitions (see app/partitions.py)
+PARTITION_DIR = os.getenv("ASRSV_PARTITION_DIR", "partitions")
+
+# Storage profiles: page cache and memory map per connection, and the page size new
+# databases are created with. ASRSV_DB_PROFILE picks one; ASRSV_DB_CACHE_SIZE_KB,
+# ASRSV_DB_MMAP_MB and ASRSV_DB_PAGE_SIZE override single values.
+DB_PROFILES: Dict[str, Dict[str, int]] = {
+	"small": {"cache_size_kb": 8192, "mmap_mb": 0, "page_size": 4096},
+	"default": {"cache_size_kb": 32768, "mmap_mb": 256, "page_size": 4096},
+	"large": {"cache_size_kb": 262144, "mmap_mb": 4096, "page_size": 8192},
+}
+
+
+def _db_profile() -> Dict[str, Any]:
+	name = os.getenv("ASRSV_DB_PROFILE", "default")
+	profile = dict(DB_PROFILES.get(name, DB_PROFILES["default"]), name=name if name in DB_PROFILES else "default")
+	for key, env in (("cache_size_kb", "ASRSV_DB_CACHE_SIZE_KB"), ("mmap_mb", "ASRSV_DB_MMAP_MB"), ("page_size", "ASRSV_DB_PAGE_SIZE")):
+		if os.getenv(env):
+			profile[key] = int(os.getenv(env))
+	return profile
+
+
+DB_PROFILE = _db_profile()
+
+_FIRST_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+
 
 def _connect() -> sqlite3.Connection:
-	conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+	# uri=True so partitions can be attached with URI flags; a plain path still opens as before
+	conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, uri=True)
 	conn.row_factory = Row
 	cur = conn.cursor()
 	cur.execute("PRAGMA journal_mode=WAL;")
 	cur.execute("PRAGMA synchronous=NORMAL;")
 	cur.execute("PRAGMA busy_timeout=5000;")
+	cur.execute(f"PRAGMA cache_size=-{DB_PROFILE['cache_size_kb']};")
+	cur.execute(f"PRAGMA mmap_size={DB_PROFILE['mmap_mb'] * 1024 * 1024};")
 	return conn
 
 
+def _query_label(sql: str) -> str:
+	"""Low-cardinality metric label such as 'select:pool_snapshots'."""
+	words = sql.split(None, 1)
+	verb = words[0].lower() if words else "unknown"
+	m = _FIRST_TABLE.search(sql)
+	return f"{verb}:{m.group(1)}" if m else verb
+
+
 def q(sql: str, params: Sequence[Any] = ()) -> List[Row]:
+	started = time.perf_counter()
 	conn = _connect()
 	try:
 		cur = conn.execute(sql, params)
 		rows = cur.fetchall()
+		explain_if_slow(conn, sql, params, (time.perf_counter() - started) * 1000.0)
 		return rows
 	finally:
 		conn.close()
+		DB_QUERY_SECONDS.labels(_query_label(sql)).observe(time.perf_counter() - started)
+
+
+def next_month(month: str) -> str:
+	"""'2025-12' -> '2026-01'."""
+	year, mon = int(month[:4]), int(month[5:7])
+	return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+
+def partition_uri(file: str) -> str:
+	# immutable=1: a sealed file never changes, so SQLite skips locking and change checks
+	return pathlib.Path(PARTITION_DIR, file).resolve().as_uri() + "?mode=ro&immutable=1"
+
+
+def sealed_partitions(conn: sqlite3.Connection, start: Optional[str] = None, end: Optional[str] = None) -> List[Row]:
+	"""Registered, not dropped, partitions holding rows in [start, end], oldest first."""
+	try:
+		return conn.execute(
+			"""
+			SELECT * FROM pool_partitions
+			WHERE dropped_at IS NULL AND last_ts >= ? AND first_ts <= ?
+			ORDER BY month
+			""",
+			(start or "", end or "~"),
+		).fetchall()
+	except sqlite3.OperationalError:
+		return []  # not migrated yet
+
+
+def hot_floor(conn: sqlite3.Connection) -> Optional[str]:
+	"""First month the live pool_snapshots table answers for; older months are partitions."""
+	try:
+		month = conn.execute("SELECT MAX(month) FROM pool_partitions").fetchone()[0]
+	except sqlite3.OperationalError:
+		return None
+	return next_month(month) if month else None
+
+
+def pool_snapshot_sources(conn: sqlite3.Connection, start: Optional[str] = None,
+		end: Optional[str] = None) -> Iterator[Tuple[str, bool]]:
+	"""Route a pool_snapshots read over [start, end] to the stores that hold those rows.
+
+	Yields (table, sealed) oldest first: each overlapping sealed partition, attached
+	read-only as `sealed` while the caller works on it, then the live table limited to
+	the months not sealed yet. A database without partitions yields the live table
+	alone. A partition whose file is missing is skipped with a warning. ATTACH cannot
+	run inside a transaction, and every statement on a partition must be finished
+	before the loop moves on.
+	"""
+	floor = hot_floor(conn)
+	for part in sealed_partitions(conn, start, end):
+		if not os.path.exists(os.path.join(PARTITION_DIR, part["file"])):
+			logger.warning(f"pool_snapshots partition {part['month']} is missing its file {part['file']}; skipped")
+			continue
+		conn.execute("ATTACH DATABASE ? AS sealed", (partition_uri(part["file"]),))
+		try:
+			yield "sealed.pool_snapshots", True
+		finally:
+			conn.execute("DETACH DATABASE sealed")
+	if floor is None:
+		yield "pool_snapshots", False
+	elif end is None or end >= floor:
+		# Rows of a month just sealed stay until app.partitions has deleted them
+		yield f"(SELECT * FROM main.pool_snapshots WHERE ts_utc >= '{floor}')", False
+
+
+def q_routed(sql: str, params: Sequence[Any] = (), start: Optional[str] = None, end: Optional[str] = None,
+		sealed_sql: Optional[str] = None) -> List[Row]:
+	"""q() over every store pool_snapshot_sources() picks for [start, end], results concatenated.
+
+	`sql` names the table `{pool_snapshots}`. `sealed_sql` replaces it on partitions,
+	where the immutable per-pool daily rollup `sealed.pool_daily` can be read instead.
+	Only for queries whose groups never span two months.
+	"""
+	started = time.perf_counter()
+	conn = _connect()
+	try:
+		rows: List[Row] = []
+		for table, sealed in pool_snapshot_sources(conn, start, end):
+			rows += conn.execute(((sealed and sealed_sql) or sql).replace("{pool_snapshots}", table), params).fetchall()
+		return rows
+	finally:
+		conn.close()
+		DB_QUERY_SECONDS.labels(_query_label(sql.replace("{pool_snapshots}", "pool_snapshots"))).observe(time.perf_counter() - started)
+
+
+def partition_totals(conn: sqlite3.Connection, asset_key: str) -> Dict[str, float]:
+	"""Rows and fee/volume sums of one asset across every partition, dropped ones included."""
+	totals = {"rows": 0, "fee_24h_usd": 0.0, "volume_24h_usd": 0.0}
+	try:
+		stats = conn.execute("SELECT stats FROM pool_partitions").fetchall()
+	except sqlite3.OperationalError:
+		return totals
+	for (blob,) in stats:
+		asset = json.loads(blob or "{}").get("assets", {}).get(asset_key)
+		if asset:
+			for key in totals:
+				totals[key] += asset[key]
+	return totals
+
+
+def _table_exists(cur: sqlite3.Cursor, table: str) -> bool:
+	return cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
 
 
 def _col_exists(cur: sqlite3.Cursor, table: str, col: str) -> bool:
@@ -31,26 +186,133 @@ def _col_exists(cur: sqlite3.Cursor, table: str, col: str) -> bool:
 	return any(r[1] == col for r in cur.fetchall())
 
 
+def write_composition(cur: sqlite3.Cursor, ts_utc: Optional[str] = None, asset_key: Optional[str] = None) -> None:
+	"""Aggregate pool_snapshots into composition_snapshots for one snapshot (or all of them).
+
+	One row per asset and quote asset: summed units across its pools, value-weighted
+	price, USD value and share of the snapshot's total quote value.
+	"""
+	filters, params = [], []
+	if ts_utc:
+		filters.append("ts_utc = ?")
+		params.append(ts_utc)
+	if asset_key:
+		filters.append("asset_key = ?")
+		params.append(asset_key)
+	cur.execute(
+		f"""
+		INSERT OR REPLACE INTO composition_snapshots
+		(asset_key, ts_utc, quote_symbol, units, price_usd, value_usd, percentage, pool_count)
+		SELECT asset_key, ts_utc, quote_symbol, units, value / units, value,
+		       100.0 * value / SUM(value) OVER (PARTITION BY asset_key, ts_utc), pool_count
+		FROM (
+		  SELECT asset_key, ts_utc, quote_symbol,
+		         SUM(quote_units) AS units,
+		         SUM(quote_units * quote_price_usd) AS value,
+		         COUNT(*) AS pool_count
+		  FROM pool_snapshots
+		  WHERE quote_units > 0 AND quote_price_usd > 0 {"".join(" AND " + f for f in filters)}
+		  GROUP BY asset_key, ts_utc, quote_symbol
+		)
+		""",
+		params,
+	)
+
+
+def _needs_rekey(cur: sqlite3.Cursor, table: str) -> bool:
+	"""True if `table` exists and asset_key is not part of its primary key."""
+	if not _table_exists(cur, table):
+		return False
+	cur.execute(f"PRAGMA table_info({table});")
+	return not any(r[1] == "asset_key" and r[5] > 0 for r in cur.fetchall())
+
+
+def _rekey_by_asset(cur: sqlite3.Cursor, table: str, ddl: str) -> None:
+	"""Create `table` from `ddl`, rebuilding a pre-existing table whose key lacks asset_key.
+
+	SQLite cannot change a primary key in place, so old rows are copied into the new
+	layout, keeping their asset_key or tagged with DEFAULT_ASSET_KEY if they have none.
+	"""
+	if not _needs_rekey(cur, table):
+		cur.execute(ddl)
+		return
+	cur.execute(f"PRAGMA table_info({table});")
+	old_cols = [r[1] for r in cur.fetchall()]
+	cur.execute("BEGIN IMMEDIATE")
+	try:
+		cur.execute(f"ALTER TABLE {table} RENAME TO {table}_pre_asset;")
+		cur.execute(ddl)
+		cur.execute(f"PRAGMA table_info({table});")
+		new_cols = {r[1] for r in cur.fetchall()}
+		cols = ", ".join(c for c in old_cols if c in new_cols)
+		if "asset_key" in old_cols:
+			cur.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {table}_pre_asset;")
+		else:
+			cur.execute(f"INSERT INTO {table} (asset_key, {cols}) SELECT ?, {cols} FROM {table}_pre_asset;", (DEFAULT_ASSET_KEY,))
+		cur.execute(f"DROP TABLE {table}_pre_asset;")
+		cur.execute("COMMIT")
+	except Exception:
+		cur.execute("ROLLBACK")
+		raise
+
+
+def _init_page_layout(cur: sqlite3.Cursor) -> None:
+	"""Give a database with no tables yet the profile's page size and incremental auto-vacuum.
+
+	Both are fixed once the first table exists; app.maintenance can rebuild an
+	existing database to change them.
+	"""
+	if cur.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+		return
+	cur.execute("PRAGMA journal_mode=DELETE;")
+	cur.execute(f"PRAGMA page_size={DB_PROFILE['page_size']};")
+	cur.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+	cur.execute("VACUUM;")
+	cur.execute("PRAGMA journal_mode=WAL;")
+
+
 def migrate() -> None:
 	"""Create tables if missing and add required columns/views idempotently."""
 	conn = _connect()
 	try:
 		cur = conn.cursor()
+		_init_page_layout(cur)
 
-		# Base summary snapshots
+		# Tracked reserve-backed tokens (see core/assets.py)
 		cur.execute(
 			"""
+			CREATE TABLE IF NOT EXISTS assets (
+			  asset_key TEXT PRIMARY KEY,
+			  mint TEXT NOT NULL,
+			  symbol TEXT,
+			  reserve_wallets TEXT,
+			  enabled INTEGER NOT NULL DEFAULT 1,
+			  created_at REAL
+			);
+			"""
+		)
+
+		# Base summary snapshots, one row per asset and snapshot
+		_rekey_by_asset(
+			cur,
+			"metrics_snapshots",
+			f"""
 			CREATE TABLE IF NOT EXISTS metrics_snapshots (
-			  ts_utc TEXT PRIMARY KEY,
+			  asset_key TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}',
+			  ts_utc TEXT NOT NULL,
 			  price_usd REAL,
 			  fdv_usd REAL,
 			  market_cap_usd REAL,
 			  circulating_supply REAL,
 			  real_tvl_total_usd REAL,
 			  volume_24h_usd REAL,
-			  collateralization_ratio REAL
+			  collateralization_ratio REAL,
+			  real_yield_daily REAL,
+			  apy_simple REAL,
+			  apy_compound REAL,
+			  PRIMARY KEY (asset_key, ts_utc)
 			);
-			"""
+			""",
 		)
 		# Add APY fields to metrics_snapshots
 		if not _col_exists(cur, "metrics_snapshots", "real_yield_daily"):
@@ -60,9 +322,15 @@ def migrate() -> None:
 		if not _col_exists(cur, "metrics_snapshots", "apy_compound"):
 			cur.execute("ALTER TABLE metrics_snapshots ADD COLUMN apy_compound REAL;")
 
-		# Per-pool snapshots
-		cur.execute(
-			"""
+		# Per-pool snapshots. A pool can back several assets, so asset_key is part of the
+		# key; it comes last so keyset scans in (ts_utc, pool_address) order stay on the key
+		if _needs_rekey(cur, "pool_snapshots"):
+			# The rebuild renames the table, which would retarget the view at the old copy
+			cur.execute("DROP VIEW IF EXISTS v_pool_apy_daily;")
+		_rekey_by_asset(
+			cur,
+			"pool_snapshots",
+			f"""
 			CREATE TABLE IF NOT EXISTS pool_snapshots (
 			  ts_utc TEXT,
 			  pool_address TEXT,
@@ -74,9 +342,22 @@ def migrate() -> None:
 			  volume_24h_usd REAL,
 			  fee_rate REAL,
 			  protocol_cut REAL,
-			  PRIMARY KEY (ts_utc, pool_address)
+			  daily_yield REAL,
+			  apy_simple REAL,
+			  apy_compound REAL,
+			  gross_fee_24h_usd REAL,
+			  protocol_fee_24h_usd REAL,
+			  fee_24h_usd REAL,
+			  source TEXT,
+			  interval_fee_usd REAL,
+			  all_time_fees_usd REAL,
+			  quote_price_usd REAL,
+			  quote_units REAL,
+			  fee_policy_version INTEGER,
+			  asset_key TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}',
+			  PRIMARY KEY (ts_utc, pool_address, asset_key)
 			);
-			"""
+			""",
 		)
 		# Add new columns on pool_snapshots
 		for col, decl in [
@@ -89,49 +370,299 @@ def migrate() -> None:
 			("source", "TEXT"),
 			("interval_fee_usd", "REAL"),  # 30m incremental fees
 			("all_time_fees_usd", "REAL"),  # Cumulative fees
+			("quote_price_usd", "REAL"),
+			("quote_units", "REAL"),
+			("fee_policy_version", "INTEGER"),
+			("asset_key", f"TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}'"),
 		]:
 			if not _col_exists(cur, "pool_snapshots", col):
 				cur.execute(f"ALTER TABLE pool_snapshots ADD COLUMN {col} {decl};")
 
 		# Pools state for 24h pointer
+		_rekey_by_asset(
+			cur,
+			"pools_state",
+			f"""
+			CREATE TABLE IF NOT EXISTS pools_state (
+			  asset_key TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}',
+			  pool_address TEXT NOT NULL,
+			  last_volume_24h_usd REAL,
+			  PRIMARY KEY (asset_key, pool_address)
+			);
+			""",
+		)
+
+		# Families all-time counters
+		_rekey_by_asset(
+			cur,
+			"family_totals",
+			f"""
+			CREATE TABLE IF NOT EXISTS family_totals (
+			  asset_key TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}',
+			  family TEXT NOT NULL,
+			  all_time_volume_usd REAL,
+			  all_time_fees_usd REAL,
+			  PRIMARY KEY (asset_key, family)
+			);
+			""",
+		)
+
+		# Scheduler leadership lease (one collector per deployment)
 		cur.execute(
 			"""
-			CREATE TABLE IF NOT EXISTS pools_state (
-			  pool_address TEXT PRIMARY KEY,
-			  last_volume_24h_usd REAL
+			CREATE TABLE IF NOT EXISTS scheduler_lease (
+			  name TEXT PRIMARY KEY,
+			  holder TEXT,
+			  acquired_at REAL,
+			  heartbeat_at REAL,
+			  expires_at REAL
 			);
 			"""
 		)
 
-		# Families all-time counters
+		# Last run of each database maintenance task (see app/maintenance.py)
 		cur.execute(
 			"""
-			CREATE TABLE IF NOT EXISTS family_totals (
-			  family TEXT PRIMARY KEY,
-			  all_time_volume_usd REAL,
-			  all_time_fees_usd REAL
+			CREATE TABLE IF NOT EXISTS maintenance_log (
+			  task TEXT PRIMARY KEY,
+			  last_run_at REAL,
+			  last_seconds REAL,
+			  last_result TEXT
+			);
+			"""
+		)
+
+		# Sealed pool_snapshots months (app/partitions.py). `stats` holds what the month
+		# adds to all-time figures, and so outlives the file when a partition is dropped
+		cur.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS pool_partitions (
+			  month TEXT PRIMARY KEY,
+			  file TEXT NOT NULL,
+			  first_ts TEXT,
+			  last_ts TEXT,
+			  rows INTEGER,
+			  sha256 TEXT,
+			  stats TEXT,
+			  sealed_at REAL,
+			  dropped_at REAL
 			);
 			"""
 		)
 
-		# View: daily APY rollup
+		# Last payload of each snapshot collector per asset (multi-cadence reuse)
+		_rekey_by_asset(
+			cur,
+			"collector_cache",
+			f"""
+			CREATE TABLE IF NOT EXISTS collector_cache (
+			  asset_key TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}',
+			  name TEXT NOT NULL,
+			  fetched_at REAL,
+			  payload TEXT,
+			  PRIMARY KEY (asset_key, name)
+			);
+			""",
+		)
+
+		# Versioned fee policy (see core/fee_policy.py)
+		cur.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS fee_policies (
+			  version INTEGER PRIMARY KEY,
+			  effective_from TEXT NOT NULL,
+			  default_fee_rate REAL NOT NULL,
+			  usdc_fee_rate REAL NOT NULL,
+			  meteora_protocol_cut REAL NOT NULL,
+			  note TEXT,
+			  created_at REAL
+			);
+			"""
+		)
+
+		# Progress of resumable bulk fee recomputes (scripts/recompute_fees.py)
+		cur.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS fee_recompute_jobs (
+			  job_id TEXT PRIMARY KEY,
+			  status TEXT,
+			  phase TEXT,
+			  cursor_ts TEXT,
+			  cursor_pool TEXT,
+			  cursor_asset TEXT,
+			  rows_done INTEGER,
+			  state TEXT,
+			  started_at REAL,
+			  updated_at REAL
+			);
+			"""
+		)
+		if not _col_exists(cur, "fee_recompute_jobs", "cursor_asset"):
+			cur.execute("ALTER TABLE fee_recompute_jobs ADD COLUMN cursor_asset TEXT;")
+
+		# Known markets of each asset and their static attributes (see core/market_registry.py)
+		_rekey_by_asset(
+			cur,
+			"market_registry",
+			f"""
+			CREATE TABLE IF NOT EXISTS market_registry (
+			  asset_key TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}',
+			  pool_address TEXT NOT NULL,
+			  name TEXT,
+			  source TEXT,
+			  base_mint TEXT,
+			  base_symbol TEXT,
+			  quote_mint TEXT,
+			  quote_symbol TEXT,
+			  liquidity_rank INTEGER,
+			  active INTEGER NOT NULL DEFAULT 1,
+			  first_seen REAL,
+			  last_discovered REAL,
+			  token_a_mint TEXT,
+			  token_b_mint TEXT,
+			  token_a_vault TEXT,
+			  token_b_vault TEXT,
+			  token_a_decimals INTEGER,
+			  token_b_decimals INTEGER,
+			  PRIMARY KEY (asset_key, pool_address)
+			);
+			""",
+		)
+		# Pool token accounts, learned from the Meteora API, for on-chain reserve reads
+		for col, decl in [
+			("token_a_mint", "TEXT"),
+			("token_b_mint", "TEXT"),
+			("token_a_vault", "TEXT"),
+			("token_b_vault", "TEXT"),
+			("token_a_decimals", "INTEGER"),
+			("token_b_decimals", "INTEGER"),
+			("asset_key", f"TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}'"),
+		]:
+			if not _col_exists(cur, "market_registry", col):
+				cur.execute(f"ALTER TABLE market_registry ADD COLUMN {col} {decl};")
+
+		# Two-phase snapshot runs and their staged data (see core/staging.py)
+		cur.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS snapshot_runs (
+			  run_id TEXT PRIMARY KEY,
+			  status TEXT NOT NULL,
+			  ts_utc TEXT,
+			  summary TEXT,
+			  error TEXT,
+			  started_at REAL,
+			  updated_at REAL
+			);
+			"""
+		)
+		if not _col_exists(cur, "snapshot_runs", "asset_key"):
+			cur.execute(f"ALTER TABLE snapshot_runs ADD COLUMN asset_key TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}';")
+		# Process working on an unfinished run; it heartbeats updated_at (see core/staging.py)
+		if not _col_exists(cur, "snapshot_runs", "owner"):
+			cur.execute("ALTER TABLE snapshot_runs ADD COLUMN owner TEXT;")
+		cur.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS snapshot_staging (
+			  run_id TEXT NOT NULL,
+			  collector TEXT NOT NULL,
+			  staged_at REAL,
+			  payload TEXT,
+			  PRIMARY KEY (run_id, collector)
+			);
+			"""
+		)
+		cur.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS snapshot_staging_pools (
+			  run_id TEXT NOT NULL,
+			  pool_address TEXT NOT NULL,
+			  family TEXT,
+			  base_symbol TEXT,
+			  quote_symbol TEXT,
+			  liquidity_usd REAL,
+			  real_tvl_usd REAL,
+			  volume_24h_usd REAL,
+			  fee_rate REAL,
+			  protocol_cut REAL,
+			  source TEXT,
+			  gross_fee_24h_usd REAL,
+			  protocol_fee_24h_usd REAL,
+			  fee_24h_usd REAL,
+			  daily_yield REAL,
+			  apy_simple REAL,
+			  apy_compound REAL,
+			  quote_price_usd REAL,
+			  quote_units REAL,
+			  fee_policy_version INTEGER,
+			  PRIMARY KEY (run_id, pool_address)
+			);
+			"""
+		)
+
+		# Portfolio composition per snapshot, one row per quote asset (see write_composition).
+		# A database that predates the table is backfilled in the transaction creating it,
+		# so the backfill runs exactly once
+		backfill_composition = not _table_exists(cur, "composition_snapshots")
+		if backfill_composition:
+			cur.execute("BEGIN IMMEDIATE")
+		_rekey_by_asset(
+			cur,
+			"composition_snapshots",
+			f"""
+			CREATE TABLE IF NOT EXISTS composition_snapshots (
+			  asset_key TEXT NOT NULL DEFAULT '{DEFAULT_ASSET_KEY}',
+			  ts_utc TEXT NOT NULL,
+			  quote_symbol TEXT NOT NULL,
+			  units REAL,
+			  price_usd REAL,
+			  value_usd REAL,
+			  percentage REAL,
+			  pool_count INTEGER,
+			  PRIMARY KEY (asset_key, ts_utc, quote_symbol)
+			);
+			""",
+		)
+		if backfill_composition:
+			write_composition(cur)
+			cur.execute("COMMIT")
+
+		# View: daily APY rollup (recreated when it predates asset_key)
+		if not _col_exists(cur, "v_pool_apy_daily", "asset_key"):
+			cur.execute("DROP VIEW IF EXISTS v_pool_apy_daily;")
 		cur.execute(
 			"""
 			CREATE VIEW IF NOT EXISTS v_pool_apy_daily AS
-			SELECT date(substr(ts_utc,1,19)) AS day,
+			SELECT asset_key,
+			       date(substr(ts_utc,1,19)) AS day,
 			       pool_address,
 			       family,
 			       AVG(daily_yield)   AS daily_yield_avg,
 			       AVG(apy_simple)    AS apy_simple_avg,
 			       AVG(apy_compound)  AS apy_compound_avg
 			FROM pool_snapshots
-			GROUP BY day, pool_address, family;
+			GROUP BY day, pool_address, family, asset_key;
 			"""
 		)
 
 		# Indexes
 		cur.execute("CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics_snapshots(ts_utc);")
 		cur.execute("CREATE INDEX IF NOT EXISTS idx_pool_ts_addr_family ON pool_snapshots(ts_utc, pool_address, family);")
+		# Covering index for per-pool history: range scans by pool and asset without table lookups.
+		# asset_key was added once a pool could back two assets.
+		if "asset_key" not in [r[2] for r in cur.execute("PRAGMA index_info(idx_pool_addr_ts)")]:
+			cur.execute("DROP INDEX IF EXISTS idx_pool_addr_ts;")
+		cur.execute(
+			"""
+			CREATE INDEX IF NOT EXISTS idx_pool_addr_ts
+			ON pool_snapshots(pool_address, asset_key, ts_utc, real_tvl_usd, volume_24h_usd, fee_24h_usd, daily_yield, quote_units);
+			"""
+		)
+
+		# Per-asset latest-snapshot lookups and all-time fee/volume sums, answered from the index
+		cur.execute("CREATE INDEX IF NOT EXISTS idx_pool_asset_ts ON pool_snapshots(asset_key, ts_utc, fee_24h_usd, volume_24h_usd);")
+		cur.execute("DROP INDEX IF EXISTS idx_snapshot_runs_status;")
+		cur.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_runs_asset_status ON snapshot_runs(asset_key, status, started_at);")
+		cur.execute("CREATE INDEX IF NOT EXISTS idx_composition_asset_symbol_ts ON composition_snapshots(asset_key, quote_symbol, ts_utc);")
 
 		conn.commit()
 	finally:
@@ -0,0 +1,139 @@
+"""
+Scheduler leadership via a lease row in the SQLite database.
+Every process that wants to collect competes for the same lease; only the
+holder runs snapshots, and a lease that stops heartbeating expires so another
+process can take over.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from app.db import _connect
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "auto_refresh"
+LEASE_TTL_SECONDS = int(os.getenv("ASRSV_LEASE_TTL_SECONDS", "90"))
+
+
+class SchedulerLease:
+	"""A named, expiring lease stored in the scheduler_lease table."""
+
+	def __init__(self, name: str = LEASE_NAME, ttl_seconds: int = LEASE_TTL_SECONDS) -> None:
+		self.name = name
+		self.ttl = ttl_seconds
+		self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+		self.is_leader = False
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		self._heartbeat: Optional[threading.Thread] = None
+
+	def acquire(self) -> bool:
+		"""Take the lease if it is free or expired, or renew it if we already hold it."""
+		with self._lock:
+			now = time.time()
+			conn = _connect()
+			try:
+				conn.execute("BEGIN IMMEDIATE")
+				row = conn.execute(
+					"SELECT holder, expires_at FROM scheduler_lease WHERE name = ?",
+					(self.name,),
+				).fetchone()
+				if row is None or row["holder"] == self.holder or (row["expires_at"] or 0) < now:
+					conn.execute(
+						"""
+						INSERT INTO scheduler_lease (name, holder, acquired_at, heartbeat_at, expires_at)
+						VALUES (?, ?, ?, ?, ?)
+						ON CONFLICT(name) DO UPDATE SET
+						  holder = excluded.holder,
+						  acquired_at = CASE WHEN scheduler_lease.holder = excluded.holder
+						                     THEN scheduler_lease.acquired_at ELSE excluded.acquired_at END,
+						  heartbeat_at = excluded.heartbeat_at,
+						  expires_at = excluded.expires_at
+						""",
+						(self.name, self.holder, now, now, now + self.ttl),
+					)
+					leader = True
+				else:
+					leader = False
+				conn.execute("COMMIT")
+			except sqlite3.Error as e:
+				try:
+					conn.execute("ROLLBACK")
+				except sqlite3.Error:
+					pass
+				logger.warning(f"Lease acquire failed: {e}")
+				leader = False
+			finally:
+				conn.close()
+
+			if leader and not self.is_leader:
+				logger.info(f"Acquired scheduler lease '{self.name}' as {self.holder}")
+			elif self.is_leader and not leader:
+				logger.warning(f"Lost scheduler lease '{self.name}'")
+			self.is_leader = leader
+			return leader
+
+	def release(self) -> None:
+		"""Give up the lease so a follower can take over immediately."""
+		with self._lock:
+			conn = _connect()
+			try:
+				conn.execute(
+					"DELETE FROM scheduler_lease WHERE name = ? AND holder = ?",
+					(self.name, self.holder),
+				)
+			except sqlite3.Error as e:
+				logger.warning(f"Lease release failed: {e}")
+			finally:
+				conn.close()
+			if self.is_leader:
+				logger.info(f"Released scheduler lease '{self.name}'")
+			self.is_leader = False
+
+	def start_heartbeat(self) -> None:
+		"""Renew (or try to take) the lease every ttl/3 seconds in a background thread."""
+		if self._heartbeat and self._heartbeat.is_alive():
+			return
+		self._stop.clear()
+		self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+		self._heartbeat.start()
+
+	def stop_heartbeat(self, release: bool = True) -> None:
+		self._stop.set()
+		if self._heartbeat:
+			self._heartbeat.join(timeout=5)
+		if release:
+			self.release()
+
+	def _heartbeat_loop(self) -> None:
+		while not self._stop.is_set():
+			self.acquire()
+			self._stop.wait(max(self.ttl / 3.0, 1.0))
+
+	def current_holder(self) -> Optional[Dict[str, Any]]:
+		"""Return the active lease row, or None when nobody holds a live lease."""
+		conn = _connect()
+		try:
+			row = conn.execute(
+				"SELECT holder, acquired_at, heartbeat_at, expires_at FROM scheduler_lease WHERE name = ?",
+				(self.name,),
+			).fetchone()
+		finally:
+			conn.close()
+		if row is None or (row["expires_at"] or 0) < time.time():
+			return None
+		return dict(row)
+
+	def __enter__(self):
+		if not self.acquire():
+			raise RuntimeError(f"scheduler lease '{self.name}' is held by another process")
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.release()
@@ -1,15 +1,22 @@
+import csv
+import io
+import json
 import os
+import time
+from typing import Any, Dict, Iterator, List, Literal, Optional
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
 # Load environment variables
 load_dotenv()
 
-from app.db import migrate, q
+from app.db import DEFAULT_ASSET_KEY, _connect, migrate, pool_snapshot_sources, q, q_routed
 from app.auto_refresh import start_auto_refresh, get_auto_refresh_status
+from app.metrics import HTTP_REQUEST_SECONDS, render_latest
+from app import analytics, dashboard, maintenance, profiling, publish
 # Removed complex fee accumulation - using simple approach
 
 app = FastAPI(title="ASSET Reserve Dashboard")
@@ -26,230 +33,362 @@ os.makedirs(templates_dir, exist_ok=True)
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 templates = Jinja2Templates(directory=templates_dir)
 
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+	"""Per-route latency histogram, labelled by the route template rather than the raw path."""
+	started = time.perf_counter()
+	status = "500"
+	try:
+		response = await call_next(request)
+		status = str(response.status_code)
+		return response
+	finally:
+		route = request.scope.get("route")
+		HTTP_REQUEST_SECONDS.labels(
+			request.method, getattr(route, "path", "unmatched"), status
+		).observe(time.perf_counter() - started)
+
+
+@app.middleware("http")
+async def profile_slow_requests(request: Request, call_next):
+	"""Sample routes listed in ASRSV_PROFILE_ROUTES while profiling is enabled."""
+	if not profiling.route_enabled(request.url.path):
+		return await call_next(request)
+	with profiling.profile(f"route{request.url.path}", profiling.get_config()["route_threshold_ms"]):
+		return await call_next(request)
+
 # Ensure migrations at startup
 migrate()
 
-# Start auto-refresh for VPS deployment (8 hour intervals)
-start_auto_refresh(interval_minutes=480)
+# Start auto-refresh for VPS deployment (8 hour intervals); ASRSV_AUTO_REFRESH=0 disables it
+if os.getenv("ASRSV_AUTO_REFRESH", "1") != "0":
+	start_auto_refresh(interval_minutes=480)
 
+# Background ANALYZE/checkpoint/vacuum; ASRSV_MAINTENANCE=0 disables it
+if os.getenv("ASRSV_MAINTENANCE", "1") != "0":
+	maintenance.maintenance_scheduler.start()
 
-def _latest_metrics():
-	rows = q("""
-		SELECT ts_utc, price_usd, fdv_usd, market_cap_usd, circulating_supply, 
-		       real_tvl_total_usd, volume_24h_usd, real_yield_daily, apy_simple, apy_compound
-		FROM metrics_snapshots 
-		ORDER BY ts_utc DESC LIMIT 1
-	""")
-	if rows:
-		# Convert Row object to regular dict for template compatibility
-		row = rows[0]
-		return {
-			'ts_utc': row['ts_utc'],
-			'price_usd': row['price_usd'],
-			'fdv_usd': row['fdv_usd'],
-			'market_cap_usd': row['market_cap_usd'],
-			'circulating_supply': row['circulating_supply'],
-			'real_tvl_total_usd': row['real_tvl_total_usd'],
-			'volume_24h_usd': row['volume_24h_usd'],
-			'real_yield_daily': row['real_yield_daily'],
-			'apy_simple': row['apy_simple'],
-			'apy_compound': row['apy_compound']
-		}
-	return None
 
+def _latest_metrics(asset: str = DEFAULT_ASSET_KEY):
+	return dashboard.latest_metrics(asset)
 
-def _pools_for_ts(ts_utc: str):
-	return q(
-		"""
-		SELECT family, source, quote_symbol, real_tvl_usd, volume_24h_usd,
-		       fee_24h_usd, daily_yield, apy_simple, quote_units
-		FROM pool_snapshots
-		WHERE ts_utc = ?
-		ORDER BY apy_simple DESC
-		""",
-		(ts_utc,),
-	)
 
+def _pools_for_ts(ts_utc: str, asset: str = DEFAULT_ASSET_KEY):
+	return dashboard.pools_for_ts(ts_utc, asset)
 
-def _get_fee_metrics():
-	"""Get simple fee metrics: 8hr = 24h/3, all-time = sum of all 8hr fees"""
-	# Get latest 24h fees
-	latest_24h = q("""
-		SELECT COALESCE(SUM(fee_24h_usd), 0) as total_24h_fees
-		FROM pool_snapshots
-		WHERE ts_utc = (SELECT MAX(ts_utc) FROM pool_snapshots)
-	""")
-	
-	latest_24h_fees = latest_24h[0]['total_24h_fees'] if latest_24h else 0.0
-	fees_8hr = latest_24h_fees / 3.0  # Simple: 8hr = 24h / 3
-	
-	# Get all-time fees (sum of all 8hr fees)
-	all_time = q("""
-		SELECT COALESCE(SUM(fee_24h_usd / 3.0), 0) as all_time_fees
-		FROM pool_snapshots
-	""")
-	
-	all_time_fees = all_time[0]['all_time_fees'] if all_time else 0.0
-	
-	return {
-		'latest_8hr_fees': fees_8hr,
-		'latest_24h_fees': latest_24h_fees,
-		'all_time_fees': all_time_fees
-	}
 
+def _get_fee_metrics(asset: str = DEFAULT_ASSET_KEY):
+	return dashboard.fee_metrics(asset)
 
-def _get_volume_metrics():
-	"""Get volume metrics: 8hr = 24h/3, all-time = sum of all 8hr volumes"""
-	# Get latest 24h volume
-	latest_24h = q("""
-		SELECT COALESCE(SUM(volume_24h_usd), 0) as total_24h_volume
-		FROM pool_snapshots
-		WHERE ts_utc = (SELECT MAX(ts_utc) FROM pool_snapshots)
-	""")
-	
-	latest_24h_volume = latest_24h[0]['total_24h_volume'] if latest_24h else 0.0
-	volume_8hr = latest_24h_volume / 3.0  # Simple: 8hr = 24h / 3
-	
-	# Get all-time volume (sum of all 8hr volumes)
-	all_time = q("""
-		SELECT COALESCE(SUM(volume_24h_usd / 3.0), 0) as all_time_volume
-		FROM pool_snapshots
-	""")
-	
-	all_time_volume = all_time[0]['all_time_volume'] if all_time else 0.0
-	
-	return {
-		'latest_8hr_volume': volume_8hr,
-		'latest_24h_volume': latest_24h_volume,
-		'all_time_volume': all_time_volume
-	}
+
+def _get_volume_metrics(asset: str = DEFAULT_ASSET_KEY):
+	return dashboard.volume_metrics(asset)
 
 
-def _history_summaries():
+def _history_summaries(asset: str = DEFAULT_ASSET_KEY):
 	# Daily totals from metrics
-	return q(
-		"""
-		SELECT date(substr(ts_utc,1,19)) AS day,
-		       SUM(COALESCE(volume_24h_usd,0)) AS vol_sum,
-		       SUM(0) AS fees_placeholder,
-		       AVG(COALESCE(real_yield_daily,0)) AS real_yield_avg,
-		       AVG(COALESCE(apy_simple,0)) AS apy_simple_avg
-		FROM metrics_snapshots
-		GROUP BY day
-		ORDER BY day
-		"""
-	)
+	return analytics.history_summaries(asset)
 
 
-def _history_pool_apy():
-	return q(
-		"""
-		SELECT day, AVG(apy_simple_avg) AS apy_avg
-		FROM v_pool_apy_daily
-		GROUP BY day
-		ORDER BY day
-		"""
-	)
+def _history_pool_apy(asset: str = DEFAULT_ASSET_KEY):
+	return analytics.history_pool_apy(asset)
 
 
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request):
+async def index(request: Request, asset: str = DEFAULT_ASSET_KEY):
 	"""Main dashboard page with working chart structure and real data"""
-	m = _latest_metrics()
-	if not m:
-		return templates.TemplateResponse(
-			"minimal-with-pools-table-test.html",
-			{"request": request, "summary": None, "pools": [], "fees_8hr": 0, "fees_24h": 0, "fees_all_time": 0, "volume_8hr": 0, "volume_24h": 0, "volume_all_time": 0, "liquidity_deployed": 0, "no_data": True},
-		)
-
-	pools = _pools_for_ts(m["ts_utc"]) if m else []
-	fee_metrics = _get_fee_metrics()
-	volume_metrics = _get_volume_metrics()
-	
-	# Calculate liquidity deployed (market cap + real TVL)
-	liquidity_deployed = (m.get('market_cap_usd', 0) or 0) + (m.get('real_tvl_total_usd', 0) or 0)
-	
-	return templates.TemplateResponse(
-		"minimal-with-pools-table-test.html",
-		{
-			"request": request, 
-			"summary": m, 
-			"pools": pools, 
-			"fees_8hr": fee_metrics['latest_8hr_fees'],
-			"fees_24h": fee_metrics['latest_24h_fees'],
-			"fees_all_time": fee_metrics['all_time_fees'],
-			"volume_8hr": volume_metrics['latest_8hr_volume'],
-			"volume_24h": volume_metrics['latest_24h_volume'],
-			"volume_all_time": volume_metrics['all_time_volume'],
-			"liquidity_deployed": liquidity_deployed,
-			"daily_yield": m['real_yield_daily'] if m and 'real_yield_daily' in m else 0,
-			"apy_simple": m['apy_simple'] if m and 'apy_simple' in m else 0,
-			"apy_compound": m['apy_compound'] if m and 'apy_compound' in m else 0,
-			"no_data": False
-		},
-	)
+	# nginx serves the published page itself; this covers deployments without it
+	page = publish.published_file(asset, publish.PAGE)
+	if page:
+		return FileResponse(page, media_type="text/html")
+	return templates.TemplateResponse(dashboard.DASHBOARD_TEMPLATE, {"request": request, **dashboard.dashboard_context(asset)})
 
 
 @app.get("/api/portfolio-composition")
-async def portfolio_composition():
+async def portfolio_composition(asset: str = DEFAULT_ASSET_KEY):
 	"""Get portfolio composition data for pie chart"""
-	rows = q("""
-		SELECT quote_symbol, quote_units, quote_price_usd
-		FROM pool_snapshots
-		WHERE ts_utc = (SELECT MAX(ts_utc) FROM pool_snapshots)
-		AND quote_units > 0 AND quote_price_usd > 0
-		ORDER BY (quote_units * quote_price_usd) DESC
-	""")
-	
-	composition = []
-	total_value = 0.0
-	
+	published = publish.published_file(asset, publish.PORTFOLIO_COMPOSITION)
+	if published:
+		return FileResponse(published, media_type="application/json")
+	return JSONResponse(dashboard.portfolio_composition_payload(asset))
+
+
+@app.get("/api/portfolio-composition/history")
+async def portfolio_composition_history(start: Optional[str] = None, end: Optional[str] = None,
+		symbol: Optional[str] = None, asset: str = DEFAULT_ASSET_KEY):
+	"""Per-quote-asset value and share of the portfolio for each snapshot in [start, end]"""
+	filters: List[str] = ["asset_key = ?"]
+	params: List[object] = [asset]
+	if symbol:
+		filters.append("quote_symbol = ?")
+		params.append(symbol)
+	if start:
+		filters.append("ts_utc >= ?")
+		params.append(start)
+	if end:
+		filters.append("ts_utc <= ?")
+		params.append(end)
+	rows = q(
+		f"""
+		SELECT ts_utc, quote_symbol, units, price_usd, value_usd, percentage, pool_count
+		FROM composition_snapshots
+		WHERE {" AND ".join(filters)}
+		ORDER BY ts_utc, value_usd DESC
+		""",
+		params,
+	)
+
+	timestamps: List[str] = []
+	series: Dict[str, Dict[str, List[Optional[float]]]] = {}
 	for row in rows:
-		value = row["quote_units"] * row["quote_price_usd"]
-		total_value += value
-		composition.append({
-			"symbol": row["quote_symbol"],
-			"units": row["quote_units"],
-			"price": row["quote_price_usd"],
-			"value": value
-		})
-	
-	# Calculate percentages
-	for item in composition:
-		item["percentage"] = (item["value"] / total_value * 100) if total_value > 0 else 0
-	
-	return JSONResponse({
-		"composition": composition,
-		"total_value": total_value
-	})
+		if not timestamps or timestamps[-1] != row["ts_utc"]:
+			timestamps.append(row["ts_utc"])
+		s = series.setdefault(row["quote_symbol"], {"units": [], "value": [], "percentage": []})
+		# Pad symbols that were absent from earlier snapshots so every list lines up with timestamps
+		for values in s.values():
+			values.extend([None] * (len(timestamps) - 1 - len(values)))
+		s["units"].append(row["units"])
+		s["value"].append(row["value_usd"])
+		s["percentage"].append(row["percentage"])
+	for s in series.values():
+		for values in s.values():
+			values.extend([None] * (len(timestamps) - len(values)))
+
+	return JSONResponse({"asset": asset, "timestamps": timestamps, "series": series})
 
 
 @app.get("/api/time-series")
-async def time_series():
+async def time_series(asset: str = DEFAULT_ASSET_KEY):
     """Get time series data for charts"""
-    rows = q("""
-        SELECT ts_utc, price_usd, market_cap_usd, volume_24h_usd, circulating_supply
-        FROM metrics_snapshots
-        ORDER BY ts_utc ASC
-        LIMIT 100
-    """)
-    
-    time_series_data = {
-        "timestamps": [],
-        "price": [],
-        "market_cap": [],
-        "volume_24h": [],
-        "circulating_supply": []
-    }
-    
-    for row in rows:
-        time_series_data["timestamps"].append(row["ts_utc"])
-        time_series_data["price"].append(row["price_usd"] or 0)
-        time_series_data["market_cap"].append(row["market_cap_usd"] or 0)
-        time_series_data["volume_24h"].append(row["volume_24h_usd"] or 0)
-        time_series_data["circulating_supply"].append(row["circulating_supply"] or 0)
-    
-    return JSONResponse(time_series_data)
+    published = publish.published_file(asset, publish.TIME_SERIES)
+    if published:
+        return FileResponse(published, media_type="application/json")
+    return JSONResponse(dashboard.time_series_payload(asset))
+
+
+EXPORT_COLUMNS = [
+	"ts_utc", "pool_address", "family", "source", "base_symbol", "quote_symbol",
+	"liquidity_usd", "real_tvl_usd", "volume_24h_usd", "fee_rate", "protocol_cut",
+	"gross_fee_24h_usd", "protocol_fee_24h_usd", "fee_24h_usd",
+	"daily_yield", "apy_simple", "apy_compound", "quote_price_usd", "quote_units", "fee_policy_version",
+	"asset_key",
+]
+EXPORT_BATCH_SIZE = 2000
+
+
+def _iter_pool_snapshots(pool: Optional[str], family: Optional[str], start: Optional[str], end: Optional[str],
+		after_ts: Optional[str], after_pool: Optional[str], limit: Optional[int],
+		asset: Optional[str] = None, after_asset: Optional[str] = None) -> Iterator[tuple]:
+	"""Yield pool_snapshots rows in (ts_utc, pool_address, asset_key) order.
+
+	Rows are read in keyset-paginated batches, each a short statement on its own
+	cursor, so an export never holds one long read transaction open against the WAL.
+	Months in sealed partitions are read from their files first.
+	"""
+	filters: List[str] = []
+	params: List[object] = []
+	if asset:
+		filters.append("asset_key = ?")
+		params.append(asset)
+	if pool:
+		filters.append("pool_address = ?")
+		params.append(pool)
+	if family:
+		filters.append("family = ?")
+		params.append(family)
+	if start:
+		filters.append("ts_utc >= ?")
+		params.append(start)
+	if end:
+		filters.append("ts_utc <= ?")
+		params.append(end)
+
+	cursor_ts, cursor_pool, cursor_asset = after_ts, after_pool or "", after_asset or ""
+	remaining = limit
+	conn = _connect()
+	try:
+		# Sources come oldest first, so the keyset cursor carries over from one to the next
+		lower = max(filter(None, (start, after_ts)), default=None)
+		for table, _ in pool_snapshot_sources(conn, lower, end):
+			while remaining is None or remaining > 0:
+				where = list(filters)
+				args = list(params)
+				if cursor_ts is not None:
+					where.append("(ts_utc > ? OR (ts_utc = ? AND (pool_address > ? OR (pool_address = ? AND asset_key > ?))))")
+					args += [cursor_ts, cursor_ts, cursor_pool, cursor_pool, cursor_asset]
+				batch = EXPORT_BATCH_SIZE if remaining is None else min(EXPORT_BATCH_SIZE, remaining)
+				cur = conn.execute(
+					f"""
+					SELECT {", ".join(EXPORT_COLUMNS)}
+					FROM {table}
+					{"WHERE " + " AND ".join(where) if where else ""}
+					ORDER BY ts_utc, pool_address, asset_key
+					LIMIT ?
+					""",
+					args + [batch],
+				)
+				n = 0
+				row = None
+				for row in cur:
+					n += 1
+					yield tuple(row)
+				if remaining is not None:
+					remaining -= n
+				if n < batch:
+					break
+				cursor_ts, cursor_pool, cursor_asset = row[0], row[1], row[-1]
+			if remaining is not None and remaining <= 0:
+				return
+	finally:
+		conn.close()
+
+
+def _ndjson_lines(rows: Iterator[tuple]) -> Iterator[str]:
+	for row in rows:
+		yield json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n"
+
+
+def _csv_lines(rows: Iterator[tuple]) -> Iterator[str]:
+	buf = io.StringIO()
+	writer = csv.writer(buf)
+	writer.writerow(EXPORT_COLUMNS)
+	yield buf.getvalue()
+	for row in rows:
+		buf.seek(0)
+		buf.truncate()
+		writer.writerow(row)
+		yield buf.getvalue()
+
+
+@app.get("/api/export/pool-snapshots")
+def export_pool_snapshots(format: Literal["ndjson", "csv"] = "ndjson", pool: Optional[str] = None,
+		family: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+		after_ts: Optional[str] = None, after_pool: Optional[str] = None, limit: Optional[int] = None,
+		asset: Optional[str] = None, after_asset: Optional[str] = None):
+	"""Stream raw pool_snapshots rows as NDJSON or CSV.
+
+	Filter by asset, pool, family and ts_utc range (start/end inclusive). To page, pass
+	the ts_utc, pool_address and asset_key of the last row received as
+	after_ts/after_pool/after_asset.
+	"""
+	rows = _iter_pool_snapshots(pool, family, start, end, after_ts, after_pool, limit, asset, after_asset)
+	if format == "csv":
+		body, media_type = _csv_lines(rows), "text/csv"
+	else:
+		body, media_type = _ndjson_lines(rows), "application/x-ndjson"
+	return StreamingResponse(
+		body,
+		media_type=media_type,
+		headers={"Content-Disposition": f'attachment; filename="pool_snapshots.{format}"'},
+	)
+
+POOL_HISTORY_COLUMNS = ["real_tvl_usd", "volume_24h_usd", "fee_24h_usd", "daily_yield", "quote_units"]
+
+
+def _pool_history(address: str, start: Optional[str], end: Optional[str],
+		bucket_seconds: Optional[int], max_points: int, asset: str = DEFAULT_ASSET_KEY) -> Dict[str, Any]:
+	"""One pool's metrics for one asset over [start, end], averaged into fixed-width time buckets.
+
+	With no explicit bucket, the width is chosen so at most max_points points come back;
+	if the range already has that few rows they are returned as-is. Every query here is
+	answered from idx_pool_addr_ts without touching the table, in the live table and in
+	each sealed partition the range overlaps (partitions sealed before asset_key joined
+	the index read it from the table).
+	"""
+	filters = ["pool_address = ?", "asset_key = ?"]
+	params: List[object] = [address, asset]
+	if start:
+		filters.append("ts_utc >= ?")
+		params.append(start)
+	if end:
+		filters.append("ts_utc <= ?")
+		params.append(end)
+	where = " AND ".join(filters)
+
+	spans = q_routed(
+		f"""
+		SELECT COUNT(*) AS n,
+		       CAST(strftime('%s', MIN(ts_utc)) AS INTEGER) AS first_s,
+		       CAST(strftime('%s', MAX(ts_utc)) AS INTEGER) AS last_s
+		FROM {{pool_snapshots}}
+		WHERE {where}
+		""",
+		params, start, end,
+	)
+	span = {
+		"n": sum(r["n"] for r in spans),
+		"first_s": min((r["first_s"] for r in spans if r["n"]), default=None),
+		"last_s": max((r["last_s"] for r in spans if r["n"]), default=None),
+	}
+	if bucket_seconds is None and span["n"] > max_points:
+		# Buckets are epoch-aligned, so a range can straddle one extra boundary
+		bucket_seconds = max(-(-(span["last_s"] - span["first_s"]) // max(max_points - 1, 1)), 1)
+
+	if not bucket_seconds:
+		rows = [dict(r) for r in q_routed(
+			f"""
+			SELECT ts_utc, {", ".join(POOL_HISTORY_COLUMNS)}, 1 AS samples
+			FROM {{pool_snapshots}}
+			WHERE {where}
+			ORDER BY ts_utc
+			""",
+			params, start, end,
+		)]
+	else:
+		rows = []
+		for r in q_routed(
+			f"""
+			SELECT strftime('%Y-%m-%dT%H:%M:%SZ', (CAST(strftime('%s', ts_utc) AS INTEGER) / ?) * ?, 'unixepoch') AS ts_utc,
+			       {", ".join(f"AVG({c}) AS {c}, COUNT({c}) AS {c}_n" for c in POOL_HISTORY_COLUMNS)},
+			       COUNT(*) AS samples
+			FROM {{pool_snapshots}}
+			WHERE {where}
+			GROUP BY CAST(strftime('%s', ts_utc) AS INTEGER) / ?
+			ORDER BY 1
+			""",
+			[bucket_seconds, bucket_seconds] + params + [bucket_seconds], start, end,
+		):
+			r = dict(r)
+			if rows and rows[-1]["ts_utc"] == r["ts_utc"]:
+				# A bucket that straddles a partition boundary comes back once per source
+				last = rows[-1]
+				for c in POOL_HISTORY_COLUMNS:
+					n = last[f"{c}_n"] + r[f"{c}_n"]
+					if n:
+						last[c] = ((last[c] or 0) * last[f"{c}_n"] + (r[c] or 0) * r[f"{c}_n"]) / n
+					last[f"{c}_n"] = n
+				last["samples"] += r["samples"]
+			else:
+				rows.append(r)
+		for r in rows:
+			for c in POOL_HISTORY_COLUMNS:
+				del r[f"{c}_n"]
+
+	return {
+		"pool_address": address,
+		"asset": asset,
+		"start": start,
+		"end": end,
+		"bucket_seconds": bucket_seconds or None,
+		"points": rows,
+	}
+
+
+@app.get("/api/pools/{address}/history")
+def pool_history(address: str, start: Optional[str] = None, end: Optional[str] = None,
+		bucket: Optional[int] = None, max_points: int = 500, asset: str = DEFAULT_ASSET_KEY):
+	"""TVL, volume, fees, daily yield and quote units for one pool of one asset over time.
+
+	`bucket` is the averaging window in seconds; without it the window is derived from
+	`max_points`. A pool backing two assets has separate rows, and history, per asset.
+	"""
+	if not q_routed("SELECT 1 FROM {pool_snapshots} WHERE pool_address = ? AND asset_key = ? LIMIT 1", (address, asset)):
+		return JSONResponse({"error": f"unknown pool {address} for asset {asset}"}, status_code=404)
+	if (bucket is not None and bucket <= 0) or max_points <= 0:
+		return JSONResponse({"error": "bucket and max_points must be positive"}, status_code=400)
+	return _pool_history(address, start, end, bucket, max_points, asset)
+
 
 @app.get("/test-main", response_class=HTMLResponse)
 async def test_main(request: Request):
@@ -378,29 +517,109 @@ async def working_copy_test(request: Request):
     return templates.TemplateResponse("minimal-with-pools-table-test.html", {"request": request})
 
 @app.get("/history", response_class=HTMLResponse)
-async def history(request: Request):
-	daily = _history_summaries()
-	pool_apy = _history_pool_apy()
+def history(request: Request, asset: str = DEFAULT_ASSET_KEY):
+	daily = _history_summaries(asset)
+	pool_apy = _history_pool_apy(asset)
 	return templates.TemplateResponse(
 		"history.html",
 		{"request": request, "daily": daily, "pool_apy": pool_apy},
 	)
 
+@app.get("/metrics")
+async def metrics():
+	"""Prometheus scrape endpoint"""
+	payload, content_type = render_latest()
+	return Response(payload, media_type=content_type)
+
+@app.get("/api/profiling")
+async def profiling_status():
+	"""Current profiling settings"""
+	return profiling.get_config()
+
+@app.post("/api/profiling")
+async def profiling_toggle(enabled: bool, snapshot_threshold_ms: Optional[int] = None,
+		route_threshold_ms: Optional[int] = None, slow_query_ms: Optional[int] = None,
+		routes: Optional[str] = None):
+	"""Enable/disable profiling and adjust thresholds at runtime"""
+	return profiling.configure(
+		enabled=enabled,
+		snapshot_threshold_ms=snapshot_threshold_ms,
+		route_threshold_ms=route_threshold_ms,
+		slow_query_ms=slow_query_ms,
+		routes=[r for r in routes.split(",") if r] if routes is not None else None,
+	)
+
+@app.get("/api/upstream-status")
+async def upstream_status():
+	"""Circuit breaker state per upstream provider (this process only)"""
+	from core.upstream import breaker_status
+	return breaker_status()
+
+@app.get("/api/db-report")
+async def db_report():
+	"""Database, WAL and free-page sizes, storage profile and maintenance state"""
+	return maintenance.report()
+
+@app.get("/api/analytics/status")
+async def analytics_status():
+	"""Analytics engine, archive watermarks and last refresh"""
+	return analytics.analytics_engine.status()
+
+@app.get("/api/analytics/families")
+def analytics_families(asset: str = DEFAULT_ASSET_KEY, bucket: Literal["day", "month"] = "day",
+		start: Optional[str] = None, end: Optional[str] = None):
+	"""Per-family average TVL, volume, fees and APY by day or month"""
+	return {"asset": asset, "bucket": bucket, "rows": analytics.family_rollup(asset, bucket, start, end)}
+
+@app.get("/api/analytics/apy-distribution")
+def analytics_apy_distribution(asset: str = DEFAULT_ASSET_KEY, start: Optional[str] = None, end: Optional[str] = None):
+	"""Per-family percentiles of pool simple APY"""
+	return {"asset": asset, "families": analytics.apy_distribution(asset, start, end)}
+
+@app.get("/api/analytics/reconcile")
+def analytics_reconcile(asset: str = DEFAULT_ASSET_KEY):
+	"""Stored all-time family totals against totals recomputed from history"""
+	return {"asset": asset, "families": analytics.reconcile_family_totals(asset)}
+
 @app.get("/api/auto-refresh-status")
 async def auto_refresh_status():
 	"""Get the status of the auto-refresh system"""
 	return get_auto_refresh_status()
 
+@app.get("/api/assets")
+async def assets():
+	"""Tracked assets and the time of each one's latest snapshot"""
+	from core.assets import load_assets
+	latest = {r["asset_key"]: r["ts"] for r in q("SELECT asset_key, MAX(ts_utc) AS ts FROM metrics_snapshots GROUP BY asset_key")}
+	return [
+		{
+			"asset_key": a["asset_key"],
+			"symbol": a["symbol"],
+			"mint": a["mint"],
+			"enabled": a["enabled"],
+			"latest_ts_utc": latest.get(a["asset_key"]),
+		}
+		for a in load_assets(enabled_only=False)
+	]
+
 @app.post("/api/trigger-snapshot")
-async def trigger_snapshot():
-	"""Manually trigger a snapshot"""
+async def trigger_snapshot(asset: Optional[str] = None):
+	"""Manually trigger a snapshot of one asset, or of every enabled asset"""
 	try:
-		from core.snapshot import snapshot_once
-		result = snapshot_once()
+		from core.snapshot import snapshot_all, snapshot_once
+		if asset:
+			result = snapshot_once(asset_key=asset)
+			return {
+				"success": True,
+				"timestamp": result.get("ts_utc"),
+				"message": "Snapshot completed successfully"
+			}
+		result = snapshot_all()
 		return {
-			"success": True,
-			"timestamp": result.get("ts_utc"),
-			"message": "Snapshot completed successfully"
+			"success": not result["errors"],
+			"timestamps": {key: res.get("ts_utc") for key, res in result["assets"].items()},
+			"errors": result["errors"],
+			"message": "Snapshot completed successfully" if not result["errors"] else "Snapshot failed for some assets"
 		}
 	except Exception as e:
 		return {
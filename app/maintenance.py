@@ -0,0 +1,369 @@
+"""
+Database maintenance.
+MaintenanceScheduler runs next to AutoRefreshManager. Every ASRSV_MAINT_CHECK_MINUTES it
+looks at the database's own numbers and runs the tasks that are due:
+  optimize    PRAGMA optimize, every ASRSV_MAINT_OPTIMIZE_HOURS
+  analyze     full ANALYZE once pool_snapshots has grown by ASRSV_MAINT_ANALYZE_GROWTH since
+              the last one, or app.db.q averaged over ASRSV_MAINT_SLOW_QUERY_MS since the last check
+              (at most every ASRSV_MAINT_ANALYZE_MIN_HOURS)
+  vacuum      incremental_vacuum once free pages add up to ASRSV_MAINT_FREELIST_MB
+  checkpoint  wal_checkpoint(TRUNCATE) once the WAL is over ASRSV_MAINT_WAL_MB
+  backup      online backup (app/backup.py) every ASRSV_BACKUP_HOURS, if set
+  partition   seal pool_snapshots months that left the hot window and drop partitions
+              past retention (app/partitions.py), when there are any
+One process at a time runs maintenance (lease 'maintenance', see app/leader.py).
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import backup, partitions
+from app.db import DB_PATH, DB_PROFILE, _connect
+from app.leader import SchedulerLease
+from app.metrics import DB_QUERY_SECONDS
+from app.writer import db_writer
+
+logger = logging.getLogger(__name__)
+
+MAINT_CHECK_MINUTES = float(os.getenv("ASRSV_MAINT_CHECK_MINUTES", "10"))
+MAINT_OPTIMIZE_HOURS = float(os.getenv("ASRSV_MAINT_OPTIMIZE_HOURS", "6"))
+MAINT_ANALYZE_GROWTH = float(os.getenv("ASRSV_MAINT_ANALYZE_GROWTH", "0.1"))
+MAINT_SLOW_QUERY_MS = float(os.getenv("ASRSV_MAINT_SLOW_QUERY_MS", "250"))
+# Least time between ANALYZE runs triggered by slow queries alone
+MAINT_ANALYZE_MIN_HOURS = float(os.getenv("ASRSV_MAINT_ANALYZE_MIN_HOURS", "6"))
+MAINT_WAL_MB = float(os.getenv("ASRSV_MAINT_WAL_MB", "64"))
+MAINT_FREELIST_MB = float(os.getenv("ASRSV_MAINT_FREELIST_MB", "32"))
+# Pages freed per writer transaction by the vacuum task
+MAINT_VACUUM_PAGES = int(os.getenv("ASRSV_MAINT_VACUUM_PAGES", "2000"))
+# 0 leaves backups to cron (scripts/backup.py)
+BACKUP_HOURS = float(os.getenv("ASRSV_BACKUP_HOURS", "0"))
+
+TASKS = ("optimize", "analyze", "vacuum", "checkpoint", "backup", "partition")
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+# Queries the latency trigger needs before it trusts an average
+_MIN_LATENCY_SAMPLES = 20
+
+
+def _file_size(path: str) -> int:
+	try:
+		return os.path.getsize(path)
+	except OSError:
+		return 0
+
+
+def _pragma(conn: sqlite3.Connection, name: str) -> Any:
+	return conn.execute(f"PRAGMA {name};").fetchone()[0]
+
+
+def db_stats() -> Dict[str, Any]:
+	"""File, WAL and free-page sizes of the database."""
+	conn = _connect()
+	try:
+		page_size = _pragma(conn, "page_size")
+		page_count = _pragma(conn, "page_count")
+		freelist = _pragma(conn, "freelist_count")
+		auto_vacuum = _pragma(conn, "auto_vacuum")
+		journal_mode = _pragma(conn, "journal_mode")
+		# Sealing deletes the oldest rows, so the live row count is the rowid span
+		pool_rows = conn.execute("SELECT COALESCE(MAX(rowid) - MIN(rowid) + 1, 0) FROM pool_snapshots").fetchone()[0]
+		analyzed = None
+		if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+			row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = 'pool_snapshots' LIMIT 1").fetchone()
+			analyzed = int(row[0].split()[0]) if row else None
+		partition_due = partitions.due_months(conn)
+		partition_expired = partitions.expired_months(conn)
+	finally:
+		conn.close()
+	return {
+		"path": DB_PATH,
+		"db_bytes": _file_size(DB_PATH),
+		"wal_bytes": _file_size(f"{DB_PATH}-wal"),
+		"page_size": page_size,
+		"page_count": page_count,
+		"freelist_pages": freelist,
+		"freelist_bytes": freelist * page_size,
+		"auto_vacuum": AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+		"journal_mode": journal_mode,
+		"pool_snapshot_rows": pool_rows,
+		"pool_snapshot_rows_at_analyze": analyzed,
+		"partition_months_due": partition_due,
+		"partition_months_expired": partition_expired,
+	}
+
+
+def _last_runs() -> Dict[str, Dict[str, Any]]:
+	conn = _connect()
+	try:
+		rows = conn.execute("SELECT task, last_run_at, last_seconds, last_result FROM maintenance_log").fetchall()
+	finally:
+		conn.close()
+	return {r["task"]: dict(r) for r in rows}
+
+
+def _log_run(conn: sqlite3.Connection, task: str, seconds: float, result: Dict[str, Any]) -> None:
+	conn.execute(
+		"""
+		INSERT INTO maintenance_log (task, last_run_at, last_seconds, last_result) VALUES (?, ?, ?, ?)
+		ON CONFLICT(task) DO UPDATE SET
+		  last_run_at = excluded.last_run_at, last_seconds = excluded.last_seconds, last_result = excluded.last_result
+		""",
+		(task, time.time(), seconds, json.dumps(result)),
+	)
+
+
+def run_optimize() -> Dict[str, Any]:
+	started = time.perf_counter()
+
+	def job(conn):
+		conn.execute("PRAGMA optimize;").fetchall()
+		_log_run(conn, "optimize", time.perf_counter() - started, {})
+		return {}
+
+	return db_writer.run(job)
+
+
+def run_analyze() -> Dict[str, Any]:
+	started = time.perf_counter()
+
+	def job(conn):
+		conn.execute("ANALYZE;")
+		_log_run(conn, "analyze", time.perf_counter() - started, {})
+		return {}
+
+	return db_writer.run(job)
+
+
+def run_checkpoint() -> Dict[str, Any]:
+	"""Checkpoint and truncate the WAL. Not a writer job: a checkpoint cannot run inside a transaction."""
+	started = time.perf_counter()
+	before = _file_size(f"{DB_PATH}-wal")
+	conn = _connect()
+	try:
+		busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+	finally:
+		conn.close()
+	result = {
+		"busy": bool(busy), "log_frames": log_frames, "checkpointed_frames": checkpointed,
+		"wal_bytes_before": before, "wal_bytes_after": _file_size(f"{DB_PATH}-wal"),
+	}
+	if busy:
+		# A reader still holds an old snapshot; the WAL is truncated at a later check
+		logger.warning(f"WAL checkpoint could not finish: {checkpointed}/{log_frames} frames")
+	db_writer.run(lambda c: _log_run(c, "checkpoint", time.perf_counter() - started, result))
+	return result
+
+
+def run_vacuum() -> Dict[str, Any]:
+	"""Return free pages to the filesystem, MAINT_VACUUM_PAGES per writer transaction."""
+	started = time.perf_counter()
+	stats = db_stats()
+	if stats["auto_vacuum"] != "incremental":
+		result = {"skipped": f"auto_vacuum is {stats['auto_vacuum']}; rebuild the database to enable incremental vacuum"}
+		db_writer.run(lambda c: _log_run(c, "vacuum", time.perf_counter() - started, result))
+		return result
+
+	def step(conn) -> bool:
+		# sqlite3 steps a statement once, and each step of incremental_vacuum frees one page
+		for _ in range(min(_pragma(conn, "freelist_count"), MAINT_VACUUM_PAGES)):
+			conn.execute("PRAGMA incremental_vacuum(1);")
+		return _pragma(conn, "freelist_count") > 0
+
+	chunks = db_writer.run_chunked(step)
+	# The file itself shrinks at the next checkpoint
+	result = {"chunks": chunks, "freed_bytes": stats["freelist_bytes"] - db_stats()["freelist_bytes"]}
+	db_writer.run(lambda c: _log_run(c, "vacuum", time.perf_counter() - started, result))
+	return result
+
+
+def rebuild() -> Dict[str, Any]:
+	"""VACUUM into the profile's page size with incremental auto-vacuum.
+
+	Rewrites the whole file and needs the database to itself; run it from the command
+	line (scripts/maintenance.py) with the service stopped.
+	"""
+	started = time.perf_counter()
+	before = _file_size(DB_PATH)
+	conn = _connect()
+	try:
+		conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+		conn.execute("PRAGMA journal_mode=DELETE;")
+		conn.execute(f"PRAGMA page_size={DB_PROFILE['page_size']};")
+		conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+		conn.execute("VACUUM;")
+		conn.execute("PRAGMA journal_mode=WAL;")
+		_log_run(conn, "rebuild", time.perf_counter() - started, {})
+	finally:
+		conn.close()
+	return {"db_bytes_before": before, "db_bytes_after": _file_size(DB_PATH), "seconds": time.perf_counter() - started}
+
+
+def run_backup() -> Dict[str, Any]:
+	started = time.perf_counter()
+	meta = backup.create_backup()
+	result = {"file": meta["file"], "bytes": meta["bytes"], "rotated": meta["rotated"]}
+	db_writer.run(lambda c: _log_run(c, "backup", time.perf_counter() - started, result))
+	return result
+
+
+def run_partition() -> Dict[str, Any]:
+	started = time.perf_counter()
+	done = partitions.run()
+	result = {"sealed": [s["month"] for s in done["sealed"]], "dropped": done["dropped"]}
+	db_writer.run(lambda c: _log_run(c, "partition", time.perf_counter() - started, result))
+	return result
+
+
+TASK_RUNNERS = {
+	"optimize": run_optimize,
+	"analyze": run_analyze,
+	"vacuum": run_vacuum,
+	"checkpoint": run_checkpoint,
+	"backup": run_backup,
+	"partition": run_partition,
+}
+
+
+class MaintenanceScheduler:
+	"""Runs due maintenance tasks in a background thread."""
+
+	def __init__(self, check_minutes: float = MAINT_CHECK_MINUTES) -> None:
+		self.check_seconds = max(check_minutes * 60.0, 1.0)
+		self.is_running = False
+		self.thread: Optional[threading.Thread] = None
+		self.lease = SchedulerLease(name="maintenance")
+		self.last_check: Optional[float] = None
+		self.last_due: List[Tuple[str, str]] = []
+		self._latency_mark: Optional[Tuple[float, float]] = None
+		self._stop_event = threading.Event()
+
+	def start(self) -> None:
+		if self.is_running:
+			return
+		self.is_running = True
+		self._stop_event.clear()
+		self.thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+		self.thread.start()
+		logger.info(f"Database maintenance started (check every {self.check_seconds / 60:.0f} minutes)")
+
+	def stop(self) -> None:
+		self.is_running = False
+		self._stop_event.set()
+		if self.thread:
+			self.thread.join(timeout=5)
+
+	def _query_latency_ms(self) -> Optional[float]:
+		"""Mean app.db.q latency in this process since the previous call."""
+		total = count = 0.0
+		for metric in DB_QUERY_SECONDS.collect():
+			for sample in metric.samples:
+				if sample.name.endswith("_sum"):
+					total += sample.value
+				elif sample.name.endswith("_count"):
+					count += sample.value
+		mark, self._latency_mark = self._latency_mark, (total, count)
+		if mark is None or count - mark[1] < _MIN_LATENCY_SAMPLES:
+			return None
+		return (total - mark[0]) / (count - mark[1]) * 1000.0
+
+	def due_tasks(self, stats: Dict[str, Any], last_runs: Dict[str, Dict[str, Any]],
+			latency_ms: Optional[float] = None) -> List[Tuple[str, str]]:
+		"""(task, reason) for every task whose threshold is crossed."""
+		now = time.time()
+		due = []
+		last_optimize = (last_runs.get("optimize") or {}).get("last_run_at")
+		if last_optimize is None:
+			due.append(("optimize", "never run"))
+		elif now - last_optimize >= MAINT_OPTIMIZE_HOURS * 3600.0:
+			due.append(("optimize", f"last run {(now - last_optimize) / 3600:.1f}h ago"))
+		analyzed = stats["pool_snapshot_rows_at_analyze"]
+		if analyzed is None:
+			if stats["pool_snapshot_rows"]:
+				due.append(("analyze", "never analyzed"))
+		elif stats["pool_snapshot_rows"] > analyzed * (1.0 + MAINT_ANALYZE_GROWTH):
+			due.append(("analyze", f"pool_snapshots grew from {analyzed} to {stats['pool_snapshot_rows']} rows"))
+		elif latency_ms is not None and latency_ms > MAINT_SLOW_QUERY_MS:
+			last_analyze = (last_runs.get("analyze") or {}).get("last_run_at")
+			if last_analyze is None or now - last_analyze >= MAINT_ANALYZE_MIN_HOURS * 3600.0:
+				due.append(("analyze", f"mean query latency {latency_ms:.0f}ms"))
+		if stats["partition_months_due"] or stats["partition_months_expired"]:
+			due.append(("partition", ", ".join(
+				[f"seal {m}" for m in stats["partition_months_due"]] + [f"drop {m}" for m in stats["partition_months_expired"]]
+			)))
+		# Vacuum first: the pages it frees leave the file at the checkpoint
+		if stats["freelist_bytes"] > MAINT_FREELIST_MB * 1024 * 1024 and stats["auto_vacuum"] == "incremental":
+			due.append(("vacuum", f"{stats['freelist_bytes'] / 1048576:.0f}MB of free pages"))
+		if stats["wal_bytes"] > MAINT_WAL_MB * 1024 * 1024:
+			due.append(("checkpoint", f"WAL is {stats['wal_bytes'] / 1048576:.0f}MB"))
+		last_backup = (last_runs.get("backup") or {}).get("last_run_at")
+		if BACKUP_HOURS > 0 and (last_backup is None or now - last_backup >= BACKUP_HOURS * 3600.0):
+			due.append(("backup", "never run" if last_backup is None else f"last run {(now - last_backup) / 3600:.1f}h ago"))
+		return due
+
+	def run_due(self) -> Dict[str, Any]:
+		"""Check thresholds and run what is due, if this process gets the maintenance lease."""
+		latency_ms = self._query_latency_ms()
+		if not self.lease.acquire():
+			return {}
+		results: Dict[str, Any] = {}
+		# Backups, sealing and ANALYZE can outlast the lease's TTL
+		self.lease.start_heartbeat()
+		try:
+			self.last_check = time.time()
+			self.last_due = self.due_tasks(db_stats(), _last_runs(), latency_ms)
+			for task, reason in self.last_due:
+				logger.info(f"Database maintenance: {task} ({reason})")
+				try:
+					results[task] = TASK_RUNNERS[task]()
+				except Exception as e:
+					logger.error(f"Database maintenance task {task} failed: {e}")
+					results[task] = {"error": str(e)}
+		finally:
+			self.lease.stop_heartbeat()
+		return results
+
+	def _loop(self) -> None:
+		while not self._stop_event.wait(self.check_seconds):
+			try:
+				self.run_due()
+			except Exception as e:
+				logger.error(f"Database maintenance check failed: {e}")
+
+	def get_status(self) -> Dict[str, Any]:
+		return {
+			"is_running": self.is_running,
+			"check_minutes": self.check_seconds / 60.0,
+			"last_check": self.last_check,
+			"last_due": [{"task": t, "reason": r} for t, r in self.last_due],
+		}
+
+
+maintenance_scheduler = MaintenanceScheduler()
+
+
+def report() -> Dict[str, Any]:
+	"""Sizes, storage profile, thresholds, last runs and the tasks due now."""
+	stats = db_stats()
+	last_runs = _last_runs()
+	for run in last_runs.values():
+		run["last_result"] = json.loads(run["last_result"] or "{}")
+	return {
+		**stats,
+		"profile": DB_PROFILE,
+		"thresholds": {
+			"optimize_hours": MAINT_OPTIMIZE_HOURS,
+			"analyze_growth": MAINT_ANALYZE_GROWTH,
+			"slow_query_ms": MAINT_SLOW_QUERY_MS,
+			"analyze_min_hours": MAINT_ANALYZE_MIN_HOURS,
+			"wal_mb": MAINT_WAL_MB,
+			"freelist_mb": MAINT_FREELIST_MB,
+			"backup_hours": BACKUP_HOURS,
+		},
+		"last_runs": last_runs,
+		"due": [{"task": t, "reason": r} for t, r in maintenance_scheduler.due_tasks(stats, last_runs)],
+		"scheduler": maintenance_scheduler.get_status(),
+	}
@@ -0,0 +1,130 @@
+"""
+Prometheus metrics shared by the web app, the snapshot collector and the DB layer.
+Set PROMETHEUS_MULTIPROC_DIR when running several uvicorn workers so /metrics
+aggregates every process instead of whichever worker answered the scrape.
+"""
+import os
+import time
+from typing import Tuple
+
+from prometheus_client import (
+	CONTENT_TYPE_LATEST,
+	CollectorRegistry,
+	Counter,
+	Gauge,
+	Histogram,
+	generate_latest,
+)
+
+UPSTREAM_SECONDS = Histogram(
+	"asrsv_upstream_request_seconds",
+	"Latency of upstream API calls",
+	["provider", "endpoint"],
+	buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0),
+)
+UPSTREAM_RETRIES = Counter(
+	"asrsv_upstream_retries_total",
+	"Upstream calls retried after a failed attempt",
+	["provider", "endpoint"],
+)
+UPSTREAM_RATE_LIMITED = Counter(
+	"asrsv_upstream_rate_limited_total",
+	"Upstream responses with HTTP 429",
+	["provider", "endpoint"],
+)
+UPSTREAM_ERRORS = Counter(
+	"asrsv_upstream_errors_total",
+	"Upstream calls that ended in an exception",
+	["provider", "endpoint"],
+)
+UPSTREAM_SHORT_CIRCUITED = Counter(
+	"asrsv_upstream_short_circuited_total",
+	"Upstream calls rejected immediately because the provider's circuit was open",
+	["provider"],
+)
+UPSTREAM_CIRCUIT_STATE = Gauge(
+	"asrsv_upstream_circuit_state",
+	"Circuit breaker state per provider (0 closed, 1 half-open, 2 open)",
+	["provider"],
+	# Breaker state is shared by the collector processes; the last one to change it is current
+	multiprocess_mode="mostrecent",
+)
+
+SNAPSHOT_STAGE_SECONDS = Histogram(
+	"asrsv_snapshot_stage_seconds",
+	"Duration of each snapshot_once stage",
+	["stage"],
+	buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0),
+)
+
+DB_QUERY_SECONDS = Histogram(
+	"asrsv_db_query_seconds",
+	"Latency of app.db.q queries",
+	["query"],
+	buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+WRITER_QUEUE_DEPTH = Gauge(
+	"asrsv_db_writer_queue_depth",
+	"Jobs waiting for the database writer thread",
+	multiprocess_mode="max",
+)
+WRITER_BATCH_JOBS = Histogram(
+	"asrsv_db_writer_batch_jobs",
+	"Jobs group-committed per writer transaction",
+	buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+WRITER_COMMIT_SECONDS = Histogram(
+	"asrsv_db_writer_transaction_seconds",
+	"Duration of each writer transaction (a batch or one chunk of a long job)",
+	buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+ANALYTICS_QUERY_SECONDS = Histogram(
+	"asrsv_analytics_query_seconds",
+	"Latency of app.analytics queries by engine",
+	["query", "engine"],
+	buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 10.0),
+)
+
+DASHBOARD_PUBLISH_SECONDS = Histogram(
+	"asrsv_dashboard_publish_seconds",
+	"Time to render and publish one asset's static dashboard",
+	["result"],
+	buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+	"asrsv_http_request_seconds",
+	"Latency of dashboard HTTP requests",
+	["method", "route", "status"],
+	buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+CACHE_REQUESTS = Counter(
+	"asrsv_cache_requests_total",
+	"Cache lookups by result (hit ratio = hit / (hit + miss))",
+	["cache", "result"],
+)
+
+
+def observe_stage(stage: str, started: float) -> float:
+	"""Record a snapshot stage that began at time.perf_counter() value `started`."""
+	elapsed = time.perf_counter() - started
+	SNAPSHOT_STAGE_SECONDS.labels(stage).observe(elapsed)
+	return elapsed
+
+
+def cache_result(cache: str, hit: bool) -> None:
+	CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def render_latest() -> Tuple[bytes, str]:
+	"""Exposition payload and content type for the /metrics endpoint."""
+	if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+		from prometheus_client import multiprocess
+
+		registry = CollectorRegistry()
+		multiprocess.MultiProcessCollector(registry)
+		return generate_latest(registry), CONTENT_TYPE_LATEST
+	return generate_latest(), CONTENT_TYPE_LATEST
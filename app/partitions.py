@@ -0,0 +1,490 @@
+"""
+Monthly partitions of pool_snapshots.
+The live table keeps the newest ASRSV_PARTITION_HOT_MONTHS months. seal_month() moves
+an older month into its own SQLite file in ASRSV_PARTITION_DIR, with the same indexes
+and an immutable per-pool daily rollup (pool_daily). The file is made read-only and
+registered in pool_partitions, and the month's rows are then deleted from the live
+table in short writer transactions. Range reads go through
+app.db.pool_snapshot_sources(), which attaches only the partitions a range overlaps.
+
+Sealed files are never modified. drop_partition() deletes one. Its registry row stays,
+and keeps the per-asset sums and family totals the month contributed, so all-time
+figures do not change. A fee recompute writes a replacement file with rewrite().
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import stat
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.db import PARTITION_DIR, _connect, hot_floor, next_month, partition_uri
+from app.writer import db_writer
+
+logger = logging.getLogger(__name__)
+
+PARTITION_HOT_MONTHS = max(int(os.getenv("ASRSV_PARTITION_HOT_MONTHS", "2")), 1)
+# Months of pool history kept in all, live months included; 0 keeps everything
+PARTITION_RETAIN_MONTHS = int(os.getenv("ASRSV_PARTITION_RETAIN_MONTHS", "0"))
+PARTITION_DELETE_CHUNK = int(os.getenv("ASRSV_PARTITION_DELETE_CHUNK", "5000"))
+
+
+def _month_offset(month: str, months: int) -> str:
+	index = int(month[:4]) * 12 + int(month[5:7]) - 1 + months
+	return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def hot_start() -> str:
+	"""Oldest month that stays in the live table."""
+	current = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m")
+	return _month_offset(current, 1 - PARTITION_HOT_MONTHS)
+
+
+def _sha256(path: str) -> str:
+	digest = hashlib.sha256()
+	with open(path, "rb") as fh:
+		for block in iter(lambda: fh.read(1024 * 1024), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+
+def _schema_sql(conn: sqlite3.Connection, schema: str) -> List[str]:
+	"""pool_snapshots' CREATE TABLE and CREATE INDEX statements, retargeted at `schema`."""
+	out = []
+	for kind, sql in conn.execute(
+		"SELECT type, sql FROM main.sqlite_master WHERE tbl_name = 'pool_snapshots' AND sql IS NOT NULL ORDER BY type DESC"
+	):
+		pattern = r"^CREATE TABLE\s+(?:IF NOT EXISTS\s+)?" if kind == "table" else r"^CREATE INDEX\s+(?:IF NOT EXISTS\s+)?"
+		out.append(re.sub(pattern + r'"?(\w+)"?', lambda m: f"CREATE {kind.upper()} {schema}.{m.group(1)}", sql.strip()))
+	return out
+
+
+def _previous_stats(conn: sqlite3.Connection, month: str) -> Dict[str, Any]:
+	row = conn.execute("SELECT stats FROM pool_partitions WHERE month < ? ORDER BY month DESC LIMIT 1", (month,)).fetchone()
+	return json.loads(row[0]) if row else {}
+
+
+def _family_deltas(conn: sqlite3.Connection, table: str,
+		pool_last: Dict[str, Dict[str, float]]) -> Dict[Tuple[str, str], List[float]]:
+	"""All-time volume and fee increments per (asset, family) from the rows of `table`.
+
+	Same delta rule as publish(): a drop in 24h volume means the window reset. Each
+	pool's first row is measured against its last volume in `pool_last`.
+	"""
+	conn.execute("CREATE TEMP TABLE IF NOT EXISTS partition_boundary (asset_key TEXT, pool_address TEXT, vol REAL)")
+	conn.execute("DELETE FROM temp.partition_boundary")
+	conn.executemany(
+		"INSERT INTO temp.partition_boundary VALUES (?, ?, ?)",
+		[(a, p, v) for a, pools in pool_last.items() for p, v in pools.items()],
+	)
+	rows = conn.execute(
+		f"""
+		SELECT asset_key, family, SUM(delta), SUM(delta * COALESCE(fee_rate, 0) * (1.0 - COALESCE(protocol_cut, 0)))
+		FROM (
+		  SELECT asset_key, family, fee_rate, protocol_cut,
+		         CASE WHEN vol >= prev THEN vol - prev WHEN vol > 0 THEN vol ELSE 0.0 END AS delta
+		  FROM (
+		    SELECT p.asset_key, p.family, p.fee_rate, p.protocol_cut, COALESCE(p.volume_24h_usd, 0) AS vol,
+		           COALESCE(LAG(COALESCE(p.volume_24h_usd, 0)) OVER (PARTITION BY p.asset_key, p.pool_address ORDER BY p.ts_utc),
+		                    b.vol, 0) AS prev
+		    FROM {table} p
+		    LEFT JOIN temp.partition_boundary b ON b.asset_key = p.asset_key AND b.pool_address = p.pool_address
+		  )
+		)
+		GROUP BY asset_key, family
+		"""
+	).fetchall()
+	return {(r[0], r[1] or ""): [r[2], r[3]] for r in rows}
+
+
+def _aggregate(conn: sqlite3.Connection, schema: str, previous: Dict[str, Any]) -> Dict[str, Any]:
+	"""Build `schema`.pool_daily and return the month's stats.
+
+	Family totals continue from each pool's last volume in the previous partition.
+	"""
+	conn.execute(f"DROP TABLE IF EXISTS {schema}.pool_daily")
+	conn.execute(
+		f"""
+		CREATE TABLE {schema}.pool_daily AS
+		SELECT asset_key,
+		       date(substr(ts_utc,1,19)) AS day,
+		       pool_address,
+		       family,
+		       COUNT(*)           AS samples,
+		       AVG(daily_yield)   AS daily_yield_avg,
+		       AVG(apy_simple)    AS apy_simple_avg,
+		       AVG(apy_compound)  AS apy_compound_avg
+		FROM {schema}.pool_snapshots
+		GROUP BY day, pool_address, family, asset_key
+		"""
+	)
+	conn.execute(f"CREATE INDEX {schema}.idx_pool_daily_asset_day ON pool_daily(asset_key, day)")
+
+	pool_last = {a: dict(p) for a, p in previous.get("pool_last", {}).items()}
+	assets: Dict[str, Dict[str, Any]] = {}
+	for asset_key, rows, fees, volume in conn.execute(
+		f"SELECT asset_key, COUNT(*), COALESCE(SUM(fee_24h_usd), 0), COALESCE(SUM(volume_24h_usd), 0) FROM {schema}.pool_snapshots GROUP BY asset_key"
+	):
+		assets[asset_key] = {"rows": rows, "fee_24h_usd": fees, "volume_24h_usd": volume, "families": {}}
+	for (asset_key, family), totals in _family_deltas(conn, f"{schema}.pool_snapshots", pool_last).items():
+		assets[asset_key]["families"][family] = totals
+	for asset_key, pool, volume in conn.execute(
+		f"""
+		SELECT asset_key, pool_address, COALESCE(volume_24h_usd, 0) FROM (
+		  SELECT asset_key, pool_address, volume_24h_usd,
+		         ROW_NUMBER() OVER (PARTITION BY asset_key, pool_address ORDER BY ts_utc DESC) AS rn
+		  FROM {schema}.pool_snapshots
+		)
+		WHERE rn = 1
+		"""
+	):
+		pool_last.setdefault(asset_key, {})[pool] = volume
+	return {"assets": assets, "pool_last": pool_last}
+
+
+def _finish(tmp: str, path: str) -> str:
+	"""Check, analyze and fsync a built partition, make it read-only and move it into place."""
+	conn = sqlite3.connect(tmp, isolation_level=None)
+	try:
+		conn.execute("PRAGMA journal_mode=DELETE;")
+		conn.execute("ANALYZE;")
+		result = conn.execute("PRAGMA quick_check;").fetchone()[0]
+		if result != "ok":
+			raise RuntimeError(f"partition {tmp} failed its integrity check: {result}")
+	finally:
+		conn.close()
+	with open(tmp, "rb") as fh:
+		os.fsync(fh.fileno())
+	os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+	os.replace(tmp, path)
+	return _sha256(path)
+
+
+def _file_name(month: str) -> str:
+	return f"pool_snapshots-{month}-{uuid.uuid4().hex[:8]}.sqlite"
+
+
+def _recompute_running(conn: sqlite3.Connection) -> bool:
+	row = conn.execute("SELECT 1 FROM fee_recompute_jobs WHERE status = 'running'").fetchone()
+	return row is not None
+
+
+def due_months(conn: sqlite3.Connection) -> List[str]:
+	"""Months still in the live table that are older than the hot window, oldest first."""
+	months = []
+	cursor = hot_floor(conn) or ""
+	limit = hot_start()
+	while True:
+		first = conn.execute("SELECT MIN(ts_utc) FROM pool_snapshots WHERE ts_utc >= ?", (cursor,)).fetchone()[0]
+		if first is None or first[:7] >= limit:
+			return months
+		months.append(first[:7])
+		cursor = next_month(first[:7])
+
+
+def _delete_live(month: str) -> int:
+	"""Delete a sealed month from the live table, PARTITION_DELETE_CHUNK rows per writer transaction."""
+	deleted = 0
+
+	def step(conn) -> bool:
+		nonlocal deleted
+		n = conn.execute(
+			"DELETE FROM pool_snapshots WHERE rowid IN (SELECT rowid FROM pool_snapshots WHERE ts_utc < ? LIMIT ?)",
+			(next_month(month), PARTITION_DELETE_CHUNK),
+		).rowcount
+		deleted += n
+		return n > 0
+
+	db_writer.run_chunked(step)
+	return deleted
+
+
+def seal_month(month: str) -> Dict[str, Any]:
+	"""Move one month of pool_snapshots out of the live table into a sealed partition file."""
+	started = time.perf_counter()
+	conn = _connect()
+	try:
+		due = due_months(conn)
+		if not due or due[0] != month:
+			raise ValueError(f"{month} is not the oldest month due for sealing (due: {due or 'none'})")
+		if _recompute_running(conn):
+			raise RuntimeError("a fee recompute is running; seal once it has finished")
+		os.makedirs(PARTITION_DIR, exist_ok=True)
+		name = _file_name(month)
+		path = os.path.join(PARTITION_DIR, name)
+		tmp = path + ".tmp"
+		if os.path.exists(tmp):
+			os.unlink(tmp)
+		conn.execute("ATTACH DATABASE ? AS part", (tmp,))
+		try:
+			conn.execute("PRAGMA part.journal_mode=OFF;")
+			conn.execute("PRAGMA part.synchronous=OFF;")
+			for sql in _schema_sql(conn, "part"):
+				conn.execute(sql)
+			# Writes only the new file; the live database sees one read transaction
+			conn.execute("BEGIN")
+			rows = conn.execute(
+				"""
+				INSERT INTO part.pool_snapshots
+				SELECT * FROM main.pool_snapshots WHERE ts_utc >= ? AND ts_utc < ? ORDER BY ts_utc, pool_address
+				""",
+				(month, next_month(month)),
+			).rowcount
+			stats = _aggregate(conn, "part", _previous_stats(conn, month))
+			first_ts, last_ts = conn.execute("SELECT MIN(ts_utc), MAX(ts_utc) FROM part.pool_snapshots").fetchone()
+			conn.execute("COMMIT")
+		finally:
+			conn.execute("DETACH DATABASE part")
+	finally:
+		conn.close()
+	sha = _finish(tmp, path)
+
+	def register(c) -> None:
+		live = c.execute(
+			"SELECT COUNT(*) FROM pool_snapshots WHERE ts_utc >= ? AND ts_utc < ?", (month, next_month(month)),
+		).fetchone()[0]
+		if live != rows or _recompute_running(c):
+			raise RuntimeError(f"{month} changed while it was being sealed ({rows} rows copied, {live} live)")
+		c.execute(
+			"""
+			INSERT INTO pool_partitions (month, file, first_ts, last_ts, rows, sha256, stats, sealed_at)
+			VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+			""",
+			(month, name, first_ts, last_ts, rows, sha, json.dumps(stats), time.time()),
+		)
+
+	try:
+		# From here on reads of the month go to the file; the live rows are only dead weight
+		db_writer.run(register)
+	except Exception:
+		os.unlink(path)
+		raise
+	deleted = _delete_live(month)
+	result = {"month": month, "file": name, "rows": rows, "deleted": deleted,
+		"bytes": os.path.getsize(path), "seconds": round(time.perf_counter() - started, 3)}
+	logger.info(f"Sealed pool_snapshots {month}: {rows} rows into {name}")
+	return result
+
+
+def drop_partition(month: str) -> Dict[str, Any]:
+	"""Delete a sealed partition's file. Its rows leave every history query; all-time sums keep them."""
+	conn = _connect()
+	try:
+		row = conn.execute("SELECT file FROM pool_partitions WHERE month = ? AND dropped_at IS NULL", (month,)).fetchone()
+	finally:
+		conn.close()
+	if row is None:
+		raise ValueError(f"no sealed partition for {month}")
+	db_writer.execute("UPDATE pool_partitions SET dropped_at = ? WHERE month = ?", (time.time(), month))
+	path = os.path.join(PARTITION_DIR, row["file"])
+	if os.path.exists(path):
+		os.unlink(path)
+	logger.info(f"Dropped pool_snapshots partition {month}")
+	return {"month": month, "file": row["file"]}
+
+
+def rewrite(month: str, fn: Callable[[sqlite3.Connection], Any],
+		then: Optional[Callable[[sqlite3.Connection], None]] = None) -> Any:
+	"""Replace a sealed partition with a copy changed by fn(conn).
+
+	fn updates `pool_snapshots` in the copy; pool_daily and the stats are rebuilt and
+	the registry is switched to the new file, so readers see the old file or the new one.
+	then(conn), if given, runs in the writer job that switches the registry.
+	"""
+	conn = _connect()
+	try:
+		row = conn.execute("SELECT * FROM pool_partitions WHERE month = ? AND dropped_at IS NULL", (month,)).fetchone()
+		previous = _previous_stats(conn, month)
+	finally:
+		conn.close()
+	if row is None:
+		raise ValueError(f"no sealed partition for {month}")
+	name = _file_name(month)
+	path = os.path.join(PARTITION_DIR, name)
+	tmp = path + ".tmp"
+	src = sqlite3.connect(partition_uri(row["file"]), uri=True)
+	dst = sqlite3.connect(tmp, isolation_level=None)
+	try:
+		src.backup(dst)
+		dst.row_factory = sqlite3.Row
+		dst.execute("BEGIN")
+		result = fn(dst)
+		stats = _aggregate(dst, "main", previous)
+		dst.execute("COMMIT")
+	finally:
+		dst.close()
+		src.close()
+	sha = _finish(tmp, path)
+
+	def switch(c) -> None:
+		c.execute(
+			"UPDATE pool_partitions SET file = ?, sha256 = ?, stats = ?, sealed_at = ? WHERE month = ?",
+			(name, sha, json.dumps(stats), time.time(), month),
+		)
+		if then is not None:
+			then(c)
+
+	try:
+		db_writer.run(switch)
+	except Exception:
+		os.unlink(path)
+		raise
+	old = os.path.join(PARTITION_DIR, row["file"])
+	if os.path.exists(old):
+		os.unlink(old)
+	return result
+
+
+def _registry_stats(conn: sqlite3.Connection) -> List[Tuple[Dict[str, Any], bool]]:
+	"""(stats, dropped) of every registered partition, oldest first; none before migrate()."""
+	try:
+		rows = conn.execute("SELECT stats, dropped_at FROM pool_partitions ORDER BY month").fetchall()
+	except sqlite3.OperationalError:
+		return []
+	return [(json.loads(r[0]), r[1] is not None) for r in rows]
+
+
+def dropped_totals(conn: sqlite3.Connection, asset_key: str) -> Tuple[Dict[str, List[float]], Dict[str, float]]:
+	"""Family totals of one asset's dropped partitions, and each pool's last volume in the newest of them."""
+	families: Dict[str, List[float]] = {}
+	boundary: Dict[str, float] = {}
+	for stats, dropped in _registry_stats(conn):
+		if not dropped:
+			continue
+		for family, (volume, fees) in stats["assets"].get(asset_key, {}).get("families", {}).items():
+			t = families.setdefault(family, [0.0, 0.0])
+			t[0] += volume
+			t[1] += fees
+		boundary = stats["pool_last"].get(asset_key, {})
+	return families, boundary
+
+
+def recomputed_totals(conn: sqlite3.Connection, include_dropped: bool = True) -> Dict[Tuple[str, str], List[float]]:
+	"""family_totals as the pool history implies: partition stats plus deltas over the live table."""
+	totals: Dict[Tuple[str, str], List[float]] = {}
+	pool_last: Dict[str, Dict[str, float]] = {}
+	for stats, dropped in _registry_stats(conn):
+		pool_last = stats["pool_last"]
+		if dropped and not include_dropped:
+			continue
+		for asset_key, asset in stats["assets"].items():
+			for family, (volume, fees) in asset["families"].items():
+				t = totals.setdefault((asset_key, family), [0.0, 0.0])
+				t[0] += volume
+				t[1] += fees
+	floor = hot_floor(conn)
+	live = f"(SELECT * FROM main.pool_snapshots WHERE ts_utc >= '{floor}')" if floor else "main.pool_snapshots"
+	for key, (volume, fees) in _family_deltas(conn, live, pool_last).items():
+		t = totals.setdefault(key, [0.0, 0.0])
+		t[0] += volume
+		t[1] += fees
+	return totals
+
+
+def rebuild_totals(conn: sqlite3.Connection) -> None:
+	"""Rebuild family_totals and pools_state from the pool history, partitions included.
+
+	Runs inside the caller's transaction.
+	"""
+	conn.execute("DELETE FROM family_totals")
+	conn.executemany(
+		"INSERT INTO family_totals (asset_key, family, all_time_volume_usd, all_time_fees_usd) VALUES (?, ?, ?, ?)",
+		[(a, f, v, fees) for (a, f), (v, fees) in recomputed_totals(conn).items()],
+	)
+	registry = _registry_stats(conn)
+	pool_last = registry[-1][0]["pool_last"] if registry else {}
+	conn.execute("DELETE FROM pools_state")
+	conn.executemany(
+		"INSERT INTO pools_state (asset_key, pool_address, last_volume_24h_usd) VALUES (?, ?, ?)",
+		[(a, p, v) for a, pools in pool_last.items() for p, v in pools.items()],
+	)
+	conn.execute(
+		"""
+		INSERT OR REPLACE INTO pools_state (asset_key, pool_address, last_volume_24h_usd)
+		SELECT asset_key, pool_address, volume_24h_usd FROM (
+		  SELECT asset_key, pool_address, volume_24h_usd,
+		         ROW_NUMBER() OVER (PARTITION BY asset_key, pool_address ORDER BY ts_utc DESC) AS rn
+		  FROM pool_snapshots
+		  WHERE ts_utc >= ?
+		)
+		WHERE rn = 1
+		""",
+		(hot_floor(conn) or "",),
+	)
+
+
+def verify() -> List[Dict[str, Any]]:
+	"""Check every sealed partition's file against its registered sha256 and run an integrity check."""
+	conn = _connect()
+	try:
+		parts = conn.execute("SELECT month, file, sha256 FROM pool_partitions WHERE dropped_at IS NULL ORDER BY month").fetchall()
+	finally:
+		conn.close()
+	out = []
+	for p in parts:
+		path = os.path.join(PARTITION_DIR, p["file"])
+		result = {"month": p["month"], "file": p["file"], "ok": False}
+		if not os.path.exists(path):
+			result["error"] = "missing"
+		elif _sha256(path) != p["sha256"]:
+			result["error"] = "sha256 mismatch"
+		else:
+			check = sqlite3.connect(partition_uri(p["file"]), uri=True)
+			try:
+				result["ok"] = check.execute("PRAGMA quick_check;").fetchone()[0] == "ok"
+			finally:
+				check.close()
+		out.append(result)
+	return out
+
+
+def expired_months(conn: sqlite3.Connection) -> List[str]:
+	"""Sealed months older than the retention window, oldest first."""
+	if PARTITION_RETAIN_MONTHS <= 0:
+		return []
+	current = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m")
+	rows = conn.execute(
+		"SELECT month FROM pool_partitions WHERE dropped_at IS NULL AND month < ? ORDER BY month",
+		(_month_offset(current, 1 - PARTITION_RETAIN_MONTHS),),
+	).fetchall()
+	return [r[0] for r in rows]
+
+
+def run() -> Dict[str, Any]:
+	"""Seal every month that left the hot window, then drop partitions past the retention window."""
+	conn = _connect()
+	try:
+		due = due_months(conn)
+	finally:
+		conn.close()
+	result: Dict[str, Any] = {"sealed": [seal_month(m) for m in due]}
+	conn = _connect()
+	try:
+		expired = expired_months(conn)
+	finally:
+		conn.close()
+	result["dropped"] = [drop_partition(m)["month"] for m in expired]
+	return result
+
+
+def status() -> Dict[str, Any]:
+	conn = _connect()
+	try:
+		parts = conn.execute(
+			"SELECT month, file, first_ts, last_ts, rows, sealed_at, dropped_at FROM pool_partitions ORDER BY month"
+		).fetchall()
+		return {
+			"directory": PARTITION_DIR,
+			"hot_months": PARTITION_HOT_MONTHS,
+			"retain_months": PARTITION_RETAIN_MONTHS,
+			"live_from": hot_floor(conn),
+			"due": due_months(conn),
+			"partitions": [dict(p) for p in parts],
+		}
+	finally:
+		conn.close()
@@ -0,0 +1,159 @@
+"""
+Opt-in profiling for slow snapshot runs and slow requests.
+A sampling profiler records the target thread's stack every few milliseconds;
+runs that exceed the threshold are written as folded stacks ("a;b;c 42"), which
+flamegraph.pl, inferno and speedscope read directly.
+Toggle with ASRSV_PROFILE=1 or at runtime through POST /api/profiling.
+"""
+import functools
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_config: Dict[str, Any] = {
+	"enabled": os.getenv("ASRSV_PROFILE", "0") == "1",
+	"snapshot_threshold_ms": int(os.getenv("ASRSV_PROFILE_SNAPSHOT_THRESHOLD_MS", "60000")),
+	"route_threshold_ms": int(os.getenv("ASRSV_PROFILE_ROUTE_THRESHOLD_MS", "500")),
+	"slow_query_ms": int(os.getenv("ASRSV_SLOW_QUERY_MS", "200")),
+	"routes": [r for r in os.getenv("ASRSV_PROFILE_ROUTES", "/,/history").split(",") if r],
+	"interval_ms": int(os.getenv("ASRSV_PROFILE_INTERVAL_MS", "5")),
+	"directory": os.getenv("ASRSV_PROFILE_DIR", "profiles"),
+	"keep": int(os.getenv("ASRSV_PROFILE_KEEP", "50")),
+}
+_config_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+	return bool(_config["enabled"])
+
+
+def get_config() -> Dict[str, Any]:
+	with _config_lock:
+		return dict(_config, routes=list(_config["routes"]))
+
+
+def configure(**changes: Any) -> Dict[str, Any]:
+	"""Update profiling settings at runtime; unknown keys are rejected."""
+	with _config_lock:
+		for key, value in changes.items():
+			if key not in _config:
+				raise ValueError(f"unknown profiling setting: {key}")
+			if value is not None:
+				_config[key] = value
+	logger.info(f"Profiling config: {get_config()}")
+	return get_config()
+
+
+def route_enabled(path: str) -> bool:
+	return is_enabled() and path in _config["routes"]
+
+
+class StackSampler:
+	"""Samples one thread's Python stack on a background thread."""
+
+	def __init__(self, thread_id: int, interval_ms: int) -> None:
+		self.thread_id = thread_id
+		self.interval = max(interval_ms, 1) / 1000.0
+		self.stacks: Counter = Counter()
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+
+	def start(self) -> None:
+		self._thread.start()
+
+	def stop(self) -> None:
+		self._stop.set()
+		self._thread.join(timeout=1)
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			frame = sys._current_frames().get(self.thread_id)
+			if frame is None:
+				continue
+			names = []
+			while frame is not None:
+				code = frame.f_code
+				names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}")
+				frame = frame.f_back
+			self.stacks[";".join(reversed(names))] += 1
+
+
+def _rotate(directory: str, keep: int) -> None:
+	files = sorted(
+		(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".folded")),
+		key=os.path.getmtime,
+	)
+	for path in files[:-keep] if keep > 0 else files:
+		try:
+			os.unlink(path)
+		except OSError:
+			pass
+
+
+def _write_profile(name: str, elapsed_ms: float, stacks: Counter) -> Optional[str]:
+	directory = _config["directory"]
+	try:
+		os.makedirs(directory, exist_ok=True)
+		stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+		safe_name = name.strip("/").replace("/", "_") or "root"
+		path = os.path.join(directory, f"{safe_name}-{stamp}-{int(elapsed_ms)}ms.folded")
+		with open(path, "w", encoding="utf-8") as f:
+			for stack, count in stacks.most_common():
+				f.write(f"{stack} {count}\n")
+		_rotate(directory, int(_config["keep"]))
+		return path
+	except OSError as e:
+		logger.warning(f"Could not write profile for {name}: {e}")
+		return None
+
+
+@contextmanager
+def profile(name: str, threshold_ms: int) -> Iterator[None]:
+	"""Sample the current thread while the block runs; keep the result only if it was slow."""
+	if not is_enabled():
+		yield
+		return
+	sampler = StackSampler(threading.get_ident(), int(_config["interval_ms"]))
+	sampler.start()
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		sampler.stop()
+		elapsed_ms = (time.perf_counter() - started) * 1000.0
+		if elapsed_ms >= threshold_ms and sampler.stacks:
+			path = _write_profile(name, elapsed_ms, sampler.stacks)
+			if path:
+				logger.warning(f"Slow {name} ({elapsed_ms:.0f} ms), profile written to {path}")
+
+
+def profiled(name: str):
+	"""Decorator form of profile() for snapshot runs."""
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			with profile(name, int(_config["snapshot_threshold_ms"])):
+				return fn(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def explain_if_slow(conn: sqlite3.Connection, sql: str, params: Sequence[Any], elapsed_ms: float) -> None:
+	"""Log EXPLAIN QUERY PLAN for a statement that exceeded the slow-query threshold."""
+	if not is_enabled() or elapsed_ms < _config["slow_query_ms"]:
+		return
+	try:
+		plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+		lines = "\n".join(f"  {r[3]}" for r in plan)
+		logger.warning(f"Slow query ({elapsed_ms:.0f} ms): {' '.join(sql.split())}\n{lines}")
+	except sqlite3.Error as e:
+		logger.warning(f"Slow query ({elapsed_ms:.0f} ms), EXPLAIN failed: {e}")
@@ -0,0 +1,172 @@
+"""
+Published dashboard.
+The main page and its two JSON payloads only change when a snapshot is published, so
+after each one publish_dashboard() renders them into a new version directory,
+ASRSV_PUBLISH_DIR/<asset>/<version>/, and points the asset's `current` symlink at it
+with a single rename. nginx serves `current` without touching Python (see nginx.conf)
+and app/main.py serves it too; both render dynamically while nothing is published.
+
+The newest ASRSV_PUBLISH_KEEP versions are kept so a reader that resolved the old link
+can finish. If a publish fails, `current` is removed rather than left pointing at a
+page older than the database.
+"""
+import datetime
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi.templating import Jinja2Templates
+
+from app import dashboard
+from app.metrics import DASHBOARD_PUBLISH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PUBLISH_ENABLED = os.getenv("ASRSV_PUBLISH", "1") != "0"
+PUBLISH_DIR = os.getenv("ASRSV_PUBLISH_DIR", os.path.join(_PROJECT_ROOT, "static", "published"))
+PUBLISH_KEEP = int(os.getenv("ASRSV_PUBLISH_KEEP", "3"))
+
+# Files of a published version; nginx.conf maps each to its route
+PAGE = "index.html"
+PORTFOLIO_COMPOSITION = "portfolio-composition.json"
+TIME_SERIES = "time-series.json"
+
+# Asset keys become directory names; nginx.conf rejects the same characters
+_SAFE_KEY = re.compile(r"^[A-Za-z0-9_-]+$")
+
+_templates = Jinja2Templates(directory=os.path.join(_PROJECT_ROOT, "templates"))
+
+
+def _json(content: Any) -> str:
+	# Byte for byte what JSONResponse sends for the same payload
+	return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"))
+
+
+def _write(path: str, text: str) -> None:
+	with open(path, "w", encoding="utf-8") as fh:
+		fh.write(text)
+		fh.flush()
+		os.fsync(fh.fileno())
+
+
+def published_file(asset: str, name: str) -> Optional[str]:
+	"""Path of `name` in the asset's current published version, or None if there is none."""
+	if not _SAFE_KEY.match(asset):
+		return None
+	path = os.path.join(PUBLISH_DIR, asset, "current", name)
+	return path if os.path.exists(path) else None
+
+
+def unpublish(asset: str) -> None:
+	"""Remove the asset's `current` link so its pages are rendered dynamically again."""
+	link = os.path.join(PUBLISH_DIR, asset, "current")
+	if os.path.lexists(link):
+		os.unlink(link)
+
+
+def _prune(asset_dir: str, current: str, keep: int) -> List[str]:
+	removed = []
+	versions = sorted(n for n in os.listdir(asset_dir) if n.startswith("v") and n != current)
+	for name in versions[:max(len(versions) - max(keep - 1, 0), 0)]:
+		shutil.rmtree(os.path.join(asset_dir, name), ignore_errors=True)
+		removed.append(name)
+	# Version directories left half-written by a crashed publish
+	for name in os.listdir(asset_dir):
+		if name.startswith(".v"):
+			shutil.rmtree(os.path.join(asset_dir, name), ignore_errors=True)
+	return removed
+
+
+def publish_dashboard(asset: str, keep: Optional[int] = None) -> Dict[str, Any]:
+	"""Render the asset's dashboard and payloads and make them its current published version."""
+	if not _SAFE_KEY.match(asset):
+		raise ValueError(f"asset key '{asset}' cannot be published")
+	keep = PUBLISH_KEEP if keep is None else keep
+	asset_dir = os.path.join(PUBLISH_DIR, asset)
+	os.makedirs(asset_dir, exist_ok=True)
+	started = time.perf_counter()
+	with open(os.path.join(asset_dir, ".lock"), "w") as lock:
+		# Concurrent snapshots of one asset publish one after the other, the later last
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			context = dashboard.dashboard_context(asset)
+			if context["no_data"]:
+				unpublish(asset)
+				return {"asset": asset, "version": None, "ts_utc": None}
+			files = {
+				PAGE: _templates.get_template(dashboard.DASHBOARD_TEMPLATE).render({"request": None, **context}),
+				PORTFOLIO_COMPOSITION: _json(dashboard.portfolio_composition_payload(asset)),
+				TIME_SERIES: _json(dashboard.time_series_payload(asset)),
+			}
+			stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+			version = f"v{stamp}-{uuid.uuid4().hex[:8]}"
+			tmp_dir = os.path.join(asset_dir, f".{version}")
+			os.makedirs(tmp_dir)
+			for name, text in files.items():
+				_write(os.path.join(tmp_dir, name), text)
+			os.rename(tmp_dir, os.path.join(asset_dir, version))
+			tmp_link = os.path.join(asset_dir, f".current-{version}")
+			os.symlink(version, tmp_link)
+			os.replace(tmp_link, os.path.join(asset_dir, "current"))
+			removed = _prune(asset_dir, version, keep)
+		except Exception:
+			unpublish(asset)
+			DASHBOARD_PUBLISH_SECONDS.labels("error").observe(time.perf_counter() - started)
+			raise
+	seconds = time.perf_counter() - started
+	DASHBOARD_PUBLISH_SECONDS.labels("ok").observe(seconds)
+	return {"asset": asset, "version": version, "ts_utc": context["summary"]["ts_utc"],
+		"bytes": sum(len(t.encode("utf-8")) for t in files.values()), "pruned": removed, "seconds": round(seconds, 3)}
+
+
+def publish_after_snapshot(asset: str) -> None:
+	"""Publishing step of a snapshot; a failure is logged and never fails the snapshot itself."""
+	if not PUBLISH_ENABLED:
+		# Pages left from before publishing was turned off would never change again
+		unpublish(asset)
+		return
+	try:
+		publish_dashboard(asset)
+	except Exception as e:
+		logger.error(f"Publishing the {asset} dashboard failed, serving it dynamically: {e}")
+
+
+def publish_all() -> List[Dict[str, Any]]:
+	"""Republish every enabled asset, e.g. after history was rewritten underneath the pages."""
+	from core.assets import load_assets
+	if not PUBLISH_ENABLED:
+		return []
+	results = []
+	for a in load_assets():
+		try:
+			results.append(publish_dashboard(a["asset_key"]))
+		except Exception as e:
+			logger.error(f"Publishing the {a['asset_key']} dashboard failed: {e}")
+			results.append({"asset": a["asset_key"], "error": str(e)})
+	return results
+
+
+def status() -> List[Dict[str, Any]]:
+	"""Current version and kept versions of every published asset."""
+	if not os.path.isdir(PUBLISH_DIR):
+		return []
+	out = []
+	for asset in sorted(os.listdir(PUBLISH_DIR)):
+		asset_dir = os.path.join(PUBLISH_DIR, asset)
+		if not os.path.isdir(asset_dir):
+			continue
+		link = os.path.join(asset_dir, "current")
+		out.append({
+			"asset": asset,
+			"current": os.readlink(link) if os.path.islink(link) else None,
+			"versions": sorted(n for n in os.listdir(asset_dir) if n.startswith("v")),
+		})
+	return out
@@ -0,0 +1,207 @@
+"""
+Single database writer.
+Every mutation in a process goes through one thread that owns its only write
+connection. Callers submit jobs, callables taking that connection, and wait on a
+Future. Jobs that queue up together are group-committed: one BEGIN IMMEDIATE ...
+COMMIT around up to ASRSV_WRITER_BATCH_MAX of them, each inside its own SAVEPOINT
+so a failing job rolls back alone. Long jobs are submitted as a step function and
+committed one chunk at a time, with queued small writes let in between chunks, so
+no transaction holds the write lock for long.
+
+Jobs run inside the writer's transaction and must not BEGIN/COMMIT themselves.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence, TypeVar
+
+from app.db import _connect
+from app.metrics import WRITER_BATCH_JOBS, WRITER_COMMIT_SECONDS, WRITER_QUEUE_DEPTH
+
+T = TypeVar("T")
+
+# Most jobs committed in one transaction, and how long the writer waits for more
+# jobs to join a batch once the first one arrives
+WRITER_BATCH_MAX = int(os.getenv("ASRSV_WRITER_BATCH_MAX", "64"))
+WRITER_BATCH_WINDOW_MS = float(os.getenv("ASRSV_WRITER_BATCH_WINDOW_MS", "2"))
+
+
+class _Job:
+	__slots__ = ("fn", "future", "chunked", "chunks")
+
+	def __init__(self, fn: Callable[[sqlite3.Connection], Any], chunked: bool = False) -> None:
+		self.fn = fn
+		self.future: Future = Future()
+		self.chunked = chunked
+		self.chunks = 0
+
+
+class DatabaseWriter:
+	"""Queue-fed writer thread with group commit and chunked long jobs."""
+
+	def __init__(self, batch_max: Optional[int] = None, batch_window_ms: Optional[float] = None) -> None:
+		self.batch_max = max(int(batch_max or WRITER_BATCH_MAX), 1)
+		self.batch_window = (WRITER_BATCH_WINDOW_MS if batch_window_ms is None else batch_window_ms) / 1000.0
+		self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue()
+		self._thread: Optional[threading.Thread] = None
+		self._lock = threading.Lock()
+		self._conn: Optional[sqlite3.Connection] = None
+		self._pid = os.getpid()
+
+	def _ensure_started(self) -> None:
+		# A forked child inherits the object but not the thread
+		if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+			return
+		with self._lock:
+			if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+				return
+			self._pid = os.getpid()
+			self._queue = queue.Queue()
+			self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+			self._thread.start()
+
+	def _in_writer(self) -> bool:
+		return threading.current_thread() is self._thread
+
+	def submit(self, fn: Callable[[sqlite3.Connection], T]) -> "Future[T]":
+		"""Queue a small write; the Future resolves once its batch has committed."""
+		job = _Job(fn)
+		if self._in_writer():
+			# Nested submission from inside a job: run it in the current transaction
+			try:
+				job.future.set_result(fn(self._conn))
+			except Exception as e:
+				job.future.set_exception(e)
+			return job.future
+		self._ensure_started()
+		self._queue.put(job)
+		WRITER_QUEUE_DEPTH.set(self._queue.qsize())
+		return job.future
+
+	def submit_chunked(self, step: Callable[[sqlite3.Connection], bool]) -> "Future[int]":
+		"""Queue a long job. step(conn) does one chunk and returns True while more remain.
+
+		Each chunk is its own transaction; the Future resolves to the number of chunks.
+		"""
+		if self._in_writer():
+			raise RuntimeError("chunked jobs cannot be submitted from inside a writer job")
+		job = _Job(step, chunked=True)
+		self._ensure_started()
+		self._queue.put(job)
+		WRITER_QUEUE_DEPTH.set(self._queue.qsize())
+		return job.future
+
+	def run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+		"""Submit a small write and wait for its result."""
+		return self.submit(fn).result()
+
+	def run_chunked(self, step: Callable[[sqlite3.Connection], bool]) -> int:
+		return self.submit_chunked(step).result()
+
+	def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+		"""Run one statement through the writer; returns its rowcount."""
+		return self.run(lambda conn: conn.execute(sql, params).rowcount)
+
+	def executemany(self, sql: str, rows: Sequence[Sequence[Any]]) -> int:
+		return self.run(lambda conn: conn.executemany(sql, rows).rowcount)
+
+	def stop(self, timeout: float = 5.0) -> None:
+		"""Finish queued jobs and stop the thread."""
+		if self._thread is None or not self._thread.is_alive():
+			return
+		self._queue.put(None)
+		self._thread.join(timeout)
+
+	def _take_batch(self, first: _Job) -> List[_Job]:
+		batch = [first]
+		deadline = time.monotonic() + self.batch_window
+		while len(batch) < self.batch_max:
+			try:
+				job = self._queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+			except queue.Empty:
+				break
+			if job is None or job.chunked:
+				# Long jobs and the stop marker go back behind this batch
+				self._queue.put(job)
+				break
+			batch.append(job)
+		return batch
+
+	def _commit_batch(self, batch: List[_Job]) -> None:
+		conn = self._conn
+		started = time.perf_counter()
+		results = []
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			for i, job in enumerate(batch):
+				conn.execute(f"SAVEPOINT job{i}")
+				try:
+					results.append((job, job.fn(conn), None))
+					conn.execute(f"RELEASE job{i}")
+				except Exception as e:
+					conn.execute(f"ROLLBACK TO job{i}")
+					conn.execute(f"RELEASE job{i}")
+					results.append((job, None, e))
+			conn.execute("COMMIT")
+		except Exception as e:
+			if conn.in_transaction:
+				conn.execute("ROLLBACK")
+			for job in batch:
+				if not job.future.done():
+					job.future.set_exception(e)
+			return
+		finally:
+			WRITER_COMMIT_SECONDS.observe(time.perf_counter() - started)
+			WRITER_BATCH_JOBS.observe(len(batch))
+		for job, result, error in results:
+			if error is not None:
+				job.future.set_exception(error)
+			else:
+				job.future.set_result(result)
+
+	def _run_chunk(self, job: _Job) -> None:
+		conn = self._conn
+		started = time.perf_counter()
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			more = job.fn(conn)
+			conn.execute("COMMIT")
+		except Exception as e:
+			if conn.in_transaction:
+				conn.execute("ROLLBACK")
+			job.future.set_exception(e)
+			return
+		finally:
+			WRITER_COMMIT_SECONDS.observe(time.perf_counter() - started)
+		job.chunks += 1
+		if more:
+			# Back of the queue, so writes submitted meanwhile are not starved
+			self._queue.put(job)
+		else:
+			job.future.set_result(job.chunks)
+
+	def _loop(self) -> None:
+		self._conn = _connect()
+		try:
+			while True:
+				job = self._queue.get()
+				if job is None:
+					return
+				if job.chunked:
+					self._run_chunk(job)
+				else:
+					self._commit_batch(self._take_batch(job))
+				WRITER_QUEUE_DEPTH.set(self._queue.qsize())
+		except Exception:
+			logging.exception("Database writer stopped")
+			raise
+		finally:
+			self._conn.close()
+			self._conn = None
+
+
+db_writer = DatabaseWriter()
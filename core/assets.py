@@ -0,0 +1,84 @@
+"""
+Registry of tracked reserve-backed tokens.
+Each asset has a key (stored as asset_key on every snapshot table), its mint and the
+wallets holding its reserve. The asset configured in asrsv_config.py is registered
+under DEFAULT_ASSET_KEY on first use, so a single-asset deployment needs no setup.
+"""
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from app.db import DEFAULT_ASSET_KEY, _connect
+from app.writer import db_writer
+from asrsv_config import ASSET_MINT, RESERVE_WALLETS
+
+
+def _row_to_asset(row) -> Dict[str, Any]:
+	asset = dict(row)
+	asset["reserve_wallets"] = json.loads(asset["reserve_wallets"] or "[]")
+	asset["enabled"] = bool(asset["enabled"])
+	return asset
+
+
+def _seed_default(conn) -> None:
+	if conn.execute("SELECT 1 FROM assets WHERE asset_key = ?", (DEFAULT_ASSET_KEY,)).fetchone():
+		return
+	db_writer.execute(
+		"""
+		INSERT OR IGNORE INTO assets (asset_key, mint, symbol, reserve_wallets, enabled, created_at)
+		VALUES (?, ?, ?, ?, 1, ?)
+		""",
+		(DEFAULT_ASSET_KEY, ASSET_MINT, DEFAULT_ASSET_KEY.upper(), json.dumps(RESERVE_WALLETS), time.time()),
+	)
+
+
+def load_assets(enabled_only: bool = True) -> List[Dict[str, Any]]:
+	"""Registered assets ordered by key (the configured default is always present)."""
+	conn = _connect()
+	try:
+		_seed_default(conn)
+		rows = conn.execute(
+			f"""
+			SELECT asset_key, mint, symbol, reserve_wallets, enabled, created_at
+			FROM assets {"WHERE enabled = 1" if enabled_only else ""}
+			ORDER BY asset_key
+			"""
+		).fetchall()
+	finally:
+		conn.close()
+	return [_row_to_asset(r) for r in rows]
+
+
+def get_asset(asset_key: str) -> Optional[Dict[str, Any]]:
+	conn = _connect()
+	try:
+		_seed_default(conn)
+		row = conn.execute(
+			"SELECT asset_key, mint, symbol, reserve_wallets, enabled, created_at FROM assets WHERE asset_key = ?",
+			(asset_key,),
+		).fetchone()
+	finally:
+		conn.close()
+	return _row_to_asset(row) if row else None
+
+
+def add_asset(asset_key: str, mint: str, reserve_wallets: List[str], symbol: Optional[str] = None,
+		enabled: bool = True) -> Dict[str, Any]:
+	"""Register an asset, or update the mint, wallets and symbol of an existing one."""
+	db_writer.execute(
+		"""
+		INSERT INTO assets (asset_key, mint, symbol, reserve_wallets, enabled, created_at)
+		VALUES (?, ?, ?, ?, ?, ?)
+		ON CONFLICT(asset_key) DO UPDATE SET
+		  mint = excluded.mint,
+		  symbol = excluded.symbol,
+		  reserve_wallets = excluded.reserve_wallets,
+		  enabled = excluded.enabled
+		""",
+		(
+			asset_key, mint, symbol or asset_key.upper(),
+			json.dumps([w.strip() for w in reserve_wallets if w and w.strip()]),
+			1 if enabled else 0, time.time(),
+		),
+	)
+	return get_asset(asset_key)
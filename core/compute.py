@@ -0,0 +1,92 @@
+"""
+Columnar fee/yield engine shared by snapshot_once and bulk historical recomputes.
+Inputs are equal-length arrays (one entry per pool row); every derived column is
+produced in a single NumPy pass instead of a Python loop per pool.
+"""
+from typing import Dict, Sequence
+
+import numpy as np
+
+DAYS_PER_YEAR = 365.0
+
+# Columns produced by pool_metrics, in pool_snapshots naming
+POOL_METRIC_COLUMNS = (
+	"real_tvl_usd",
+	"gross_fee_24h_usd",
+	"protocol_fee_24h_usd",
+	"fee_24h_usd",
+	"daily_yield",
+	"apy_simple",
+	"apy_compound",
+)
+
+
+def _array(values: Sequence[float]) -> np.ndarray:
+	return np.nan_to_num(np.asarray(values, dtype=np.float64))
+
+
+def compound_apy(daily_yield: np.ndarray) -> np.ndarray:
+	"""(1 + daily)^365 - 1 for positive yields, 0 otherwise."""
+	positive = daily_yield > 0
+	return np.where(positive, np.power(1.0 + np.where(positive, daily_yield, 0.0), DAYS_PER_YEAR) - 1.0, 0.0)
+
+
+def pool_metrics(liquidity_usd: Sequence[float], volume_24h_usd: Sequence[float],
+		fee_rate: Sequence[float], protocol_cut: Sequence[float]) -> Dict[str, np.ndarray]:
+	"""Per-pool TVL, gross/protocol/net fees, daily yield and simple/compound APY.
+
+	Real TVL is half the quoted liquidity (the quote side of the pool), and yields are
+	measured against it.
+	"""
+	liquidity = _array(liquidity_usd)
+	volume = _array(volume_24h_usd)
+	rate = _array(fee_rate)
+	cut = _array(protocol_cut)
+
+	real_tvl = liquidity / 2.0
+	gross = volume * rate
+	protocol = gross * cut
+	net = gross - protocol
+	safe_tvl = np.where(real_tvl > 0, real_tvl, 1.0)
+	daily_yield = np.where(real_tvl > 0, net / safe_tvl, 0.0)
+
+	return {
+		"real_tvl_usd": real_tvl,
+		"gross_fee_24h_usd": gross,
+		"protocol_fee_24h_usd": protocol,
+		"fee_24h_usd": net,
+		"daily_yield": daily_yield,
+		"apy_simple": daily_yield * DAYS_PER_YEAR,
+		"apy_compound": compound_apy(daily_yield),
+	}
+
+
+def portfolio_metrics(total_fees_24h_usd: float, total_real_tvl_usd: float) -> Dict[str, float]:
+	"""Portfolio daily yield and APYs from summed net fees and real TVL."""
+	daily = (total_fees_24h_usd / total_real_tvl_usd) if total_real_tvl_usd > 0 else 0.0
+	return {
+		"real_yield_daily": daily,
+		"apy_simple": daily * DAYS_PER_YEAR,
+		"apy_compound": float(compound_apy(np.array([daily]))[0]),
+	}
+
+
+def grouped_portfolio_metrics(group_keys: Sequence[str], fee_24h_usd: Sequence[float],
+		real_tvl_usd: Sequence[float]) -> Dict[str, Dict[str, float]]:
+	"""portfolio_metrics for many snapshots at once, keyed by e.g. ts_utc."""
+	keys, inverse = np.unique(np.asarray(group_keys), return_inverse=True)
+	fees = np.bincount(inverse, weights=_array(fee_24h_usd), minlength=len(keys))
+	tvl = np.bincount(inverse, weights=_array(real_tvl_usd), minlength=len(keys))
+	safe_tvl = np.where(tvl > 0, tvl, 1.0)
+	daily = np.where(tvl > 0, fees / safe_tvl, 0.0)
+	apy_comp = compound_apy(daily)
+	return {
+		str(k): {
+			"fees_24h_usd": float(fees[i]),
+			"real_tvl_usd": float(tvl[i]),
+			"real_yield_daily": float(daily[i]),
+			"apy_simple": float(daily[i] * DAYS_PER_YEAR),
+			"apy_compound": float(apy_comp[i]),
+		}
+		for i, k in enumerate(keys)
+	}
@@ -0,0 +1,102 @@
+"""
+Versioned fee policy.
+Each row of fee_policies says which fee rates and protocol cuts apply to snapshots
+taken at or after its effective_from timestamp. snapshot_once uses the policy in
+force now; scripts.recompute_fees re-derives stored history from the same table.
+"""
+import datetime
+import time
+from typing import Any, Dict, List, Optional
+
+from app.db import _connect
+from app.writer import db_writer
+
+# Version 1 policy (the original hard-coded rates)
+DEFAULT_FEE_RATE = 0.01
+USDC_FEE_RATE    = 0.0025
+
+PROTOCOL_CUT_METEORA = 0.20
+
+BASELINE_POLICY = {
+	"version": 1,
+	"effective_from": "1970-01-01T00:00:00Z",
+	"default_fee_rate": DEFAULT_FEE_RATE,
+	"usdc_fee_rate": USDC_FEE_RATE,
+	"meteora_protocol_cut": PROTOCOL_CUT_METEORA,
+	"note": "baseline",
+}
+
+
+def fee_rate_for_pair(family: str, quote_symbol: str, policy: Optional[Dict[str, Any]] = None) -> float:
+	policy = policy or BASELINE_POLICY
+	qs = (quote_symbol or "").upper()
+	fam = (family or "").lower()
+	if qs == "USDC" or "usdc" in fam:
+		return float(policy["usdc_fee_rate"])
+	return float(policy["default_fee_rate"])
+
+
+def protocol_cut_for_source(source: str, policy: Optional[Dict[str, Any]] = None) -> float:
+	policy = policy or BASELINE_POLICY
+	return float(policy["meteora_protocol_cut"]) if "meteora" in (source or "").lower() else 0.0
+
+
+def load_policies() -> List[Dict[str, Any]]:
+	"""All policies ordered by effective_from; seeds the baseline on first use."""
+	conn = _connect()
+	try:
+		if not conn.execute("SELECT 1 FROM fee_policies WHERE version = ?", (BASELINE_POLICY["version"],)).fetchone():
+			db_writer.execute(
+				"""
+				INSERT OR IGNORE INTO fee_policies
+				(version, effective_from, default_fee_rate, usdc_fee_rate, meteora_protocol_cut, note, created_at)
+				VALUES (:version, :effective_from, :default_fee_rate, :usdc_fee_rate, :meteora_protocol_cut, :note, 0)
+				""",
+				BASELINE_POLICY,
+			)
+		rows = conn.execute(
+			"""
+			SELECT version, effective_from, default_fee_rate, usdc_fee_rate, meteora_protocol_cut, note
+			FROM fee_policies
+			ORDER BY effective_from, version
+			"""
+		).fetchall()
+	finally:
+		conn.close()
+	return [dict(r) for r in rows]
+
+
+def policy_for_ts(policies: List[Dict[str, Any]], ts_utc: str) -> Dict[str, Any]:
+	"""The last policy whose effective_from is at or before ts_utc."""
+	current = policies[0] if policies else BASELINE_POLICY
+	for p in policies:
+		if p["effective_from"] <= ts_utc:
+			current = p
+		else:
+			break
+	return current
+
+
+def current_policy() -> Dict[str, Any]:
+	now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+	return policy_for_ts(load_policies(), now)
+
+
+def add_policy(effective_from: str, default_fee_rate: float, usdc_fee_rate: float,
+		meteora_protocol_cut: float, note: str = "") -> int:
+	"""Insert a new policy version and return its number."""
+	load_policies()
+
+	def insert(conn):
+		version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM fee_policies").fetchone()[0]
+		conn.execute(
+			"""
+			INSERT INTO fee_policies
+			(version, effective_from, default_fee_rate, usdc_fee_rate, meteora_protocol_cut, note, created_at)
+			VALUES (?, ?, ?, ?, ?, ?, ?)
+			""",
+			(version, effective_from, default_fee_rate, usdc_fee_rate, meteora_protocol_cut, note, time.time()),
+		)
+		return int(version)
+
+	return db_writer.run(insert)
@@ -0,0 +1,274 @@
+"""
+Buffered snapshot ingestion.
+With ASRSV_INGEST_BUFFER=1, snapshot_once hands its computed rows to ingest_buffer
+instead of staging and publishing them itself. The buffer publishes everything
+pending in one writer job every ASRSV_INGEST_FLUSH_SECONDS, or sooner once
+ASRSV_INGEST_FLUSH_ROWS rows are waiting, so high-frequency sampling pays one
+transaction per flush instead of several per snapshot.
+
+ASRSV_INGEST_DURABILITY says when a buffered snapshot counts as acknowledged:
+  log     appended and fsync'd to this process's log in ASRSV_INGEST_LOG_DIR (default);
+          logs left behind by a dead process are replayed when the buffer next starts,
+          except snapshots older than what their asset has published since
+  commit  published to the database (snapshot_once waits for the flush, and raises if
+          its snapshot was not published)
+  memory  once buffered; a crash loses up to one flush window
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.db import DB_PATH
+from app.publish import publish_after_snapshot
+from app.writer import db_writer
+from core.staging import ValidationError, publish_rows
+
+INGEST_ENABLED = os.getenv("ASRSV_INGEST_BUFFER", "0") == "1"
+INGEST_FLUSH_SECONDS = float(os.getenv("ASRSV_INGEST_FLUSH_SECONDS", "5"))
+INGEST_FLUSH_ROWS = int(os.getenv("ASRSV_INGEST_FLUSH_ROWS", "1000"))
+INGEST_DURABILITY = os.getenv("ASRSV_INGEST_DURABILITY", "log")
+INGEST_LOG_DIR = os.getenv("ASRSV_INGEST_LOG_DIR", "ingest_log")
+
+DURABILITY_MODES = ("log", "commit", "memory")
+
+
+def _record_failed(conn, e: Dict[str, Any], err: Exception) -> None:
+	logging.error(f"Buffered {e['asset_key']} snapshot {e['ts']} not published: {err}")
+	conn.execute(
+		"""
+		INSERT OR REPLACE INTO snapshot_runs (run_id, asset_key, status, ts_utc, error, started_at, updated_at)
+		VALUES (?, ?, 'failed', ?, ?, ?, ?)
+		""",
+		(e["run_id"], e["asset_key"], e["ts"], str(err), time.time(), time.time()),
+	)
+
+
+def _apply_entries(conn, entries: List[Dict[str, Any]],
+		replay: bool = False) -> Tuple[int, Dict[str, Exception]]:
+	"""Publish buffered snapshots in order; a snapshot that fails is recorded as a failed run.
+
+	Returns the number published and the error of each failed run by run id. When
+	replaying a log, a snapshot no newer than its asset's latest published one is
+	rejected: its totals would be computed against a later pool state.
+	"""
+	published = 0
+	failed: Dict[str, Exception] = {}
+	for e in entries:
+		if replay:
+			known = conn.execute("SELECT 1 FROM snapshot_runs WHERE run_id = ?", (e["run_id"],)).fetchone()
+			latest = conn.execute(
+				"SELECT MAX(ts_utc) FROM metrics_snapshots WHERE asset_key = ?", (e["asset_key"],)
+			).fetchone()[0]
+			if not known and latest is not None and e["ts"] <= latest:
+				failed[e["run_id"]] = ValidationError(f"replayed snapshot is not newer than the published {latest}")
+				_record_failed(conn, e, failed[e["run_id"]])
+				continue
+		conn.execute("SAVEPOINT ingest_entry")
+		try:
+			if publish_rows(conn, e["run_id"], e["asset_key"], e["ts"], e["rows"], e["summary"]):
+				published += 1
+			conn.execute("RELEASE ingest_entry")
+		except Exception as err:
+			conn.execute("ROLLBACK TO ingest_entry")
+			conn.execute("RELEASE ingest_entry")
+			failed[e["run_id"]] = err
+			_record_failed(conn, e, err)
+	return published, failed
+
+
+def _sync_database() -> None:
+	# Commits are not fsync'd under synchronous=NORMAL; make them durable before a log is dropped
+	for path in (f"{DB_PATH}-wal", DB_PATH):
+		try:
+			fd = os.open(path, os.O_RDONLY)
+		except FileNotFoundError:
+			continue
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+
+
+class IngestBuffer:
+	"""In-memory snapshot buffer with group-committed flushes and an optional append log."""
+
+	def __init__(self, flush_seconds: Optional[float] = None, flush_rows: Optional[int] = None,
+			durability: Optional[str] = None, log_dir: Optional[str] = None) -> None:
+		self.flush_seconds = INGEST_FLUSH_SECONDS if flush_seconds is None else float(flush_seconds)
+		self.flush_rows = max(int(flush_rows or INGEST_FLUSH_ROWS), 1)
+		self.durability = durability or INGEST_DURABILITY
+		if self.durability not in DURABILITY_MODES:
+			raise ValueError(f"ASRSV_INGEST_DURABILITY must be one of {DURABILITY_MODES}, got '{self.durability}'")
+		self.log_dir = log_dir or INGEST_LOG_DIR
+		self._lock = threading.Lock()
+		self._flush_lock = threading.Lock()
+		self._wake = threading.Event()
+		self._pending: List[Tuple[Dict[str, Any], Optional[Future]]] = []
+		self._pending_rows = 0
+		# Open logs holding the pending entries, oldest first; the last one takes appends
+		self._logs: List[Tuple[Any, str]] = []
+		self._log_open = False
+		self._thread: Optional[threading.Thread] = None
+		self._pid = os.getpid()
+		atexit.register(self.close)
+
+	def _ensure_started(self) -> None:
+		if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+			return
+		with self._lock:
+			if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+				return
+			if self._pid != os.getpid():
+				# A forked child must not append to, or flush, its parent's buffer
+				self._pid = os.getpid()
+				self._pending, self._pending_rows, self._logs, self._log_open = [], 0, [], False
+			self._thread = threading.Thread(target=self._loop, name="ingest-flush", daemon=True)
+			self._thread.start()
+		self.recover()
+
+	def _append(self, line: str) -> None:
+		if not self._log_open:
+			os.makedirs(self.log_dir, exist_ok=True)
+			path = os.path.join(self.log_dir, f"ingest-{os.getpid()}-{uuid.uuid4().hex[:8]}.log")
+			fh = open(f"{path}.new", "a", encoding="utf-8")
+			# Held until the log is flushed, so recover() in another process leaves it alone;
+			# the log only gets its .log name once locked
+			fcntl.flock(fh, fcntl.LOCK_EX)
+			os.rename(f"{path}.new", path)
+			self._logs.append((fh, path))
+			self._log_open = True
+		fh = self._logs[-1][0]
+		fh.write(line)
+		fh.flush()
+		os.fsync(fh.fileno())
+
+	def add(self, asset_key: str, ts: str, rows: List[Dict[str, Any]], summary: Dict[str, Any]) -> str:
+		"""Buffer one computed snapshot; returns its run id once it is acknowledged."""
+		self._ensure_started()
+		entry = {"run_id": uuid.uuid4().hex, "asset_key": asset_key, "ts": ts, "rows": rows, "summary": summary}
+		waiter: Optional[Future] = Future() if self.durability == "commit" else None
+		with self._lock:
+			if self.durability == "log":
+				self._append(json.dumps(entry) + "\n")
+			self._pending.append((entry, waiter))
+			self._pending_rows += len(rows) + 1
+			full = self._pending_rows >= self.flush_rows
+		if full:
+			self._wake.set()
+		if waiter is not None:
+			waiter.result()
+		return entry["run_id"]
+
+	def pending(self) -> int:
+		with self._lock:
+			return len(self._pending)
+
+	def flush(self) -> int:
+		"""Publish everything buffered in one writer job; returns the number of snapshots published."""
+		with self._flush_lock:
+			with self._lock:
+				batch, logs = self._pending, self._logs
+				self._pending, self._pending_rows, self._logs, self._log_open = [], 0, [], False
+			if not batch:
+				return 0
+			try:
+				published, failed = db_writer.run(lambda conn: _apply_entries(conn, [e for e, _ in batch]))
+			except Exception as err:
+				# Snapshots with a waiter fail back to it; everything else is kept, ahead
+				# of what arrived meanwhile, for the next flush
+				kept = [(e, waiter) for e, waiter in batch if waiter is None]
+				with self._lock:
+					self._pending = kept + self._pending
+					self._pending_rows += sum(len(e["rows"]) + 1 for e, _ in kept)
+					self._logs = logs + self._logs
+				for _, waiter in batch:
+					if waiter is not None:
+						waiter.set_exception(err)
+				raise
+			if logs:
+				_sync_database()
+				for fh, path in logs:
+					os.unlink(path)
+					fh.close()
+			for e, waiter in batch:
+				if waiter is None:
+					continue
+				if e["run_id"] in failed:
+					waiter.set_exception(failed[e["run_id"]])
+				else:
+					waiter.set_result(None)
+		# Outside the flush lock: rendering must not hold up the next flush
+		for asset_key in sorted({e["asset_key"] for e, _ in batch}):
+			publish_after_snapshot(asset_key)
+		return published
+
+	def recover(self) -> int:
+		"""Replay logs left by processes that died before flushing; returns snapshots published."""
+		if not os.path.isdir(self.log_dir):
+			return 0
+		with self._lock:
+			own = {path for _, path in self._logs}
+		logs = []
+		for name in os.listdir(self.log_dir):
+			path = os.path.join(self.log_dir, name)
+			if name.endswith(".log") and path not in own:
+				try:
+					logs.append((os.path.getmtime(path), path))
+				except FileNotFoundError:
+					pass
+		published = 0
+		replayed = set()
+		for _, path in sorted(logs):
+			try:
+				fh = open(path, "r", encoding="utf-8")
+			except FileNotFoundError:
+				continue
+			with fh:
+				try:
+					fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				except OSError:
+					continue  # its owner is still running
+				if not os.path.exists(path):
+					continue  # replayed by another process while we waited
+				entries = []
+				for line in fh:
+					try:
+						entries.append(json.loads(line))
+					except ValueError:
+						# A torn final line was never acknowledged
+						logging.warning(f"Skipping unreadable line in {path}")
+				if entries:
+					# Runs a log shares with the database were flushed already and are skipped
+					count, _ = db_writer.run(lambda conn: _apply_entries(conn, entries, replay=True))
+					published += count
+					_sync_database()
+					replayed.update(e["asset_key"] for e in entries)
+				os.unlink(path)
+				logging.info(f"Replayed {len(entries)} buffered snapshot(s) from {path}")
+		for asset_key in sorted(replayed):
+			publish_after_snapshot(asset_key)
+		return published
+
+	def close(self) -> None:
+		"""Flush what is left; the process is about to exit."""
+		if self._pid == os.getpid():
+			self.flush()
+
+	def _loop(self) -> None:
+		while True:
+			self._wake.wait(self.flush_seconds)
+			self._wake.clear()
+			try:
+				self.flush()
+			except Exception:
+				logging.exception("Ingest buffer flush failed; retrying at the next interval")
+
+
+ingest_buffer = IngestBuffer()
@@ -0,0 +1,121 @@
+"""
+Registry of known markets (pools) per asset; a pool backing two assets has an entry for each.
+Full discovery (BirdEye markets v2) records every pool's static attributes here:
+mints, symbols, source and family name. Routine snapshots then refresh only the
+volatile fields (liquidity, 24h volume) for the active pools. Pools that drop out of
+a discovery run are marked inactive rather than deleted. Token vaults and decimals
+for on-chain reserve reads (core/onchain.py) are filled in as they are learned.
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+from app.db import DEFAULT_ASSET_KEY, _connect
+from app.writer import db_writer
+
+
+def load_markets(active_only: bool = True, asset_key: str = DEFAULT_ASSET_KEY) -> List[Dict[str, Any]]:
+	"""Registry entries of one asset ordered by their liquidity rank at the last discovery."""
+	conn = _connect()
+	try:
+		rows = conn.execute(
+			f"""
+			SELECT pool_address, name, source, base_mint, base_symbol, quote_mint, quote_symbol,
+			       liquidity_rank, active, first_seen, last_discovered,
+			       token_a_mint, token_b_mint, token_a_vault, token_b_vault, token_a_decimals, token_b_decimals
+			FROM market_registry
+			WHERE asset_key = ? {"AND active = 1" if active_only else ""}
+			ORDER BY liquidity_rank, pool_address
+			""",
+			(asset_key,),
+		).fetchall()
+	finally:
+		conn.close()
+	return [dict(r) for r in rows]
+
+
+def last_discovery(asset_key: str = DEFAULT_ASSET_KEY) -> float:
+	"""Unix time of the asset's most recent full discovery, 0.0 if there has been none."""
+	conn = _connect()
+	try:
+		row = conn.execute("SELECT MAX(last_discovered) FROM market_registry WHERE asset_key = ?", (asset_key,)).fetchone()
+	finally:
+		conn.close()
+	return float(row[0] or 0.0) if row else 0.0
+
+
+def record_discovery(items: List[Dict[str, Any]], discovered_at: Optional[float] = None,
+		asset_key: str = DEFAULT_ASSET_KEY) -> None:
+	"""Upsert the markets from an asset's full discovery and deactivate its pools no longer listed."""
+	discovered_at = discovered_at or time.time()
+
+	def upsert(conn):
+		for rank, it in enumerate(items):
+			if not it.get("address"):
+				continue
+			base = it.get("base") or {}
+			quote = it.get("quote") or {}
+			conn.execute(
+				"""
+				INSERT INTO market_registry
+				(pool_address, asset_key, name, source, base_mint, base_symbol, quote_mint, quote_symbol,
+				 liquidity_rank, active, first_seen, last_discovered)
+				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+				ON CONFLICT(asset_key, pool_address) DO UPDATE SET
+				  name = excluded.name,
+				  source = excluded.source,
+				  base_mint = excluded.base_mint,
+				  base_symbol = excluded.base_symbol,
+				  quote_mint = excluded.quote_mint,
+				  quote_symbol = excluded.quote_symbol,
+				  liquidity_rank = excluded.liquidity_rank,
+				  active = 1,
+				  last_discovered = excluded.last_discovered
+				""",
+				(
+					it["address"], asset_key, it.get("name") or "", it.get("source") or "",
+					base.get("address") or "", base.get("symbol") or "",
+					quote.get("address") or "", quote.get("symbol") or "",
+					rank, discovered_at, discovered_at,
+				),
+			)
+		conn.execute(
+			"UPDATE market_registry SET active = 0 WHERE asset_key = ? AND (last_discovered IS NULL OR last_discovered < ?)",
+			(asset_key, discovered_at),
+		)
+
+	db_writer.run(upsert)
+
+
+POOL_TOKEN_FIELDS = ("token_a_mint", "token_b_mint", "token_a_vault", "token_b_vault", "token_a_decimals", "token_b_decimals")
+
+
+def record_pool_tokens(reserves: Dict[str, Dict[str, Any]]) -> None:
+	"""Store pool token mints, vaults and decimals from reserve lookups; missing fields keep their value."""
+	updates = []
+	for addr, r in reserves.items():
+		values = [r.get(f) if r.get(f) not in ("", None) else None for f in POOL_TOKEN_FIELDS]
+		if any(v is not None for v in values):
+			updates.append(values + [addr])
+	if not updates:
+		return
+	db_writer.executemany(
+		f"""
+		UPDATE market_registry SET
+		{", ".join(f"{f} = COALESCE(?, {f})" for f in POOL_TOKEN_FIELDS)}
+		WHERE pool_address = ?
+		""",
+		updates,
+	)
+
+
+def market_item(entry: Dict[str, Any], liquidity: float, volume24h: float) -> Dict[str, Any]:
+	"""A registry entry plus fresh volatile fields, in the BirdEye markets v2 item shape."""
+	return {
+		"address": entry["pool_address"],
+		"name": entry["name"],
+		"source": entry["source"],
+		"base": {"address": entry["base_mint"], "symbol": entry["base_symbol"]},
+		"quote": {"address": entry["quote_mint"], "symbol": entry["quote_symbol"]},
+		"liquidity": liquidity,
+		"volume24h": volume24h,
+	}
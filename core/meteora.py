@@ -0,0 +1,108 @@
+"""
+Meteora DAMM v2 pool reserve client.
+Reserves for many pools are fetched concurrently (bounded by ASRSV_METEORA_CONCURRENCY)
+so the pool_reserves stage costs roughly one round trip instead of one per pool.
+Successful lookups are kept for ASRSV_METEORA_CACHE_TTL seconds.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.metrics import cache_result
+from core.upstream import UNAVAILABLE_ERRORS, http_json
+
+METEORA_API = "https://dammv2-api.meteora.ag"
+
+METEORA_CONCURRENCY = int(os.getenv("ASRSV_METEORA_CONCURRENCY", "8"))
+METEORA_CACHE_TTL = float(os.getenv("ASRSV_METEORA_CACHE_TTL", "60"))
+
+
+def parse_pool_reserves(response: Any) -> Dict[str, Any]:
+	"""Reserve fields from a /pools/{address} response; {} if the payload has no data."""
+	if not response or not isinstance(response, dict) or "data" not in response:
+		return {}
+	data = response["data"]
+	return {
+		"token_a_amount": float(data.get("token_a_amount", 0)),
+		"token_b_amount": float(data.get("token_b_amount", 0)),
+		"token_a_amount_usd": float(data.get("token_a_amount_usd", 0)),
+		"token_b_amount_usd": float(data.get("token_b_amount_usd", 0)),
+		"token_a_mint": data.get("token_a_mint", ""),
+		"token_b_mint": data.get("token_b_mint", ""),
+		"token_a_symbol": data.get("token_a_symbol", ""),
+		"token_b_symbol": data.get("token_b_symbol", ""),
+		"token_a_vault": data.get("token_a_vault", ""),
+		"token_b_vault": data.get("token_b_vault", ""),
+	}
+
+
+class MeteoraClient:
+	"""Concurrent, TTL-cached pool reserve lookups against the Meteora DAMM v2 API."""
+
+	def __init__(self, concurrency: Optional[int] = None, cache_ttl: Optional[float] = None) -> None:
+		self.concurrency = max(int(concurrency or METEORA_CONCURRENCY), 1)
+		self.cache_ttl = METEORA_CACHE_TTL if cache_ttl is None else float(cache_ttl)
+		self._cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+		self._lock = threading.Lock()
+
+	def _cached(self, pool_address: str) -> Optional[Dict[str, Any]]:
+		with self._lock:
+			hit = self._cache.get(pool_address)
+		if hit and (time.time() - hit[0]) < self.cache_ttl:
+			return hit[1]
+		return None
+
+	def _fetch(self, pool_address: str) -> Dict[str, Any]:
+		try:
+			response = http_json("GET", f"{METEORA_API}/pools/{pool_address}", headers={"accept": "application/json"}, retries=2)
+			reserves = parse_pool_reserves(response)
+		except UNAVAILABLE_ERRORS as e:
+			# Meteora being down sends the collector to its stale payload; a 4xx is this pool's problem
+			status = getattr(getattr(e, "response", None), "status_code", None)
+			if status is None or status >= 500 or status == 429:
+				raise
+			logging.warning(f"Failed to fetch Meteora reserves for {pool_address}: {e}")
+			return {}
+		except Exception as e:
+			logging.warning(f"Failed to fetch Meteora reserves for {pool_address}: {e}")
+			return {}
+		if reserves:
+			with self._lock:
+				self._cache[pool_address] = (time.time(), reserves)
+		return reserves
+
+	def get_pool_reserves(self, pool_address: str) -> Dict[str, Any]:
+		return self.get_pool_reserves_many([pool_address]).get(pool_address, {})
+
+	def get_pool_reserves_many(self, pool_addresses: List[str]) -> Dict[str, Dict[str, Any]]:
+		"""Reserves per pool address; pools Meteora has no data for map to {}.
+
+		Raises UNAVAILABLE_ERRORS when Meteora itself is unreachable or failing.
+		"""
+		out: Dict[str, Dict[str, Any]] = {}
+		missing: List[str] = []
+		for addr in dict.fromkeys(a for a in pool_addresses if a):
+			hit = self._cached(addr)
+			cache_result("meteora", hit is not None)
+			if hit is not None:
+				out[addr] = hit
+			else:
+				missing.append(addr)
+
+		if len(missing) == 1:
+			out[missing[0]] = self._fetch(missing[0])
+		elif missing:
+			with ThreadPoolExecutor(max_workers=min(self.concurrency, len(missing)), thread_name_prefix="meteora") as pool:
+				for addr, reserves in zip(missing, pool.map(self._fetch, missing)):
+					out[addr] = reserves
+		return out
+
+	def clear(self) -> None:
+		with self._lock:
+			self._cache.clear()
+
+
+meteora_client = MeteoraClient()
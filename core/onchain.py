@@ -0,0 +1,102 @@
+"""
+On-chain pool reserve reader (ASRSV_RESERVE_ENGINE=onchain).
+Reads each pool's two token vaults with one batched getMultipleAccounts call (up to
+100 accounts per request) and decodes the SPL token amounts locally, instead of
+asking the Meteora REST API about every pool. Vault addresses come from the Meteora
+API and are kept in market_registry. Mint decimals are read once and stored there too.
+
+The RPC transport is passed in as a callable(method, params) -> JSON-RPC response,
+so recorded responses can be replayed without the network:
+
+    recorded = json.load(open("getMultipleAccounts.json"))
+    read_pool_reserves(pools, lambda method, params: recorded, prices={})
+"""
+import base64
+import struct
+from typing import Any, Callable, Dict, List, Optional
+
+MAX_ACCOUNTS_PER_CALL = 100
+
+# SPL Token account: mint (32) | owner (32) | amount u64 LE (8) | ...
+TOKEN_AMOUNT_OFFSET = 64
+# SPL Mint: mint_authority option (36) | supply u64 (8) | decimals u8 (1) | ...
+MINT_DECIMALS_OFFSET = 44
+
+Rpc = Callable[[str, Any], Any]
+
+
+def decode_token_amount(data: bytes) -> int:
+	"""Raw amount from SPL token account data."""
+	return struct.unpack_from("<Q", data, TOKEN_AMOUNT_OFFSET)[0]
+
+
+def decode_mint_decimals(data: bytes) -> int:
+	"""Decimals from SPL mint account data."""
+	return data[MINT_DECIMALS_OFFSET]
+
+
+def _account_data(account: Optional[Dict[str, Any]]) -> Optional[bytes]:
+	if not account:
+		return None
+	data = account.get("data")
+	if isinstance(data, list) and data and data[-1] == "base64":
+		return base64.b64decode(data[0])
+	return None
+
+
+def get_multiple_accounts(addresses: List[str], rpc: Rpc) -> Dict[str, Optional[bytes]]:
+	"""Raw account data per address (None for missing accounts), batched per call."""
+	unique = list(dict.fromkeys(a for a in addresses if a))
+	out: Dict[str, Optional[bytes]] = {}
+	for i in range(0, len(unique), MAX_ACCOUNTS_PER_CALL):
+		chunk = unique[i:i + MAX_ACCOUNTS_PER_CALL]
+		j = rpc("getMultipleAccounts", [chunk, {"encoding": "base64"}])
+		if not isinstance(j, dict) or "result" not in j:
+			raise RuntimeError(f"getMultipleAccounts failed: {(j or {}).get('error') if isinstance(j, dict) else j}")
+		values = j["result"].get("value") or []
+		if len(values) != len(chunk):
+			raise RuntimeError(f"getMultipleAccounts returned {len(values)} accounts for {len(chunk)} addresses")
+		for addr, acc in zip(chunk, values):
+			out[addr] = _account_data(acc)
+	return out
+
+
+def read_pool_reserves(pools: List[Dict[str, Any]], rpc: Rpc, prices: Dict[str, float]) -> Dict[str, Dict[str, Any]]:
+	"""Reserves for registry pools with known vaults, in the Meteora reserves shape.
+
+	pools are market_registry entries; prices maps mint -> USD price for the *_usd
+	fields (0 when unknown). Decimals read from mint accounts are returned as
+	token_a_decimals/token_b_decimals so the caller can store them.
+	"""
+	accounts: List[str] = []
+	for p in pools:
+		accounts += [p["token_a_vault"], p["token_b_vault"]]
+		for side in ("a", "b"):
+			if p.get(f"token_{side}_decimals") is None:
+				accounts.append(p[f"token_{side}_mint"])
+	data = get_multiple_accounts(accounts, rpc)
+
+	out: Dict[str, Dict[str, Any]] = {}
+	for p in pools:
+		reserves: Dict[str, Any] = {}
+		for side in ("a", "b"):
+			mint = p[f"token_{side}_mint"]
+			vault = data.get(p[f"token_{side}_vault"])
+			decimals = p.get(f"token_{side}_decimals")
+			if decimals is None and data.get(mint) is not None:
+				decimals = decode_mint_decimals(data[mint])
+			if vault is None or decimals is None:
+				reserves = {}
+				break
+			amount = decode_token_amount(vault) / (10 ** int(decimals))
+			symbol = p["base_symbol"] if mint == p.get("base_mint") else p["quote_symbol"] if mint == p.get("quote_mint") else ""
+			reserves.update({
+				f"token_{side}_amount": amount,
+				f"token_{side}_amount_usd": amount * float(prices.get(mint) or 0.0),
+				f"token_{side}_mint": mint,
+				f"token_{side}_symbol": symbol,
+				f"token_{side}_vault": p[f"token_{side}_vault"],
+				f"token_{side}_decimals": int(decimals),
+			})
+		out[p["pool_address"]] = reserves
+	return out
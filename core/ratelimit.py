@@ -0,0 +1,64 @@
+"""
+Per-provider request pacing shared by every collector process.
+Each provider gets a request rate (ASRSV_<PROVIDER>_RPS, 0 disables pacing) and a
+"next free slot" time kept in shared memory. snapshot_all() creates one limiter and
+installs it in every worker of its process pool, so adding processes adds
+throughput without multiplying the request rate any provider sees.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# Requests per second per provider across all collector processes
+PROVIDER_RPS = {
+	"birdeye": float(os.getenv("ASRSV_BIRDEYE_RPS", "15")),
+	"helius": float(os.getenv("ASRSV_HELIUS_RPS", "10")),
+	"meteora": float(os.getenv("ASRSV_METEORA_RPS", "20")),
+}
+
+
+class SharedRateLimiter:
+	"""Spaces calls to each provider at least 1/rps seconds apart, across processes."""
+
+	def __init__(self, rps: Optional[Dict[str, float]] = None, ctx=None) -> None:
+		self.rps = dict(PROVIDER_RPS if rps is None else rps)
+		self.providers = sorted(self.rps)
+		ctx = ctx or multiprocessing.get_context("spawn")
+		self._slots = ctx.Array("d", len(self.providers))
+
+	def acquire(self, provider: str) -> float:
+		"""Block until `provider` may be called; returns the seconds waited."""
+		rps = self.rps.get(provider) or 0.0
+		if rps <= 0:
+			return 0.0
+		i = self.providers.index(provider)
+		with self._slots.get_lock():
+			now = time.time()
+			slot = max(self._slots[i], now)
+			self._slots[i] = slot + 1.0 / rps
+		wait = slot - now
+		if wait > 0:
+			time.sleep(wait)
+		return wait
+
+
+_limiter: Optional[SharedRateLimiter] = None
+_lock = threading.Lock()
+
+
+def install(limiter: SharedRateLimiter) -> None:
+	"""Use `limiter` for this process (the process pool initializer)."""
+	global _limiter
+	_limiter = limiter
+
+
+def acquire(provider: str) -> float:
+	"""Wait for a request slot on the installed limiter, creating a process-local one if none is."""
+	global _limiter
+	if _limiter is None:
+		with _lock:
+			if _limiter is None:
+				_limiter = SharedRateLimiter()
+	return _limiter.acquire(provider)
@@ -1,20 +1,32 @@
-import os, math, time, json, datetime, tempfile, logging
-from typing import Any, Dict, List, Tuple
-import sqlite3
-
-from app.db import migrate, _connect
-from asrsv_config import BIRDEYE_API_KEY, HELIUS_API_KEY, ASSET_MINT, RESERVE_WALLETS
+import os, time, json, datetime, tempfile, logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.db import DEFAULT_ASSET_KEY, migrate, _connect
+from app.metrics import cache_result, observe_stage
+from app.profiling import profiled
+from app.publish import publish_after_snapshot
+from app.writer import db_writer
+from core import ratelimit, upstream
+from core.assets import get_asset, load_assets
+from core.ingest import INGEST_ENABLED, ingest_buffer
+from core.fee_policy import current_policy, fee_rate_for_pair, protocol_cut_for_source
+from core.compute import POOL_METRIC_COLUMNS, pool_metrics, portfolio_metrics
+from core.meteora import meteora_client
+from core.market_registry import last_discovery, load_markets, market_item, record_discovery, record_pool_tokens
+from core.onchain import read_pool_reserves
+from core.staging import (
+	RunHeartbeat, ValidationError, begin_run, fail_run, load_staged, load_staged_collectors, publish, stage_collector,
+	stage_rows,
+)
+from core.upstream import UNAVAILABLE_ERRORS, http_json
+from asrsv_config import BIRDEYE_API_KEY, HELIUS_API_KEY
 
 BIRDEYE_BASE = "https://public-api.birdeye.so"
 HELIUS_RPC   = "https://mainnet.helius-rpc.com"
 
-DEFAULT_FEE_RATE = 0.01
-USDC_FEE_RATE    = 0.0025
-
-PROTOCOL_CUT_METEORA = 0.20
-
-import requests
-
 logging.basicConfig(level=logging.INFO)
 
 
@@ -24,21 +36,6 @@ def _be_headers() -> Dict[str, str]:
 	return {"X-API-KEY": BIRDEYE_API_KEY, "x-chain": "solana", "accept": "application/json"}
 
 
-def http_json(method: str, url: str, headers: Dict[str, str] = None,
-             params: Dict[str, Any] = None, json_body: Any = None,
-             retries: int = 3, backoff: float = 0.9) -> Any:
-	for attempt in range(1, retries + 1):
-		r = requests.request(method, url, headers=headers, params=params, json=json_body, timeout=25)
-		if r.status_code == 429 and attempt < retries:
-			time.sleep(backoff * attempt)
-			continue
-		r.raise_for_status()
-		try:
-			return r.json()
-		except Exception:
-			return r.text
-
-
 def be_markets_v2(token_addr: str, *, sort_by="liquidity", limit=50, time_frame="24h") -> List[Dict[str, Any]]:
 	url = f"{BIRDEYE_BASE}/defi/v2/markets"
 	items: List[Dict[str, Any]] = []
@@ -61,6 +58,20 @@ def be_markets_v2(token_addr: str, *, sort_by="liquidity", limit=50, time_frame=
 	return items
 
 
+def be_pair_overview_multiple(pair_addrs: List[str], batch: int = 20) -> Dict[str, Dict[str, Any]]:
+	"""Liquidity/volume overview for known pairs, keyed by pair address (max 20 per call)."""
+	url = f"{BIRDEYE_BASE}/defi/v3/pair/overview/multiple"
+	out: Dict[str, Dict[str, Any]] = {}
+	for i in range(0, len(pair_addrs), batch):
+		chunk = pair_addrs[i:i + batch]
+		j = http_json("GET", url, headers=_be_headers(), params={"list_address": ",".join(chunk)})
+		data = (j or {}).get("data") or {}
+		for addr, ov in data.items():
+			if isinstance(ov, dict):
+				out[addr] = ov
+	return out
+
+
 def be_price(token_addr: str) -> float:
 	j = http_json("GET", f"{BIRDEYE_BASE}/defi/price", headers=_be_headers(), params={"address": token_addr, "include_liquidity": "true"})
 	data = j.get("data", j) or {}
@@ -83,6 +94,8 @@ def helius_get_token_supply(mint: str) -> float:
 		if val.get("uiAmount") is not None:
 			return float(val["uiAmount"])
 		return float(val["amount"]) / (10 ** int(val["decimals"]))
+	except UNAVAILABLE_ERRORS:
+		raise
 	except Exception:
 		return 0.0
 
@@ -99,6 +112,8 @@ def helius_get_owner_token_balance(owner: str, mint: str) -> float:
 			else:
 				total += float(amt.get("amount", 0)) / (10 ** int(amt.get("decimals", 0)))
 		return total
+	except UNAVAILABLE_ERRORS:
+		raise
 	except Exception:
 		return 0.0
 
@@ -115,35 +130,7 @@ def helius_get_reserve_total(mint: str, reserve_wallets: List[str]) -> float:
 
 def meteora_get_pool_reserves(pool_address: str) -> Dict[str, Any]:
 	"""Fetch actual token reserves from Meteora DAMM v2 API"""
-	try:
-		url = f"https://dammv2-api.meteora.ag/pools/{pool_address}"
-		response = http_json("GET", url, headers={"accept": "application/json"}, retries=2)
-		
-		if not response or "data" not in response:
-			return {}
-		
-		data = response["data"]
-		return {
-			"token_a_amount": float(data.get("token_a_amount", 0)),
-			"token_b_amount": float(data.get("token_b_amount", 0)),
-			"token_a_amount_usd": float(data.get("token_a_amount_usd", 0)),
-			"token_b_amount_usd": float(data.get("token_b_amount_usd", 0)),
-			"token_a_mint": data.get("token_a_mint", ""),
-			"token_b_mint": data.get("token_b_mint", ""),
-			"token_a_symbol": data.get("token_a_symbol", ""),
-			"token_b_symbol": data.get("token_b_symbol", ""),
-		}
-	except Exception as e:
-		logging.warning(f"Failed to fetch Meteora reserves for {pool_address}: {e}")
-		return {}
-
-
-def fee_rate_for_pair(family: str, quote_symbol: str) -> float:
-	qs = (quote_symbol or "").upper()
-	fam = (family or "").lower()
-	if qs == "USDC" or "usdc" in fam:
-		return USDC_FEE_RATE
-	return DEFAULT_FEE_RATE
+	return meteora_client.get_pool_reserves(pool_address)
 
 
 class SnapshotLock:
@@ -180,8 +167,8 @@ class SnapshotLock:
 		self.release()
 
 
-def _get_last_non_zero_value(column: str) -> float:
-	"""Get the last non-zero value for a given column in metrics_snapshots."""
+def _get_last_non_zero_value(column: str, asset_key: str = DEFAULT_ASSET_KEY) -> float:
+	"""Get the last non-zero value for a given column in the asset's metrics_snapshots."""
 	conn = _connect()
 	try:
 		cur = conn.cursor()
@@ -189,10 +176,11 @@ def _get_last_non_zero_value(column: str) -> float:
 			f"""
 			SELECT {column}
 			FROM metrics_snapshots
-			WHERE {column} IS NOT NULL AND {column} > 0
+			WHERE asset_key = ? AND {column} IS NOT NULL AND {column} > 0
 			ORDER BY ts_utc DESC
 			LIMIT 1
-			"""
+			""",
+			(asset_key,),
 		)
 		row = cur.fetchone()
 		return float(row[0]) if row and row[0] else 0.0
@@ -203,60 +191,277 @@ def _get_last_non_zero_value(column: str) -> float:
 		conn.close()
 
 
-def snapshot_once() -> Dict[str, Any]:
-	"""Run a single snapshot, persist into DB, and return the computed summary dict."""
-	migrate()
+STABLE_SYMBOLS = ("USDC", "USDT", "USD", "USDC.E", "USDT.E")
+
+# Minutes a collector's last value is reused before it is fetched again.
+COLLECTOR_CADENCE_MINUTES = {
+	"markets": float(os.getenv("ASRSV_MARKETS_CADENCE_MINUTES", "30")),
+	"supply": float(os.getenv("ASRSV_SUPPLY_CADENCE_MINUTES", "360")),
+	"price": float(os.getenv("ASRSV_PRICE_CADENCE_MINUTES", "1")),
+	"pool_reserves": float(os.getenv("ASRSV_POOL_RESERVES_CADENCE_MINUTES", "30")),
+}
+
+
+# "meteora" asks the Meteora API per pool; "onchain" reads vault accounts via getMultipleAccounts
+RESERVE_ENGINE = os.getenv("ASRSV_RESERVE_ENGINE", "meteora").lower()
+
+# Minutes between full market discoveries; runs in between only refresh known pools.
+DISCOVERY_CADENCE_MINUTES = float(os.getenv("ASRSV_DISCOVERY_CADENCE_MINUTES", "360"))
+
+# Worker processes snapshot_all() spreads assets over (1 runs them serially in-process).
+# Workers' metrics only reach /metrics through PROMETHEUS_MULTIPROC_DIR, so without it the
+# default is to stay in-process.
+COLLECTOR_PROCESSES = int(os.getenv("ASRSV_COLLECTOR_PROCESSES",
+	str(min(os.cpu_count() or 1, 4)) if os.getenv("PROMETHEUS_MULTIPROC_DIR") else "1"))
 
-	# Sanity checks for API keys
-	if not BIRDEYE_API_KEY:
-		logging.warning("BirdEye API key is empty — price/markets may fail.")
-	if not HELIUS_API_KEY:
-		logging.warning("Helius API key is empty — supply/circulating/FDV/MC will be 0.")
 
-	price = be_price(ASSET_MINT)
-	total_supply = helius_get_token_supply(ASSET_MINT)
-	reserve_total = helius_get_reserve_total(ASSET_MINT, RESERVE_WALLETS)
+def _pool_addresses(markets: Dict[str, Any]) -> List[str]:
+	return sorted(it.get("address") or "" for it in markets.get("items", []))
+
+
+def discover_markets(asset: Dict[str, Any]) -> Dict[str, Any]:
+	"""Full top-50 market listing; records the asset's pool set in the market registry."""
+	items = be_markets_v2(asset["mint"], sort_by="liquidity", limit=50, time_frame="24h")
+	if items:
+		record_discovery(items, asset_key=asset["asset_key"])
+	return {"items": items, "mode": "discovery"}
+
+
+def collect_markets(asset: Dict[str, Any]) -> Dict[str, Any]:
+	"""Known pools with fresh liquidity and volume.
+
+	Falls back to full discovery when the registry is empty, the discovery cadence has
+	elapsed, or the overview refresh fails or misses a known pool.
+	"""
+	known = load_markets(asset_key=asset["asset_key"])
+	if not known or (time.time() - last_discovery(asset["asset_key"])) >= DISCOVERY_CADENCE_MINUTES * 60.0:
+		return discover_markets(asset)
+	try:
+		overview = be_pair_overview_multiple([m["pool_address"] for m in known])
+	except Exception as e:
+		logging.warning(f"Pair overview refresh failed, running full discovery: {e}")
+		return discover_markets(asset)
+	missing = [m["pool_address"] for m in known if m["pool_address"] not in overview]
+	if missing:
+		logging.warning(f"Pair overview missing {len(missing)} known pools, running full discovery")
+		return discover_markets(asset)
+
+	items = []
+	for m in known:
+		ov = overview[m["pool_address"]]
+		volume = ov.get("volume_24h", ov.get("volume24h"))
+		items.append(market_item(m, float(ov.get("liquidity") or 0.0), float(volume or 0.0)))
+	items.sort(key=lambda it: it["liquidity"], reverse=True)
+	return {"items": items, "mode": "refresh"}
+
+
+def collect_supply(asset: Dict[str, Any]) -> Dict[str, Any]:
+	return {
+		"total_supply": helius_get_token_supply(asset["mint"]),
+		"reserve_total": helius_get_reserve_total(asset["mint"], asset["reserve_wallets"]),
+	}
+
+
+def collect_price(asset: Dict[str, Any], markets: Dict[str, Any]) -> Dict[str, Any]:
+	"""Asset price plus the USD price of every quote token in the current market set."""
+	quote_prices: Dict[str, float] = {}
+	for it in markets.get("items", []):
+		quote = it.get("quote") or {}
+		mint = quote.get("address") or ""
+		if not mint or mint in quote_prices:
+			continue
+		if (quote.get("symbol") or "").upper() in STABLE_SYMBOLS:
+			continue
+		quote_prices[mint] = be_price(mint)
+	return {
+		"price_usd": be_price(asset["mint"]),
+		"quote_prices": quote_prices,
+		"for_pools": _pool_addresses(markets),
+	}
+
+
+def _onchain_pool_reserves(asset: Dict[str, Any], pools: List[str], price: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+	"""Reserves read from the pools' vault accounts; the Meteora API covers pools whose vaults are unknown."""
+	registry = {m["pool_address"]: m for m in load_markets(asset_key=asset["asset_key"])}
+	known = [registry[p] for p in pools if p in registry and registry[p].get("token_a_vault") and registry[p].get("token_b_vault")]
+	reserves: Dict[str, Dict[str, Any]] = {}
+
+	prices = {asset["mint"]: float(price.get("price_usd") or 0.0), **price.get("quote_prices", {})}
+	for m in known:
+		if (m.get("quote_symbol") or "").upper() in STABLE_SYMBOLS:
+			prices[m["quote_mint"]] = 1.0
+	try:
+		reserves = read_pool_reserves(known, helius_rpc, prices)
+		record_pool_tokens(reserves)
+	except Exception as e:
+		logging.warning(f"On-chain reserve read failed, using the Meteora API: {e}")
+
+	fallback = [p for p in pools if not reserves.get(p)]
+	if fallback:
+		learned = meteora_client.get_pool_reserves_many(fallback)
+		record_pool_tokens(learned)
+		reserves.update(learned)
+	return reserves
+
+
+def collect_pool_reserves(asset: Dict[str, Any], markets: Dict[str, Any], price: Dict[str, Any]) -> Dict[str, Any]:
+	"""Actual token reserves for every Meteora pool in the current market set."""
+	pools = [
+		it["address"] for it in markets.get("items", [])
+		if "meteora" in (it.get("source") or "").lower() and it.get("address")
+	]
+	if RESERVE_ENGINE == "onchain":
+		reserves = _onchain_pool_reserves(asset, pools, price)
+	else:
+		reserves = meteora_client.get_pool_reserves_many(pools)
+		record_pool_tokens(reserves)
+	return {"reserves": reserves, "for_pools": _pool_addresses(markets), "engine": RESERVE_ENGINE}
+
+
+# Collector task graph in dependency order: name -> (collector, dependencies).
+# Every collector is called as collector(asset, *dependency_payloads).
+COLLECTORS = {
+	"markets": (collect_markets, ()),
+	"supply": (collect_supply, ()),
+	"price": (collect_price, ("markets",)),
+	"pool_reserves": (collect_pool_reserves, ("markets", "price")),
+}
+
+
+def _load_collector_cache(asset_key: str) -> Dict[str, Tuple[float, Dict[str, Any]]]:
+	conn = _connect()
+	try:
+		rows = conn.execute("SELECT name, fetched_at, payload FROM collector_cache WHERE asset_key = ?", (asset_key,)).fetchall()
+	finally:
+		conn.close()
+	cache = {}
+	for r in rows:
+		try:
+			cache[r["name"]] = (float(r["fetched_at"] or 0.0), json.loads(r["payload"]))
+		except Exception as e:
+			logging.warning(f"Ignoring unreadable collector cache for {r['name']}: {e}")
+	return cache
+
+
+def _store_collector_cache(asset_key: str, name: str, fetched_at: float, payload: Dict[str, Any]) -> None:
+	db_writer.execute(
+		"""
+		INSERT INTO collector_cache (asset_key, name, fetched_at, payload) VALUES (?, ?, ?, ?)
+		ON CONFLICT(asset_key, name) DO UPDATE SET fetched_at = excluded.fetched_at, payload = excluded.payload
+		""",
+		(asset_key, name, fetched_at, json.dumps(payload)),
+	)
+
+
+def run_collectors(asset: Dict[str, Any], force: bool = False,
+		run_id: Optional[str] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+	"""Walk the collector graph for one asset, refetching only what is due and reusing the rest.
+
+	A collector is due when it has no cached value, its cadence has elapsed, or it
+	depends on markets and the cached value was built for a different pool set. If a
+	due collector's provider is unreachable (or its circuit is open) the cached value
+	is served instead, with stale_age_seconds set.
+
+	With a run_id every payload is staged for that run as soon as it is known, and
+	payloads the run already staged are reused ("resumed") without refetching.
+	Returns the payload per collector and whether each was "fetched", "cached",
+	"stale" or "resumed".
+	"""
+	cache = _load_collector_cache(asset["asset_key"])
+	staged = load_staged_collectors(run_id) if run_id else {}
+	now = time.time()
+	data: Dict[str, Dict[str, Any]] = {}
+	status: Dict[str, str] = {}
+
+	for name, (collect, deps) in COLLECTORS.items():
+		if name in staged:
+			data[name] = staged[name]
+			status[name] = "resumed"
+			continue
+		fetched_at, payload = cache.get(name, (0.0, None))
+		due = force or payload is None
+		if not due:
+			due = (now - fetched_at) >= COLLECTOR_CADENCE_MINUTES[name] * 60.0
+		if not due and "markets" in deps:
+			due = payload.get("for_pools") != _pool_addresses(data["markets"])
+
+		if due:
+			try:
+				fresh = collect(asset, *(data[d] for d in deps))
+			except UNAVAILABLE_ERRORS as e:
+				if payload is None:
+					raise
+				# Stale-while-error: serve the last good payload, marked with its age
+				age = time.time() - fetched_at
+				logging.warning(f"Collector {name} for {asset['asset_key']} unavailable ({e}); using value from {age:.0f}s ago")
+				payload = dict(payload, stale_age_seconds=age)
+				status[name] = "stale"
+			else:
+				payload = fresh
+				_store_collector_cache(asset["asset_key"], name, time.time(), payload)
+				status[name] = "fetched"
+		else:
+			status[name] = "cached"
+		cache_result(f"collector:{name}", hit=not due)
+		data[name] = payload
+		if run_id:
+			stage_collector(run_id, name, payload)
+
+	logging.info(f"Collectors ({asset['asset_key']}): {status}")
+	return data, status
+
+
+def _compute_snapshot(data: Dict[str, Dict[str, Any]],
+		asset_key: str = DEFAULT_ASSET_KEY) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+	"""Pool rows and portfolio summary derived from one asset's collector payloads."""
+	price = float(data["price"].get("price_usd") or 0.0)
+	total_supply = float(data["supply"].get("total_supply") or 0.0)
+	reserve_total = float(data["supply"].get("reserve_total") or 0.0)
 	circulating = max(total_supply - reserve_total, 0.0)
 	fdv = price * total_supply
 	mc  = price * circulating
 	
 	# Replace 0 values with last known good values
 	if price <= 0:
-		price = _get_last_non_zero_value("price_usd")
+		price = _get_last_non_zero_value("price_usd", asset_key)
 		logging.info(f"Price was 0, using last known value: {price}")
 	if circulating <= 0:
-		circulating = _get_last_non_zero_value("circulating_supply")
+		circulating = _get_last_non_zero_value("circulating_supply", asset_key)
 		logging.info(f"Circulating supply was 0, using last known value: {circulating}")
 	if fdv <= 0:
-		fdv = _get_last_non_zero_value("fdv_usd")
+		fdv = _get_last_non_zero_value("fdv_usd", asset_key)
 		logging.info(f"FDV was 0, using last known value: {fdv}")
 	if mc <= 0:
-		mc = _get_last_non_zero_value("market_cap_usd")
+		mc = _get_last_non_zero_value("market_cap_usd", asset_key)
 		logging.info(f"Market cap was 0, using last known value: {mc}")
 
-	items = be_markets_v2(ASSET_MINT, sort_by="liquidity", limit=50, time_frame="24h")
+	items = data["markets"].get("items", [])
+	quote_prices = data["price"].get("quote_prices", {})
+	pool_reserves = data["pool_reserves"].get("reserves", {})
 	rows: List[Dict[str, Any]] = []
 
-	# Price cache for quote tokens
-	_price_cache = {}
 	def price_cached(mint: str, sym: str) -> float:
 		s = (sym or "").upper()
-		if s in ("USDC","USDT","USD","USDC.E","USDT.E"): return 1.0
+		if s in STABLE_SYMBOLS: return 1.0
 		if not mint: return 0.0
-		if mint in _price_cache: return _price_cache[mint]
-		j = http_json("GET", f"{BIRDEYE_BASE}/defi/price", headers=_be_headers(), params={"address": mint, "include_liquidity":"true"})
-		try:
-			px = float((j.get("data") or j).get("value") or 0.0)
-		except Exception:
-			px = 0.0
-		_price_cache[mint] = px
-		return px
-
-	total_real_tvl = 0.0
-	total_vol_24h  = 0.0
-	total_fees_24h = 0.0
-
-	for it in items:
+		return float(quote_prices.get(mint) or 0.0)
+
+	# Fee/yield columns for every pool in one vectorized pass
+	policy = current_policy()
+	fee_rates = [
+		fee_rate_for_pair(it.get("name") or "", (it.get("quote") or {}).get("symbol", "") or "", policy)
+		for it in items
+	]
+	protocol_cuts = [protocol_cut_for_source(it.get("source") or "", policy) for it in items]
+	metrics = pool_metrics(
+		[float(it.get("liquidity") or 0.0) for it in items],
+		[float(it.get("volume24h") or 0.0) for it in items],
+		fee_rates,
+		protocol_cuts,
+	)
+	per_pool = {col: metrics[col].tolist() for col in POOL_METRIC_COLUMNS}
+
+	for i, it in enumerate(items):
 		pool_addr = it.get("address")
 		base_sym  = (it.get("base")  or {}).get("symbol", "") or ""
 		quote_sym = (it.get("quote") or {}).get("symbol", "") or ""
@@ -266,25 +471,15 @@ def snapshot_once() -> Dict[str, Any]:
 		family    = it.get("name") or ""
 		source    = it.get("source") or ""
 
-		real_tvl_usd = liq_usd / 2.0
-		fee_rate = fee_rate_for_pair(family, quote_sym)
-		protocol_cut = PROTOCOL_CUT_METEORA if "meteora" in (source or "").lower() else 0.0
-
-		gross_fees_24h     = vol_24h * fee_rate
-		protocol_fees_24h  = gross_fees_24h * protocol_cut
-		net_fees_24h       = gross_fees_24h - protocol_fees_24h
-
-		daily_yield = (net_fees_24h / real_tvl_usd) if real_tvl_usd > 0 else 0.0
-		apy_simple  = daily_yield * 365.0
-		apy_comp    = (math.pow(1.0 + daily_yield, 365.0) - 1.0) if daily_yield > 0 else 0.0
+		real_tvl_usd = per_pool["real_tvl_usd"][i]
 
 		# For Meteora pools, get actual token reserves from their API
 		quote_price_usd = price_cached(quote_mint, quote_sym)
 		quote_units = 0.0
 		
 		if "meteora" in (source or "").lower():
-			# Fetch actual reserves from Meteora API
-			meteora_data = meteora_get_pool_reserves(pool_addr)
+			# Actual reserves from the Meteora API (pool_reserves collector)
+			meteora_data = pool_reserves.get(pool_addr) or {}
 			if meteora_data:
 				# Determine which token is our quote token
 				if meteora_data.get("token_b_mint") == quote_mint:
@@ -316,149 +511,33 @@ def snapshot_once() -> Dict[str, Any]:
 			"liquidity_usd": liq_usd,
 			"real_tvl_usd": real_tvl_usd,
 			"volume_24h_usd": vol_24h,
-			"fee_rate": fee_rate,
-			"protocol_cut": protocol_cut,
-			"gross_fee_24h_usd": gross_fees_24h,
-			"protocol_fee_24h_usd": protocol_fees_24h,
-			"fee_24h_usd": net_fees_24h,
-			"daily_yield": daily_yield,
-			"apy_simple": apy_simple,
-			"apy_compound": apy_comp,
+			"fee_rate": fee_rates[i],
+			"protocol_cut": protocol_cuts[i],
+			"fee_policy_version": policy["version"],
+			"gross_fee_24h_usd": per_pool["gross_fee_24h_usd"][i],
+			"protocol_fee_24h_usd": per_pool["protocol_fee_24h_usd"][i],
+			"fee_24h_usd": per_pool["fee_24h_usd"][i],
+			"daily_yield": per_pool["daily_yield"][i],
+			"apy_simple": per_pool["apy_simple"][i],
+			"apy_compound": per_pool["apy_compound"][i],
 			"quote_price_usd": quote_price_usd,
 			"quote_units": quote_units,
 		})
 
-		total_real_tvl += real_tvl_usd
-		total_vol_24h  += vol_24h
-		total_fees_24h += net_fees_24h
-	
+	total_real_tvl = sum(r["real_tvl_usd"] for r in rows)
+	total_vol_24h  = sum(r["volume_24h_usd"] for r in rows)
+	total_fees_24h = sum(r["fee_24h_usd"] for r in rows)
+
 	# Replace 0 values for aggregated metrics with last known good values
 	if total_real_tvl <= 0:
-		total_real_tvl = _get_last_non_zero_value("real_tvl_total_usd")
+		total_real_tvl = _get_last_non_zero_value("real_tvl_total_usd", asset_key)
 		logging.info(f"Total real TVL was 0, using last known value: {total_real_tvl}")
 	if total_vol_24h <= 0:
-		total_vol_24h = _get_last_non_zero_value("volume_24h_usd")
+		total_vol_24h = _get_last_non_zero_value("volume_24h_usd", asset_key)
 		logging.info(f"Total 24h volume was 0, using last known value: {total_vol_24h}")
 
-	ts = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-	conn = _connect()
-	try:
-		cur = conn.cursor()
-
-		# Ensure new columns exist (migration-safe)
-		try:
-			cur.execute("ALTER TABLE pool_snapshots ADD COLUMN quote_price_usd REAL")
-		except Exception:
-			pass  # Column already exists
-		try:
-			cur.execute("ALTER TABLE pool_snapshots ADD COLUMN quote_units REAL")
-		except Exception:
-			pass  # Column already exists
-		try:
-			cur.execute("ALTER TABLE pool_snapshots ADD COLUMN daily_yield REAL")
-		except Exception:
-			pass  # Column already exists
-		try:
-			cur.execute("ALTER TABLE pool_snapshots ADD COLUMN apy_simple REAL")
-		except Exception:
-			pass  # Column already exists
-		try:
-			cur.execute("ALTER TABLE pool_snapshots ADD COLUMN apy_compound REAL")
-		except Exception:
-			pass  # Column already exists
-
-		# write pool rows and update pools_state + family_totals
-		for r in rows:
-			cur.execute(
-				"""
-				INSERT INTO pool_snapshots
-				(ts_utc, pool_address, family, base_symbol, quote_symbol,
-				 liquidity_usd, real_tvl_usd, volume_24h_usd, fee_rate, protocol_cut, source,
-				 gross_fee_24h_usd, protocol_fee_24h_usd, fee_24h_usd, daily_yield, apy_simple, apy_compound,
-				 quote_price_usd, quote_units)
-				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-				""",
-				(
-					ts, r["pool_address"], r["family"], r["base_symbol"], r["quote_symbol"],
-					r["liquidity_usd"], r["real_tvl_usd"], r["volume_24h_usd"], r["fee_rate"], r["protocol_cut"], r["source"],
-					r["gross_fee_24h_usd"], r["protocol_fee_24h_usd"], r["fee_24h_usd"], r["daily_yield"], r["apy_simple"], r["apy_compound"],
-					r["quote_price_usd"], r["quote_units"],
-				)
-			)
-
-			# delta accumulation using pools_state
-			cur.execute("SELECT last_volume_24h_usd FROM pools_state WHERE pool_address = ?", (r["pool_address"],))
-			prev = cur.fetchone()
-			last = float(prev[0]) if prev and prev[0] is not None else 0.0
-			curr = float(r["volume_24h_usd"])
-			# If API resets (curr < last), treat delta as curr (not negative)
-			delta_vol = curr - last if curr >= last else curr
-			if delta_vol < 0:
-				delta_vol = 0.0
-			gross_delta = delta_vol * r["fee_rate"]
-			net_delta   = gross_delta * (1.0 - r["protocol_cut"])
-
-			cur.execute(
-				"""
-				INSERT INTO family_totals (family, all_time_volume_usd, all_time_fees_usd)
-				VALUES (?, ?, ?)
-				ON CONFLICT(family) DO UPDATE SET
-				  all_time_volume_usd = COALESCE(all_time_volume_usd,0) + excluded.all_time_volume_usd,
-				  all_time_fees_usd   = COALESCE(all_time_fees_usd,0) + excluded.all_time_fees_usd
-				""",
-				(r["family"], float(delta_vol or 0.0), float(net_delta or 0.0)),
-			)
-
-			cur.execute(
-				"""
-				INSERT INTO pools_state (pool_address, last_volume_24h_usd)
-				VALUES (?, ?)
-				ON CONFLICT(pool_address) DO UPDATE SET last_volume_24h_usd = excluded.last_volume_24h_usd
-				""",
-				(r["pool_address"], r["volume_24h_usd"]),
-			)
-
-		# write metrics snapshot with APY fields
-		portfolio_daily_yield = (total_fees_24h / total_real_tvl) if total_real_tvl > 0 else 0.0
-		portfolio_apy_simple  = portfolio_daily_yield * 365.0
-		portfolio_apy_comp    = (math.pow(1.0 + portfolio_daily_yield, 365.0) - 1.0) if portfolio_daily_yield > 0 else 0.0
-
-		cur.execute(
-			"""
-			INSERT OR REPLACE INTO metrics_snapshots
-			(ts_utc, price_usd, fdv_usd, market_cap_usd, circulating_supply,
-			 real_tvl_total_usd, volume_24h_usd, collateralization_ratio,
-			 real_yield_daily, apy_simple, apy_compound)
-			VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-			""",
-			(
-				ts, price, fdv, mc, circulating,
-				total_real_tvl, total_vol_24h,
-				(total_real_tvl / fdv) if fdv > 0 else 0.0,
-				portfolio_daily_yield, portfolio_apy_simple, portfolio_apy_comp,
-			),
-		)
-
-		conn.commit()
-
-		# Post-commit validations
-		row_sum = cur.execute("SELECT COALESCE(SUM(fee_24h_usd),0) FROM pool_snapshots WHERE ts_utc = ?", (ts,)).fetchone()
-		db_sum_fees = float(row_sum[0] if row_sum and row_sum[0] is not None else 0.0)
-		if abs(db_sum_fees - total_fees_24h) > 1e-6:
-			logging.warning("fees24h_total_usd_est mismatch: computed=%s db_sum=%s ts=%s", total_fees_24h, db_sum_fees, ts)
-
-		row_ms = cur.execute("SELECT real_yield_daily, apy_simple FROM metrics_snapshots WHERE ts_utc = ?", (ts,)).fetchone()
-		if row_ms:
-			db_daily = float(row_ms[0] or 0.0)
-			db_apy_s = float(row_ms[1] or 0.0)
-			if abs(db_apy_s - (db_daily * 365.0)) > 1e-6:
-				logging.warning("APY simple mismatch: apy_simple=%s daily*365=%s ts=%s", db_apy_s, db_daily * 365.0, ts)
-
-	finally:
-		conn.close()
-
-	return {
-		"ts_utc": ts,
+	portfolio = portfolio_metrics(total_fees_24h, total_real_tvl)
+	summary = {
 		"price_usd": price,
 		"fdv_usd": fdv,
 		"market_cap_usd": mc,
@@ -466,8 +545,133 @@ def snapshot_once() -> Dict[str, Any]:
 		"real_tvl_total_usd": total_real_tvl,
 		"volume_24h_usd": total_vol_24h,
 		"fees24h_total_usd_est": total_fees_24h,
-		"real_yield_daily": portfolio_daily_yield,
-		"apy_simple": portfolio_apy_simple,
-		"apy_compound": portfolio_apy_comp,
-		"per_pool": rows,
+		"real_yield_daily": portfolio["real_yield_daily"],
+		"apy_simple": portfolio["apy_simple"],
+		"apy_compound": portfolio["apy_compound"],
 	}
+	return rows, summary
+
+
+@profiled("snapshot")
+def snapshot_once(force: bool = False, asset_key: str = DEFAULT_ASSET_KEY) -> Dict[str, Any]:
+	"""Run a single snapshot of one asset, persist into DB, and return the computed summary dict.
+
+	Each collector is only refetched when its cadence is due (see COLLECTOR_CADENCE_MINUTES);
+	pass force=True to refetch everything. The run is staged first and then published
+	in one transaction (see core/staging.py); an unfinished earlier run is resumed.
+	With ASRSV_INGEST_BUFFER=1 the rows go to the ingest buffer instead (core/ingest.py).
+	"""
+	migrate()
+
+	# Sanity checks for API keys
+	if not BIRDEYE_API_KEY:
+		logging.warning("BirdEye API key is empty — price/markets may fail.")
+	if not HELIUS_API_KEY:
+		logging.warning("Helius API key is empty — supply/circulating/FDV/MC will be 0.")
+
+	asset = get_asset(asset_key)
+	if asset is None:
+		raise ValueError(f"unknown asset '{asset_key}'")
+	if INGEST_ENABLED:
+		return _snapshot_buffered(asset, force)
+
+	run = begin_run(asset_key)
+	run_id = run["run_id"]
+	# Heartbeat so an overlapping snapshot of this asset does not resume the run under us
+	with RunHeartbeat(run):
+		try:
+			if run["status"] == "fetching":
+				stage_started = time.perf_counter()
+				data, collector_status = run_collectors(asset, force=force, run_id=run_id)
+				observe_stage("fetch", stage_started)
+
+				stage_started = time.perf_counter()
+				rows, summary = _compute_snapshot(data, asset_key)
+				summary["collectors"] = collector_status
+				summary["stale_seconds"] = {n: d["stale_age_seconds"] for n, d in data.items() if "stale_age_seconds" in d}
+				stage_rows(run_id, rows, summary)
+				observe_stage("compute", stage_started)
+			else:
+				rows, summary = load_staged(run_id)
+
+			stage_started = time.perf_counter()
+			ts = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+			if not publish(run_id, ts, summary):
+				raise RuntimeError(f"snapshot run {run_id} was already published by another process")
+			observe_stage("persist", stage_started)
+		except ValidationError as e:
+			fail_run(run_id, str(e))
+			raise
+
+	# Buffered snapshots are published by the ingest buffer's flush instead
+	publish_after_snapshot(asset_key)
+	return dict(summary, asset_key=asset_key, ts_utc=ts, run_id=run_id, resumed=run["resumed"], per_pool=rows)
+
+
+def _snapshot_buffered(asset: Dict[str, Any], force: bool) -> Dict[str, Any]:
+	"""snapshot_once through the ingest buffer: no staging, published with the next flush."""
+	asset_key = asset["asset_key"]
+	stage_started = time.perf_counter()
+	data, collector_status = run_collectors(asset, force=force)
+	observe_stage("fetch", stage_started)
+
+	stage_started = time.perf_counter()
+	rows, summary = _compute_snapshot(data, asset_key)
+	summary["collectors"] = collector_status
+	summary["stale_seconds"] = {n: d["stale_age_seconds"] for n, d in data.items() if "stale_age_seconds" in d}
+	observe_stage("compute", stage_started)
+
+	stage_started = time.perf_counter()
+	ts = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+	run_id = ingest_buffer.add(asset_key, ts, rows, summary)
+	observe_stage("persist", stage_started)
+	return dict(summary, asset_key=asset_key, ts_utc=ts, run_id=run_id, resumed=False, buffered=True, per_pool=rows)
+
+
+def _snapshot_worker(asset_key: str, force: bool,
+		flush: bool = False) -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+	"""Process pool task: one asset's snapshot, with failures returned rather than raised."""
+	try:
+		result = snapshot_once(force=force, asset_key=asset_key)
+		if flush and INGEST_ENABLED:
+			# Pool workers exit without running atexit hooks
+			ingest_buffer.flush()
+		return asset_key, result, None
+	except Exception as e:
+		logging.exception(f"Snapshot of {asset_key} failed")
+		return asset_key, None, str(e)
+
+
+def _init_worker(limiter: ratelimit.SharedRateLimiter, breakers: upstream.SharedBreakerState) -> None:
+	ratelimit.install(limiter)
+	upstream.install_breakers(breakers)
+
+
+def snapshot_all(force: bool = False, processes: Optional[int] = None) -> Dict[str, Any]:
+	"""Snapshot every enabled asset, spread over a process pool.
+
+	All workers share one per-provider rate limiter (core/ratelimit.py), so the
+	request rate each provider sees does not grow with the number of processes, and
+	this process's circuit breakers (core/upstream.py), so a provider found down stays
+	open across workers and runs. One asset failing does not stop the others; its
+	error is reported under "errors".
+	"""
+	migrate()
+	keys = [a["asset_key"] for a in load_assets()]
+	processes = max(min(processes or COLLECTOR_PROCESSES, len(keys)), 1)
+
+	if processes == 1:
+		outcomes = [_snapshot_worker(key, force) for key in keys]
+	else:
+		if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+			logging.warning("PROMETHEUS_MULTIPROC_DIR is not set; snapshot worker metrics will not be exported")
+		ctx = multiprocessing.get_context("spawn")
+		limiter = ratelimit.SharedRateLimiter(ctx=ctx)
+		with ProcessPoolExecutor(max_workers=processes, mp_context=ctx,
+				initializer=_init_worker, initargs=(limiter, upstream.shared_breakers())) as pool:
+			outcomes = list(pool.map(_snapshot_worker, keys, repeat(force), repeat(True)))
+
+	results = {key: res for key, res, err in outcomes if err is None}
+	errors = {key: err for key, res, err in outcomes if err is not None}
+	logging.info(f"Snapshot of {len(keys)} asset(s) over {processes} process(es): {len(results)} ok, {len(errors)} failed")
+	return {"assets": results, "errors": errors, "processes": processes}
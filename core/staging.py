@@ -0,0 +1,315 @@
+"""
+Two-phase snapshot runs.
+Each snapshot_once call is a run of one asset in snapshot_runs. Collector payloads are staged in
+snapshot_staging as they arrive and computed pool rows in snapshot_staging_pools.
+publish() then makes the snapshot visible in a single writer job (see app/writer.py):
+pool rows, the set-based pools_state/family_totals update, metrics and composition. The transaction
+is guarded by the run's status, so a run is published at most once. A run that
+died before publishing is resumed by the asset's next snapshot and reuses what it staged.
+
+Each run records its owner, and the owner heartbeats the run's updated_at while it
+works (RunHeartbeat). A run is only resumed once its heartbeat has stopped; while it is
+live, begin_run raises RunInProgress instead of running the same snapshot twice.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.db import DEFAULT_ASSET_KEY, _connect, write_composition
+from app.writer import db_writer
+
+# Unfinished runs younger than this are resumed; older ones are abandoned
+RESUME_MINUTES = float(os.getenv("ASRSV_SNAPSHOT_RESUME_MINUTES", "30"))
+
+# Owners touch their run this often; a run untouched for three intervals has lost its owner
+HEARTBEAT_SECONDS = float(os.getenv("ASRSV_SNAPSHOT_HEARTBEAT_SECONDS", "10"))
+HEARTBEAT_TIMEOUT_SECONDS = 3 * HEARTBEAT_SECONDS
+
+# pool_snapshots columns carried by a staged pool row (everything except ts_utc)
+POOL_ROW_COLUMNS = (
+	"pool_address", "family", "base_symbol", "quote_symbol",
+	"liquidity_usd", "real_tvl_usd", "volume_24h_usd", "fee_rate", "protocol_cut", "source",
+	"gross_fee_24h_usd", "protocol_fee_24h_usd", "fee_24h_usd", "daily_yield", "apy_simple", "apy_compound",
+	"quote_price_usd", "quote_units", "fee_policy_version",
+)
+
+
+class RunInProgress(RuntimeError):
+	"""The asset's unfinished run still has a live owner."""
+
+
+def begin_run(asset_key: str = DEFAULT_ASSET_KEY) -> Dict[str, Any]:
+	"""Resume the asset's latest unfinished run if it is recent and ownerless, otherwise start a new one.
+
+	Raises RunInProgress if another process or thread is still working on that run.
+	"""
+	now = time.time()
+	owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+	def begin(conn):
+		stale = [r["run_id"] for r in conn.execute(
+			"SELECT run_id FROM snapshot_runs WHERE asset_key = ? AND status IN ('fetching', 'staged') AND started_at < ?",
+			(asset_key, now - RESUME_MINUTES * 60.0),
+		)]
+		for run_id in stale:
+			conn.execute("UPDATE snapshot_runs SET status = 'abandoned', updated_at = ? WHERE run_id = ?", (now, run_id))
+			conn.execute("DELETE FROM snapshot_staging WHERE run_id = ?", (run_id,))
+			conn.execute("DELETE FROM snapshot_staging_pools WHERE run_id = ?", (run_id,))
+		row = conn.execute(
+			"""
+			SELECT run_id, status, started_at, owner, updated_at FROM snapshot_runs
+			WHERE asset_key = ? AND status IN ('fetching', 'staged')
+			ORDER BY started_at DESC LIMIT 1
+			""",
+			(asset_key,),
+		).fetchone()
+		if row and row["owner"] and (row["updated_at"] or 0) >= now - HEARTBEAT_TIMEOUT_SECONDS:
+			return None, stale, row["owner"]
+		if row:
+			run = {"run_id": row["run_id"], "status": row["status"], "started_at": row["started_at"], "resumed": True}
+			conn.execute("UPDATE snapshot_runs SET owner = ?, updated_at = ? WHERE run_id = ?", (owner, now, row["run_id"]))
+		else:
+			run = {"run_id": uuid.uuid4().hex, "status": "fetching", "started_at": now, "resumed": False}
+			conn.execute(
+				"INSERT INTO snapshot_runs (run_id, asset_key, status, owner, started_at, updated_at) VALUES (?, ?, 'fetching', ?, ?, ?)",
+				(run["run_id"], asset_key, owner, now, now),
+			)
+		run["owner"] = owner
+		return run, stale, None
+
+	run, stale, busy_owner = db_writer.run(begin)
+	if stale:
+		logging.warning(f"Abandoned {len(stale)} unfinished {asset_key} snapshot run(s) older than {RESUME_MINUTES:.0f} minutes")
+	if run is None:
+		raise RunInProgress(f"snapshot of {asset_key} is already running ({busy_owner})")
+	if run["resumed"]:
+		logging.info(f"Resuming {asset_key} snapshot run {run['run_id']} ({run['status']})")
+	return run
+
+
+class RunHeartbeat:
+	"""Keeps a run's updated_at fresh while its owner works on it, so no one else resumes it."""
+
+	def __init__(self, run: Dict[str, Any], interval: Optional[float] = None) -> None:
+		self.run_id = run["run_id"]
+		self.owner = run["owner"]
+		self.interval = HEARTBEAT_SECONDS if interval is None else interval
+		self._stop = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	def _beat(self) -> None:
+		while not self._stop.wait(self.interval):
+			try:
+				db_writer.execute(
+					"UPDATE snapshot_runs SET updated_at = ? WHERE run_id = ? AND owner = ?",
+					(time.time(), self.run_id, self.owner),
+				)
+			except Exception as e:
+				logging.warning(f"Heartbeat of snapshot run {self.run_id} failed: {e}")
+
+	def __enter__(self) -> "RunHeartbeat":
+		self._thread = threading.Thread(target=self._beat, name=f"run-heartbeat-{self.run_id[:8]}", daemon=True)
+		self._thread.start()
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+
+
+def load_staged_collectors(run_id: str) -> Dict[str, Dict[str, Any]]:
+	conn = _connect()
+	try:
+		rows = conn.execute("SELECT collector, payload FROM snapshot_staging WHERE run_id = ?", (run_id,)).fetchall()
+	finally:
+		conn.close()
+	return {r["collector"]: json.loads(r["payload"]) for r in rows}
+
+
+def stage_collector(run_id: str, name: str, payload: Dict[str, Any]) -> None:
+	db_writer.execute(
+		"INSERT OR REPLACE INTO snapshot_staging (run_id, collector, staged_at, payload) VALUES (?, ?, ?, ?)",
+		(run_id, name, time.time(), json.dumps(payload)),
+	)
+
+
+def stage_rows(run_id: str, rows: List[Dict[str, Any]], summary: Dict[str, Any]) -> None:
+	"""Store computed pool rows and the run summary, moving the run to 'staged'."""
+	def stage(conn):
+		conn.execute("DELETE FROM snapshot_staging_pools WHERE run_id = ?", (run_id,))
+		conn.executemany(
+			f"""
+			INSERT INTO snapshot_staging_pools (run_id, {", ".join(POOL_ROW_COLUMNS)})
+			VALUES (?, {", ".join("?" for _ in POOL_ROW_COLUMNS)})
+			""",
+			[[run_id] + [r[c] for c in POOL_ROW_COLUMNS] for r in rows],
+		)
+		conn.execute(
+			"UPDATE snapshot_runs SET status = 'staged', summary = ?, updated_at = ? WHERE run_id = ?",
+			(json.dumps(summary), time.time(), run_id),
+		)
+
+	db_writer.run(stage)
+
+
+def load_staged(run_id: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+	"""Pool rows and summary of a staged run."""
+	conn = _connect()
+	try:
+		rows = conn.execute(
+			f"SELECT {', '.join(POOL_ROW_COLUMNS)} FROM snapshot_staging_pools WHERE run_id = ? ORDER BY rowid",
+			(run_id,),
+		).fetchall()
+		summary = conn.execute("SELECT summary FROM snapshot_runs WHERE run_id = ?", (run_id,)).fetchone()
+	finally:
+		conn.close()
+	return [dict(r) for r in rows], json.loads(summary["summary"] or "{}") if summary else {}
+
+
+def fail_run(run_id: str, error: str) -> None:
+	def fail(conn):
+		conn.execute(
+			"UPDATE snapshot_runs SET status = 'failed', error = ?, updated_at = ? WHERE run_id = ? AND status != 'published'",
+			(error, time.time(), run_id),
+		)
+		conn.execute("DELETE FROM snapshot_staging WHERE run_id = ?", (run_id,))
+		conn.execute("DELETE FROM snapshot_staging_pools WHERE run_id = ?", (run_id,))
+
+	db_writer.run(fail)
+
+
+class ValidationError(RuntimeError):
+	"""A staged run failed its pre-commit checks and was not published."""
+
+
+def publish(run_id: str, ts: str, summary: Dict[str, Any]) -> bool:
+	"""Atomically publish a staged run as its asset's snapshot `ts`.
+
+	Returns False without writing anything if the run is no longer 'staged' (e.g. an
+	overlapping process already published it). Raises ValidationError, rolling back,
+	if the published rows do not match what was staged.
+	"""
+	return db_writer.run(lambda conn: apply_publish(conn, run_id, ts, summary))
+
+
+def apply_publish(conn, run_id: str, ts: str, summary: Dict[str, Any]) -> bool:
+	"""The body of publish(), run inside the caller's writer job."""
+	cur = conn.cursor()
+	row = cur.execute("SELECT status, asset_key FROM snapshot_runs WHERE run_id = ?", (run_id,)).fetchone()
+	if not row or row["status"] != "staged":
+		return False
+	asset_key = row["asset_key"]
+
+	cur.execute(
+		f"""
+		INSERT INTO pool_snapshots (asset_key, ts_utc, {", ".join(POOL_ROW_COLUMNS)})
+		SELECT ?, ?, {", ".join(POOL_ROW_COLUMNS)}
+		FROM snapshot_staging_pools WHERE run_id = ?
+		ORDER BY rowid
+		""",
+		(asset_key, ts, run_id),
+	)
+	inserted = cur.rowcount
+
+	# All-time counters from 24h volume deltas against pools_state; a drop means the
+	# 24h window reset, so the new 24h volume is the delta
+	cur.execute(
+		"""
+		INSERT INTO family_totals (asset_key, family, all_time_volume_usd, all_time_fees_usd)
+		SELECT ?, family, SUM(delta), SUM(delta * fee_rate * (1.0 - protocol_cut))
+		FROM (
+		  SELECT s.family, s.fee_rate, s.protocol_cut,
+		         MAX(CASE WHEN COALESCE(s.volume_24h_usd, 0) >= COALESCE(ps.last_volume_24h_usd, 0)
+		                  THEN COALESCE(s.volume_24h_usd, 0) - COALESCE(ps.last_volume_24h_usd, 0)
+		                  ELSE COALESCE(s.volume_24h_usd, 0) END, 0.0) AS delta
+		  FROM snapshot_staging_pools s
+		  LEFT JOIN pools_state ps ON ps.asset_key = ? AND ps.pool_address = s.pool_address
+		  WHERE s.run_id = ?
+		)
+		WHERE true
+		GROUP BY family
+		ON CONFLICT(asset_key, family) DO UPDATE SET
+		  all_time_volume_usd = COALESCE(all_time_volume_usd, 0) + excluded.all_time_volume_usd,
+		  all_time_fees_usd   = COALESCE(all_time_fees_usd, 0) + excluded.all_time_fees_usd
+		""",
+		(asset_key, asset_key, run_id),
+	)
+	cur.execute(
+		"""
+		INSERT INTO pools_state (asset_key, pool_address, last_volume_24h_usd)
+		SELECT ?, pool_address, volume_24h_usd FROM snapshot_staging_pools WHERE run_id = ?
+		ON CONFLICT(asset_key, pool_address) DO UPDATE SET last_volume_24h_usd = excluded.last_volume_24h_usd
+		""",
+		(asset_key, run_id),
+	)
+
+	cur.execute(
+		"""
+		INSERT OR REPLACE INTO metrics_snapshots
+		(asset_key, ts_utc, price_usd, fdv_usd, market_cap_usd, circulating_supply,
+		 real_tvl_total_usd, volume_24h_usd, collateralization_ratio,
+		 real_yield_daily, apy_simple, apy_compound)
+		VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+		""",
+		(
+			asset_key, ts, summary["price_usd"], summary["fdv_usd"], summary["market_cap_usd"], summary["circulating_supply"],
+			summary["real_tvl_total_usd"], summary["volume_24h_usd"],
+			(summary["real_tvl_total_usd"] / summary["fdv_usd"]) if summary["fdv_usd"] > 0 else 0.0,
+			summary["real_yield_daily"], summary["apy_simple"], summary["apy_compound"],
+		),
+	)
+	write_composition(cur, ts, asset_key)
+
+	# Validations, before anything becomes visible
+	staged = cur.execute("SELECT COUNT(*) FROM snapshot_staging_pools WHERE run_id = ?", (run_id,)).fetchone()[0]
+	if inserted != staged:
+		raise ValidationError(f"published {inserted} pool rows but {staged} were staged (run {run_id})")
+	db_sum_fees = float(cur.execute(
+		"SELECT COALESCE(SUM(fee_24h_usd), 0) FROM pool_snapshots WHERE asset_key = ? AND ts_utc = ?", (asset_key, ts),
+	).fetchone()[0])
+	expected = float(summary["fees24h_total_usd_est"])
+	if abs(db_sum_fees - expected) > 1e-6 * max(1.0, abs(expected)):
+		raise ValidationError(f"fees24h_total_usd_est mismatch: computed={expected} db_sum={db_sum_fees} ts={ts}")
+	if abs(summary["apy_simple"] - summary["real_yield_daily"] * 365.0) > 1e-6:
+		logging.warning("APY simple mismatch: apy_simple=%s daily*365=%s ts=%s",
+			summary["apy_simple"], summary["real_yield_daily"] * 365.0, ts)
+
+	cur.execute(
+		"UPDATE snapshot_runs SET status = 'published', ts_utc = ?, updated_at = ? WHERE run_id = ?",
+		(ts, time.time(), run_id),
+	)
+	cur.execute("DELETE FROM snapshot_staging WHERE run_id = ?", (run_id,))
+	cur.execute("DELETE FROM snapshot_staging_pools WHERE run_id = ?", (run_id,))
+	return True
+
+
+def publish_rows(conn, run_id: str, asset_key: str, ts: str, rows: List[Dict[str, Any]],
+		summary: Dict[str, Any]) -> bool:
+	"""Stage and publish a computed snapshot in the caller's writer job (see core/ingest.py).
+
+	Returns False if `run_id` is already known, so replaying the same snapshot is a no-op.
+	"""
+	now = time.time()
+	inserted = conn.execute(
+		"""
+		INSERT OR IGNORE INTO snapshot_runs (run_id, asset_key, status, summary, started_at, updated_at)
+		VALUES (?, ?, 'staged', ?, ?, ?)
+		""",
+		(run_id, asset_key, json.dumps(summary), now, now),
+	).rowcount
+	if not inserted:
+		return False
+	conn.executemany(
+		f"""
+		INSERT INTO snapshot_staging_pools (run_id, {", ".join(POOL_ROW_COLUMNS)})
+		VALUES (?, {", ".join("?" for _ in POOL_ROW_COLUMNS)})
+		""",
+		[[run_id] + [r[c] for c in POOL_ROW_COLUMNS] for r in rows],
+	)
+	return apply_publish(conn, run_id, ts, summary)
@@ -0,0 +1,250 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from app.metrics import (
+	UPSTREAM_CIRCUIT_STATE, UPSTREAM_ERRORS, UPSTREAM_RATE_LIMITED, UPSTREAM_RETRIES, UPSTREAM_SECONDS,
+	UPSTREAM_SHORT_CIRCUITED,
+)
+from core import ratelimit
+
+# Base58 account addresses in URL paths are collapsed so metric labels stay bounded
+_ADDRESS_SEGMENT = re.compile(r"^[1-9A-HJ-NP-Za-km-z]{32,44}$")
+
+# Load tests and offline runs set ASRSV_OFFLINE=1 so nothing leaves the machine
+OFFLINE = os.getenv("ASRSV_OFFLINE", "0") == "1"
+
+PROVIDERS = {
+	"public-api.birdeye.so": "birdeye",
+	"mainnet.helius-rpc.com": "helius",
+	"dammv2-api.meteora.ag": "meteora",
+}
+
+
+# Consecutive failed calls that open a provider's circuit, and how long it stays open
+BREAKER_FAILURES = int(os.getenv("ASRSV_BREAKER_FAILURES", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("ASRSV_BREAKER_RESET_SECONDS", "60"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+_STATES = {v: k for k, v in _STATE_VALUES.items()}
+
+# Breaker fields kept per provider: state, consecutive failures, opened_at, probing
+_FIELDS = 4
+
+
+class SharedBreakerState:
+	"""Every provider's breaker fields in shared memory.
+
+	snapshot_all() hands one to each process-pool worker, so a provider's circuit opened
+	by one worker is open in all of them and stays open across runs.
+	"""
+
+	def __init__(self, ctx=None) -> None:
+		ctx = ctx or multiprocessing.get_context("spawn")
+		self.providers = sorted(set(PROVIDERS.values()))
+		self.values = ctx.Array("d", _FIELDS * len(self.providers))
+
+
+class CircuitOpenError(RuntimeError):
+	"""Raised instead of calling a provider whose circuit is open."""
+
+	def __init__(self, provider: str, retry_in: float) -> None:
+		super().__init__(f"{provider} circuit open, retry in {retry_in:.0f}s")
+		self.provider = provider
+		self.retry_in = retry_in
+
+
+class CircuitBreaker:
+	"""Per-provider breaker: closed -> open after N consecutive failures -> half-open probe.
+
+	While open every call fails immediately. After reset_seconds one probe call is let
+	through (half-open); its success closes the circuit, its failure re-opens it.
+	"""
+
+	def __init__(self, provider: str, failure_threshold: int = BREAKER_FAILURES,
+			reset_seconds: float = BREAKER_RESET_SECONDS, shared: Optional[SharedBreakerState] = None) -> None:
+		self.provider = provider
+		self.failure_threshold = max(failure_threshold, 1)
+		self.reset_seconds = reset_seconds
+		if shared is not None and provider in shared.providers:
+			self._values = shared.values
+			self._base = _FIELDS * shared.providers.index(provider)
+			self._lock = shared.values.get_lock()
+		else:
+			self._values = [0.0] * _FIELDS
+			self._base = 0
+			self._lock = threading.RLock()
+		UPSTREAM_CIRCUIT_STATE.labels(provider).set(self._values[self._base])
+
+	@property
+	def state(self) -> str:
+		return _STATES[int(self._values[self._base])]
+
+	@property
+	def failures(self) -> int:
+		return int(self._values[self._base + 1])
+
+	@failures.setter
+	def failures(self, value: int) -> None:
+		self._values[self._base + 1] = value
+
+	@property
+	def opened_at(self) -> float:
+		return self._values[self._base + 2]
+
+	@opened_at.setter
+	def opened_at(self, value: float) -> None:
+		self._values[self._base + 2] = value
+
+	@property
+	def _probing(self) -> bool:
+		return bool(self._values[self._base + 3])
+
+	@_probing.setter
+	def _probing(self, value: bool) -> None:
+		self._values[self._base + 3] = 1.0 if value else 0.0
+
+	def _set_state(self, state: str) -> None:
+		self._values[self._base] = _STATE_VALUES[state]
+		UPSTREAM_CIRCUIT_STATE.labels(self.provider).set(_STATE_VALUES[state])
+
+	def before_call(self) -> None:
+		with self._lock:
+			if self.state == CLOSED:
+				return
+			retry_in = self.opened_at + self.reset_seconds - time.time()
+			if self.state == OPEN and retry_in <= 0:
+				self._set_state(HALF_OPEN)
+			if self.state == HALF_OPEN and not self._probing:
+				self._probing = True
+				return
+		UPSTREAM_SHORT_CIRCUITED.labels(self.provider).inc()
+		raise CircuitOpenError(self.provider, max(retry_in, 0.0))
+
+	def record_success(self) -> None:
+		with self._lock:
+			self.failures = 0
+			self._probing = False
+			if self.state != CLOSED:
+				self._set_state(CLOSED)
+
+	def record_failure(self) -> None:
+		with self._lock:
+			self.failures += 1
+			self._probing = False
+			if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+				self.opened_at = time.time()
+				self._set_state(OPEN)
+
+	def status(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"state": self.state,
+				"consecutive_failures": self.failures,
+				"opened_at": self.opened_at or None,
+			}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_shared: Optional[SharedBreakerState] = None
+
+
+def breaker_for(provider: str) -> CircuitBreaker:
+	with _breakers_lock:
+		if provider not in _breakers:
+			_breakers[provider] = CircuitBreaker(provider, shared=_shared)
+		return _breakers[provider]
+
+
+def install_breakers(shared: SharedBreakerState) -> None:
+	"""Back this process's breakers with `shared` (the process pool initializer), keeping their state."""
+	global _shared
+	with _breakers_lock:
+		for provider, old in _breakers.items():
+			if provider in shared.providers:
+				base = _FIELDS * shared.providers.index(provider)
+				with old._lock:
+					shared.values[base:base + _FIELDS] = old._values[old._base:old._base + _FIELDS]
+		_shared = shared
+		_breakers.clear()
+
+
+def shared_breakers() -> SharedBreakerState:
+	"""This process's shared breaker state, created and installed on first use."""
+	if _shared is None:
+		install_breakers(SharedBreakerState())
+	return _shared
+
+
+def breaker_status() -> Dict[str, Dict[str, Any]]:
+	"""Circuit state of every provider called so far in this process (or its collector workers)."""
+	if _shared is not None:
+		for provider in _shared.providers:
+			breaker_for(provider)
+	with _breakers_lock:
+		breakers = list(_breakers.values())
+	return {b.provider: b.status() for b in breakers}
+
+
+# Errors meaning the provider could not be reached, as opposed to a bad payload
+UNAVAILABLE_ERRORS = (CircuitOpenError, requests.RequestException)
+
+
+def upstream_labels(url: str, json_body: Any = None) -> Tuple[str, str]:
+	"""(provider, endpoint) labels for an upstream URL; JSON-RPC calls are labelled by method."""
+	parsed = urlparse(url)
+	provider = PROVIDERS.get(parsed.hostname or "", parsed.hostname or "unknown")
+	if isinstance(json_body, dict) and json_body.get("method"):
+		return provider, str(json_body["method"])
+	parts = ["{address}" if _ADDRESS_SEGMENT.match(p) else p for p in parsed.path.split("/")]
+	return provider, "/".join(parts) or "/"
+
+
+def http_json(method: str, url: str, headers: Dict[str, str] = None,
+             params: Dict[str, Any] = None, json_body: Any = None,
+             retries: int = 3, backoff: float = 0.9) -> Any:
+	provider, endpoint = upstream_labels(url, json_body)
+	if OFFLINE:
+		raise RuntimeError(f"upstream calls disabled (ASRSV_OFFLINE=1): {provider} {endpoint}")
+	breaker = breaker_for(provider)
+	breaker.before_call()
+	for attempt in range(1, retries + 1):
+		if attempt > 1:
+			UPSTREAM_RETRIES.labels(provider, endpoint).inc()
+		ratelimit.acquire(provider)
+		started = time.perf_counter()
+		try:
+			r = requests.request(method, url, headers=headers, params=params, json=json_body, timeout=25)
+		except Exception:
+			UPSTREAM_ERRORS.labels(provider, endpoint).inc()
+			breaker.record_failure()
+			raise
+		finally:
+			UPSTREAM_SECONDS.labels(provider, endpoint).observe(time.perf_counter() - started)
+		if r.status_code == 429:
+			UPSTREAM_RATE_LIMITED.labels(provider, endpoint).inc()
+			if attempt < retries:
+				time.sleep(backoff * attempt)
+				continue
+		# 5xx and exhausted 429s count against the provider; other 4xx are our request's fault
+		if r.status_code >= 500 or r.status_code == 429:
+			breaker.record_failure()
+		else:
+			breaker.record_success()
+		try:
+			r.raise_for_status()
+		except Exception:
+			UPSTREAM_ERRORS.labels(provider, endpoint).inc()
+			raise
+		try:
+			return r.json()
+		except Exception:
+			return r.text
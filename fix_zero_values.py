@@ -1,17 +1,23 @@
 #!/usr/bin/env python3
 """
 Script to retrospectively fix zero values in the database by replacing them
-with the last known non-zero value.
+with the last known non-zero value of the same asset.
 """
 import sqlite3
 import os
 import logging
-from typing import List, Tuple
+from typing import Any, Dict
+
+from app import publish
+from app.writer import db_writer
 
 logging.basicConfig(level=logging.INFO)
 
 DB_PATH = os.getenv("ASSET_DB_PATH", "asset_reserve_metrics.sqlite")
 
+# Snapshots repaired per writer transaction; snapshot writes get in between chunks
+CHUNK_SIZE = int(os.getenv("ASRSV_FIX_CHUNK_SIZE", "500"))
+
 # Columns that should never be 0 (those that show in charts)
 METRICS_COLUMNS = [
     "price_usd",
@@ -30,90 +36,95 @@ def connect() -> sqlite3.Connection:
     return conn
 
 
-def get_all_timestamps(conn: sqlite3.Connection) -> List[str]:
-    """Get all timestamps from metrics_snapshots ordered by time."""
-    cur = conn.cursor()
-    cur.execute("SELECT ts_utc FROM metrics_snapshots ORDER BY ts_utc ASC")
-    return [row[0] for row in cur.fetchall()]
-
-
-def get_last_non_zero_before(conn: sqlite3.Connection, column: str, before_ts: str) -> float:
-    """Get the last non-zero value for a column before a given timestamp."""
+def get_last_non_zero_before(conn: sqlite3.Connection, column: str, asset_key: str, before_ts: str) -> float:
+    """Get the asset's last non-zero value for a column before a given timestamp."""
     cur = conn.cursor()
     cur.execute(
         f"""
         SELECT {column}
         FROM metrics_snapshots
-        WHERE {column} IS NOT NULL 
+        WHERE asset_key = ?
+          AND {column} IS NOT NULL 
           AND {column} > 0 
           AND ts_utc < ?
         ORDER BY ts_utc DESC
         LIMIT 1
         """,
-        (before_ts,)
+        (asset_key, before_ts)
     )
     row = cur.fetchone()
     return float(row[0]) if row and row[0] else 0.0
 
 
-def fix_zero_values():
-    """Fix all zero values in the database."""
-    conn = connect()
-    try:
-        timestamps = get_all_timestamps(conn)
-        logging.info(f"Found {len(timestamps)} snapshots to process")
+def _fix_chunk(conn: sqlite3.Connection, progress: Dict[str, Any]) -> bool:
+    """Replace zero values in the next CHUNK_SIZE snapshots after the cursor in `progress`.
+
+    Runs as one chunk of a database writer job; returns False once every snapshot is done.
+    """
+    cur = conn.cursor()
+    # Keyset over (ts_utc, asset_key), so each chunk is a short transaction
+    cur.execute(
+        f"""
+        SELECT asset_key, ts_utc, {', '.join(METRICS_COLUMNS)}
+        FROM metrics_snapshots
+        WHERE ts_utc > ? OR (ts_utc = ? AND asset_key > ?)
+        ORDER BY ts_utc, asset_key
+        LIMIT ?
+        """,
+        (progress["ts"], progress["ts"], progress["asset"], CHUNK_SIZE)
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return False
+    
+    for row in rows:
+        asset_key, ts = row[0], row[1]
         
-        fixes_made = 0
+        # Check each column for zero values
+        updates = {}
+        for i, column in enumerate(METRICS_COLUMNS):
+            current_value = row[2 + i]
+            
+            if current_value is None or current_value <= 0:
+                # Get last known good value
+                last_good = get_last_non_zero_before(conn, column, asset_key, ts)
+                
+                if last_good > 0:
+                    updates[column] = last_good
+                    logging.info(
+                        f"Fixing {asset_key} {column} at {ts}: {current_value} -> {last_good}"
+                    )
+                    progress["fixes"] += 1
         
-        for ts in timestamps:
-            cur = conn.cursor()
+        # Apply updates if any
+        if updates:
+            set_clause = ", ".join(f"{col} = ?" for col in updates.keys())
+            values = list(updates.values()) + [asset_key, ts]
             
-            # Get current values
             cur.execute(
                 f"""
-                SELECT {', '.join(METRICS_COLUMNS)}
-                FROM metrics_snapshots
-                WHERE ts_utc = ?
+                UPDATE metrics_snapshots
+                SET {set_clause}
+                WHERE asset_key = ? AND ts_utc = ?
                 """,
-                (ts,)
+                values
             )
-            row = cur.fetchone()
-            
-            if not row:
-                continue
-            
-            # Check each column for zero values
-            updates = {}
-            for i, column in enumerate(METRICS_COLUMNS):
-                current_value = row[i]
-                
-                if current_value is None or current_value <= 0:
-                    # Get last known good value
-                    last_good = get_last_non_zero_before(conn, column, ts)
-                    
-                    if last_good > 0:
-                        updates[column] = last_good
-                        logging.info(
-                            f"Fixing {column} at {ts}: {current_value} -> {last_good}"
-                        )
-                        fixes_made += 1
-            
-            # Apply updates if any
-            if updates:
-                set_clause = ", ".join(f"{col} = ?" for col in updates.keys())
-                values = list(updates.values()) + [ts]
-                
-                cur.execute(
-                    f"""
-                    UPDATE metrics_snapshots
-                    SET {set_clause}
-                    WHERE ts_utc = ?
-                    """,
-                    values
-                )
-        
-        conn.commit()
-        logging.info(f"✅ Fixed {fixes_made} zero values in the database")
+
+    progress["ts"], progress["asset"] = rows[-1][1], rows[-1][0]
+    progress["snapshots"] += len(rows)
+    return True
+
+
+def fix_zero_values():
+    """Fix all zero values in the database."""
+    progress = {"ts": "", "asset": "", "snapshots": 0, "fixes": 0}
+    chunks = db_writer.run_chunked(lambda conn: _fix_chunk(conn, progress))
+    if progress["fixes"]:
+        # The published dashboards still show the zeros
+        publish.publish_all()
+    conn = connect()
+    try:
+        logging.info(f"✅ Fixed {progress['fixes']} zero values in {progress['snapshots']} snapshots ({chunks} chunks)")
         
         # Show summary statistics
         cur = conn.cursor()
@@ -0,0 +1,90 @@
+"""
+Build the analytics archive and compare engines by hand.
+
+Usage:
+    python -m scripts.analytics refresh [--dir analytics]
+    python -m scripts.analytics status
+    python -m scripts.analytics compare [--asset asset] [--iterations 3]
+
+`refresh` exports whatever the archive is missing, so the first run on a long history
+takes a while; the service then keeps it current itself. `compare` runs every
+analytics query on both engines and prints timings and whether the results agree.
+"""
+import argparse
+import json
+import math
+import time
+from typing import Any, Dict, List
+
+from app import analytics
+from app.db import DEFAULT_ASSET_KEY
+
+QUERIES = {
+	"history_summaries": lambda asset: analytics.history_summaries(asset),
+	"history_pool_apy": lambda asset: analytics.history_pool_apy(asset),
+	"family_rollup_day": lambda asset: analytics.family_rollup(asset, "day"),
+	"family_rollup_month": lambda asset: analytics.family_rollup(asset, "month"),
+	"apy_distribution": lambda asset: analytics.apy_distribution(asset),
+	"reconcile_family_totals": lambda asset: analytics.reconcile_family_totals(asset),
+}
+
+
+def _same(a: List[Dict[str, Any]], b: List[Dict[str, Any]]) -> bool:
+	if len(a) != len(b):
+		return False
+	for x, y in zip(a, b):
+		if x.keys() != y.keys():
+			return False
+		for k in x:
+			u, v = x[k], y[k]
+			if isinstance(u, (int, float)) and isinstance(v, (int, float)):
+				if not math.isclose(u, v, rel_tol=1e-9, abs_tol=1e-6):
+					return False
+			elif u != v:
+				return False
+	return True
+
+
+def compare(asset: str, iterations: int) -> Dict[str, Any]:
+	out = {}
+	results = {}
+	for engine in ("sqlite", "duckdb"):
+		analytics.analytics_engine = analytics.AnalyticsEngine(engine=engine)
+		for name, fn in QUERIES.items():
+			results[engine, name] = fn(asset)  # warm up
+			started = time.perf_counter()
+			for _ in range(iterations):
+				fn(asset)
+			out.setdefault(name, {})[f"{engine}_ms"] = round((time.perf_counter() - started) * 1000 / iterations, 1)
+	for name in QUERIES:
+		out[name]["speedup"] = round(out[name]["sqlite_ms"] / max(out[name]["duckdb_ms"], 0.01), 1)
+		out[name]["match"] = _same(results["sqlite", name], results["duckdb", name])
+	return out
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--dir", default=None, help=f"archive directory (default {analytics.ANALYTICS_DIR})")
+	sub = parser.add_subparsers(dest="command")
+	sub.add_parser("refresh", help="extend the Parquet archive")
+	sub.add_parser("status", help="archive watermarks and file counts")
+	p_compare = sub.add_parser("compare", help="time every query on SQLite and DuckDB")
+	p_compare.add_argument("--asset", default=DEFAULT_ASSET_KEY)
+	p_compare.add_argument("--iterations", type=int, default=3)
+	args = parser.parse_args()
+
+	if args.dir:
+		analytics.ANALYTICS_DIR = args.dir
+		analytics.analytics_engine = analytics.AnalyticsEngine(args.dir)
+	if args.command == "refresh":
+		print(json.dumps(analytics.refresh_archive(args.dir), indent=2))
+	elif args.command == "status":
+		print(json.dumps(analytics.analytics_engine.status(), indent=2))
+	elif args.command == "compare":
+		print(json.dumps(compare(args.asset, args.iterations), indent=2))
+	else:
+		parser.print_help()
+
+
+if __name__ == "__main__":
+	main()
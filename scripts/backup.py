@@ -0,0 +1,66 @@
+"""
+Hot backups of the live database, and restores.
+
+Usage:
+    python -m scripts.backup create [--dir backups] [--keep 7]
+    python -m scripts.backup list
+    python -m scripts.backup verify [FILE ...]          # default: every backup
+    python -m scripts.backup restore FILE [--to-ts 2025-11-01T08:00:00Z] [--db PATH]
+    python -m scripts.backup restore --to-ts 2025-11-01T08:00:00Z   # picks the closest backup
+
+`create` is safe against the running service (see app/backup.py). `restore` writes
+into the database in place; stop the scheduler first so no snapshot lands mid-restore.
+"""
+import argparse
+import json
+import sys
+
+from app import backup
+from app.db import migrate
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--dir", default=None, help=f"backup directory (default {backup.BACKUP_DIR})")
+	sub = parser.add_subparsers(dest="command")
+	p_create = sub.add_parser("create", help="back up the live database")
+	p_create.add_argument("--keep", type=int, default=None)
+	sub.add_parser("list", help="list backups, newest first")
+	p_verify = sub.add_parser("verify", help="check sha256 and integrity")
+	p_verify.add_argument("files", nargs="*")
+	p_restore = sub.add_parser("restore", help="restore a backup, optionally as of a snapshot")
+	p_restore.add_argument("file", nargs="?")
+	p_restore.add_argument("--to-ts", default=None, help="keep snapshots up to this ts_utc")
+	p_restore.add_argument("--db", default=None, help="target database (default: ASSET_DB_PATH)")
+	args = parser.parse_args()
+
+	if args.command == "create":
+		migrate()
+		print(json.dumps(backup.create_backup(args.dir, args.keep), indent=2))
+	elif args.command == "list":
+		for m in backup.list_backups(args.dir):
+			last = max((r["last_ts"] for r in m["snapshots"].values()), default="-")
+			print(f"{m['file']}  {m['bytes']:>12}  last snapshot {last}")
+	elif args.command == "verify":
+		files = args.files or [m["path"] for m in backup.list_backups(args.dir)]
+		results = [backup.verify_backup(f) for f in files]
+		print(json.dumps(results, indent=2))
+		if not all(r["sha256_ok"] and r["integrity_ok"] for r in results):
+			sys.exit(1)
+	elif args.command == "restore":
+		path = args.file
+		if path is None:
+			if not args.to_ts:
+				parser.error("restore needs a FILE or --to-ts")
+			meta = backup.pick_backup(args.to_ts, args.dir)
+			if meta is None:
+				print(f"No backup holds snapshot {args.to_ts}")
+				sys.exit(1)
+			path = meta["path"]
+		print(json.dumps(backup.restore(path, args.to_ts, args.db), indent=2))
+	else:
+		parser.print_help()
+
+
+if __name__ == "__main__":
+	main()
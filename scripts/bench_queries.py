@@ -0,0 +1,94 @@
+"""
+Time the dashboard's query helpers against a (usually synthetic) database.
+
+Usage:
+    python -m scripts.generate_history --db /tmp/asrsv-3y.sqlite
+    python -m scripts.bench_queries --db /tmp/asrsv-3y.sqlite --iterations 20
+
+Reports p50/p90/p99/max latency per helper; --json prints machine-readable output
+so runs can be diffed to catch scaling regressions.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+
+def percentile(samples: List[float], pct: float) -> float:
+	"""Nearest-rank percentile of an unsorted sample list."""
+	ordered = sorted(samples)
+	rank = max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)
+	return ordered[min(rank, len(ordered) - 1)]
+
+
+def benchmarks() -> List[Tuple[str, Callable[[], object]]]:
+	"""(name, zero-argument callable) for every query helper in app.main."""
+	import app.main as m
+
+	latest = m._latest_metrics()
+	ts = latest["ts_utc"] if latest else ""
+	return [
+		("_latest_metrics", m._latest_metrics),
+		("_pools_for_ts", lambda: m._pools_for_ts(ts)),
+		("_get_fee_metrics", m._get_fee_metrics),
+		("_get_volume_metrics", m._get_volume_metrics),
+		("_history_summaries", m._history_summaries),
+		("_history_pool_apy", m._history_pool_apy),
+		("portfolio_composition", lambda: asyncio.run(m.portfolio_composition())),
+		("time_series", lambda: asyncio.run(m.time_series())),
+	]
+
+
+def run(iterations: int, warmup: int, only: List[str]) -> Dict[str, Dict[str, float]]:
+	results: Dict[str, Dict[str, float]] = {}
+	for name, fn in benchmarks():
+		if only and name not in only:
+			continue
+		for _ in range(warmup):
+			fn()
+		samples = []
+		for _ in range(iterations):
+			started = time.perf_counter()
+			fn()
+			samples.append((time.perf_counter() - started) * 1000.0)
+		results[name] = {
+			"p50_ms": percentile(samples, 50),
+			"p90_ms": percentile(samples, 90),
+			"p99_ms": percentile(samples, 99),
+			"max_ms": max(samples),
+			"mean_ms": statistics.fmean(samples),
+		}
+	return results
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--db", required=True)
+	parser.add_argument("--iterations", type=int, default=20)
+	parser.add_argument("--warmup", type=int, default=2)
+	parser.add_argument("--only", default="", help="comma-separated helper names")
+	parser.add_argument("--json", action="store_true")
+	args = parser.parse_args()
+
+	if not os.path.exists(args.db):
+		sys.exit(f"{args.db} does not exist; create it with scripts.generate_history")
+	# Must be set before app.db / app.main are imported
+	os.environ["ASSET_DB_PATH"] = args.db
+	os.environ["ASRSV_AUTO_REFRESH"] = "0"
+
+	results = run(args.iterations, args.warmup, [n for n in args.only.split(",") if n])
+	if args.json:
+		print(json.dumps(results, indent=2))
+		return
+	print(f"{'helper':<24}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+	for name, r in results.items():
+		print(f"{name:<24}{r['p50_ms']:>10.2f}{r['p90_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+	main()
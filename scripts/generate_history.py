@@ -0,0 +1,197 @@
+"""
+Fill a database with synthetic snapshot history for scale testing.
+
+Usage:
+    python -m scripts.generate_history --db /tmp/asrsv-3y.sqlite --days 1095 --pools 300
+
+Writes metrics_snapshots, pool_snapshots, composition_snapshots, pools_state and
+family_totals using the same derivations as snapshot_once, so the dashboard queries
+see realistic shapes. Everything is written for the default asset.
+"""
+import argparse
+import datetime
+import math
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+BASE58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+QUOTES = [
+	"SOL", "USDC", "USDT", "JUP", "BONK", "WIF", "JTO", "PYTH", "RAY", "ORCA",
+	"Fartcoin", "wTAO", "POPCAT", "MEW", "RENDER", "HNT", "W", "TNSR", "KMNO", "DRIFT",
+]
+SOURCES = ["Meteora", "Meteora", "Meteora", "Raydium", "Orca"]
+
+
+def _address(rng: random.Random) -> str:
+	return "".join(rng.choice(BASE58) for _ in range(44))
+
+
+def _make_pools(rng: random.Random, count: int, n_ticks: int) -> List[Dict[str, Any]]:
+	pools = []
+	for i in range(count):
+		quote = QUOTES[i % len(QUOTES)] if i < len(QUOTES) else rng.choice(QUOTES)
+		pools.append({
+			"address": _address(rng),
+			"family": f"asset-{quote}",
+			"quote_symbol": quote,
+			"quote_price": 1.0 if quote in ("USDC", "USDT") else math.exp(rng.uniform(-6, 5)),
+			"source": rng.choice(SOURCES),
+			"liquidity": math.exp(rng.gauss(8.5, 1.2)),
+			"turnover": math.exp(rng.gauss(-2.5, 0.8)),
+			# Most pools exist from the start; the rest launch part-way through
+			"start": 0 if rng.random() < 0.5 else rng.randrange(n_ticks),
+		})
+	return pools
+
+
+def generate(db_path: str, days: int, interval_minutes: int, pool_count: int, seed: int,
+		end: datetime.datetime, batch_ticks: int = 200) -> Dict[str, int]:
+	os.environ["ASSET_DB_PATH"] = db_path
+	from app.db import migrate, _connect, write_composition
+	from core.fee_policy import PROTOCOL_CUT_METEORA, fee_rate_for_pair
+
+	migrate()
+	rng = random.Random(seed)
+	interval = datetime.timedelta(minutes=interval_minutes)
+	n_ticks = int(days * 24 * 60 / interval_minutes)
+	start = end - interval * n_ticks
+	pools = _make_pools(rng, pool_count, n_ticks)
+
+	price = 0.05
+	total_supply = 3_000_000.0
+	reserve = 1_200_000.0
+	last_volume: Dict[str, float] = {}
+	family_totals: Dict[str, List[float]] = {}
+	pool_rows = 0
+
+	conn = _connect()
+	try:
+		cur = conn.cursor()
+		cur.execute("BEGIN")
+		for tick in range(n_ticks):
+			ts_dt = start + interval * (tick + 1)
+			ts = ts_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+			hour_factor = 1.0 + 0.4 * math.sin(2 * math.pi * ts_dt.hour / 24.0)
+			price = max(price * math.exp(rng.gauss(0, 0.01)), 1e-6)
+			reserve = max(reserve + rng.gauss(0, 500), 0.0)
+
+			rows = []
+			total_tvl = total_vol = total_fees = 0.0
+			for p in pools:
+				if tick < p["start"]:
+					continue
+				p["liquidity"] = max(p["liquidity"] * math.exp(rng.gauss(0, 0.02)), 10.0)
+				p["quote_price"] = max(p["quote_price"] * math.exp(rng.gauss(0, 0.01)), 1e-9) if p["quote_price"] != 1.0 else 1.0
+				liq = p["liquidity"]
+				vol = liq * p["turnover"] * hour_factor * math.exp(rng.gauss(0, 0.3))
+				fee_rate = fee_rate_for_pair(p["family"], p["quote_symbol"])
+				cut = PROTOCOL_CUT_METEORA if p["source"] == "Meteora" else 0.0
+				real_tvl = liq / 2.0
+				gross = vol * fee_rate
+				protocol = gross * cut
+				net = gross - protocol
+				daily_yield = net / real_tvl if real_tvl > 0 else 0.0
+				apy_comp = math.pow(1.0 + daily_yield, 365.0) - 1.0 if daily_yield > 0 else 0.0
+				rows.append((
+					ts, p["address"], p["family"], "asset", p["quote_symbol"],
+					liq, real_tvl, vol, fee_rate, cut, p["source"],
+					gross, protocol, net, daily_yield, daily_yield * 365.0, apy_comp,
+					p["quote_price"], real_tvl / p["quote_price"],
+				))
+
+				last = last_volume.get(p["address"], 0.0)
+				delta = vol - last if vol >= last else vol
+				last_volume[p["address"]] = vol
+				ft = family_totals.setdefault(p["family"], [0.0, 0.0])
+				ft[0] += delta
+				ft[1] += delta * fee_rate * (1.0 - cut)
+
+				total_tvl += real_tvl
+				total_vol += vol
+				total_fees += net
+
+			cur.executemany(
+				"""
+				INSERT OR REPLACE INTO pool_snapshots
+				(ts_utc, pool_address, family, base_symbol, quote_symbol,
+				 liquidity_usd, real_tvl_usd, volume_24h_usd, fee_rate, protocol_cut, source,
+				 gross_fee_24h_usd, protocol_fee_24h_usd, fee_24h_usd, daily_yield, apy_simple, apy_compound,
+				 quote_price_usd, quote_units, fee_policy_version)
+				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+				""",
+				rows,
+			)
+			pool_rows += len(rows)
+
+			circulating = max(total_supply - reserve, 0.0)
+			fdv = price * total_supply
+			daily = total_fees / total_tvl if total_tvl > 0 else 0.0
+			cur.execute(
+				"""
+				INSERT OR REPLACE INTO metrics_snapshots
+				(ts_utc, price_usd, fdv_usd, market_cap_usd, circulating_supply,
+				 real_tvl_total_usd, volume_24h_usd, collateralization_ratio,
+				 real_yield_daily, apy_simple, apy_compound)
+				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+				""",
+				(
+					ts, price, fdv, price * circulating, circulating, total_tvl, total_vol,
+					total_tvl / fdv if fdv > 0 else 0.0,
+					daily, daily * 365.0, math.pow(1.0 + daily, 365.0) - 1.0 if daily > 0 else 0.0,
+				),
+			)
+
+			if (tick + 1) % batch_ticks == 0:
+				cur.execute("COMMIT")
+				print(f"  {tick + 1}/{n_ticks} snapshots, {pool_rows} pool rows", file=sys.stderr)
+				cur.execute("BEGIN")
+
+		cur.executemany(
+			"""
+			INSERT INTO pools_state (pool_address, last_volume_24h_usd) VALUES (?, ?)
+			ON CONFLICT(asset_key, pool_address) DO UPDATE SET last_volume_24h_usd = excluded.last_volume_24h_usd
+			""",
+			list(last_volume.items()),
+		)
+		cur.executemany(
+			"""
+			INSERT INTO family_totals (family, all_time_volume_usd, all_time_fees_usd) VALUES (?, ?, ?)
+			ON CONFLICT(asset_key, family) DO UPDATE SET
+			  all_time_volume_usd = excluded.all_time_volume_usd,
+			  all_time_fees_usd   = excluded.all_time_fees_usd
+			""",
+			[(fam, v[0], v[1]) for fam, v in family_totals.items()],
+		)
+		write_composition(cur)
+		cur.execute("COMMIT")
+	finally:
+		conn.close()
+
+	return {"snapshots": n_ticks, "pool_rows": pool_rows, "pools": len(pools)}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--db", required=True, help="target SQLite file (created if missing)")
+	parser.add_argument("--days", type=int, default=1095)
+	parser.add_argument("--interval-minutes", type=int, default=30)
+	parser.add_argument("--pools", type=int, default=200)
+	parser.add_argument("--seed", type=int, default=42)
+	parser.add_argument("--end", help="last snapshot time (ISO, UTC); defaults to now")
+	args = parser.parse_args()
+
+	end = datetime.datetime.now(datetime.timezone.utc)
+	if args.end:
+		end = datetime.datetime.fromisoformat(args.end.replace("Z", "+00:00"))
+	end = end.replace(second=0, microsecond=0)
+
+	started = time.perf_counter()
+	stats = generate(args.db, args.days, args.interval_minutes, args.pools, args.seed, end)
+	print(f"Generated {stats} into {args.db} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+	main()
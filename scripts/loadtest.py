@@ -0,0 +1,149 @@
+"""
+HTTP load test for app.main:app against a generated database.
+
+Usage:
+    python -m scripts.loadtest --db /tmp/asrsv-3y.sqlite --workers 1,2,4 --concurrency 32 --duration 30
+
+For each worker count a uvicorn server is started with auto-refresh and upstream
+calls disabled (ASRSV_AUTO_REFRESH=0, ASRSV_OFFLINE=1), the routes are driven at
+the given concurrency, and throughput plus p50/p99 latency are reported per route.
+If --db does not exist it is generated first (see scripts.generate_history).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+
+from scripts.bench_queries import percentile
+
+DEFAULT_ROUTES = "/,/history,/api/time-series,/api/portfolio-composition"
+
+
+def _wait_ready(base_url: str, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if proc.poll() is not None:
+			raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+		try:
+			if requests.get(f"{base_url}/api/time-series", timeout=2).status_code == 200:
+				return
+		except requests.RequestException:
+			pass
+		time.sleep(0.5)
+	raise RuntimeError("server did not become ready")
+
+
+def _drive(base_url: str, routes: List[str], concurrency: int, duration: float) -> List[Tuple[str, float, int]]:
+	"""Each client loops over the routes until the deadline; returns (route, ms, status)."""
+	samples: List[Tuple[str, float, int]] = []
+	lock = threading.Lock()
+	deadline = time.time() + duration
+
+	def client(offset: int) -> None:
+		session = requests.Session()
+		local = []
+		i = offset
+		while time.time() < deadline:
+			route = routes[i % len(routes)]
+			i += 1
+			started = time.perf_counter()
+			try:
+				status = session.get(base_url + route, timeout=30).status_code
+			except requests.RequestException:
+				status = 0
+			local.append((route, (time.perf_counter() - started) * 1000.0, status))
+		with lock:
+			samples.extend(local)
+
+	with ThreadPoolExecutor(max_workers=concurrency) as pool:
+		list(pool.map(client, range(concurrency)))
+	return samples
+
+
+def _summarize(samples: List[Tuple[str, float, int]], duration: float) -> Dict[str, Dict[str, float]]:
+	by_route: Dict[str, List[Tuple[float, int]]] = {}
+	for route, ms, status in samples:
+		by_route.setdefault(route, []).append((ms, status))
+	summary = {}
+	for route, rows in by_route.items():
+		latencies = [ms for ms, _ in rows]
+		summary[route] = {
+			"requests": len(rows),
+			"errors": sum(1 for _, status in rows if status != 200),
+			"rps": len(rows) / duration,
+			"p50_ms": percentile(latencies, 50),
+			"p99_ms": percentile(latencies, 99),
+		}
+	return summary
+
+
+def run_for_workers(db: str, workers: int, port: int, routes: List[str], concurrency: int,
+		duration: float) -> Dict[str, Dict[str, float]]:
+	env = dict(os.environ, ASSET_DB_PATH=db, ASRSV_AUTO_REFRESH="0", ASRSV_OFFLINE="1")
+	cmd = [
+		sys.executable, "-m", "uvicorn", "app.main:app",
+		"--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+	]
+	proc = subprocess.Popen(cmd, env=env)
+	base_url = f"http://127.0.0.1:{port}"
+	try:
+		_wait_ready(base_url, proc)
+		_drive(base_url, routes, concurrency, min(duration, 3.0))  # warm-up
+		samples = _drive(base_url, routes, concurrency, duration)
+	finally:
+		proc.terminate()
+		try:
+			proc.wait(timeout=15)
+		except subprocess.TimeoutExpired:
+			proc.kill()
+	return _summarize(samples, duration)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--db", required=True)
+	parser.add_argument("--days", type=int, default=365, help="history to generate when --db is missing")
+	parser.add_argument("--pools", type=int, default=100, help="pools to generate when --db is missing")
+	parser.add_argument("--workers", default="1,2,4", help="comma-separated uvicorn worker counts")
+	parser.add_argument("--concurrency", type=int, default=16)
+	parser.add_argument("--duration", type=float, default=20.0, help="seconds per worker count")
+	parser.add_argument("--routes", default=DEFAULT_ROUTES)
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--json", action="store_true")
+	args = parser.parse_args()
+
+	db = os.path.abspath(args.db)
+	if not os.path.exists(db):
+		from scripts.generate_history import generate
+		import datetime
+		print(f"Generating {args.days} days x {args.pools} pools into {db}...", file=sys.stderr)
+		generate(db, args.days, 30, args.pools, 42,
+			datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0))
+
+	routes = [r for r in args.routes.split(",") if r]
+	results = {}
+	for workers in [int(w) for w in args.workers.split(",") if w]:
+		print(f"Running {workers} worker(s), concurrency {args.concurrency}, {args.duration:.0f}s...", file=sys.stderr)
+		results[workers] = run_for_workers(db, workers, args.port, routes, args.concurrency, args.duration)
+
+	if args.json:
+		print(json.dumps(results, indent=2))
+		return
+	print(f"{'workers':>7}  {'route':<30}{'req':>8}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}")
+	for workers, summary in results.items():
+		for route in routes:
+			r = summary.get(route)
+			if not r:
+				continue
+			print(f"{workers:>7}  {route:<30}{r['requests']:>8}{r['errors']:>6}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+	main()
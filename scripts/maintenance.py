@@ -0,0 +1,47 @@
+"""
+Run database maintenance by hand.
+
+Usage:
+    python -m scripts.maintenance report
+    python -m scripts.maintenance run [optimize analyze vacuum checkpoint]   # default: what is due
+    python -m scripts.maintenance rebuild   # service stopped; applies ASRSV_DB_PROFILE's page size
+
+`rebuild` rewrites the database with incremental auto-vacuum, which the vacuum task
+needs; databases created before it existed have auto-vacuum off.
+"""
+import argparse
+import json
+
+from app.db import migrate
+from app import maintenance
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	sub = parser.add_subparsers(dest="command")
+	sub.add_parser("report", help="sizes, thresholds and due tasks")
+	p_run = sub.add_parser("run", help="run tasks now")
+	p_run.add_argument("tasks", nargs="*", help=f"any of {', '.join(maintenance.TASKS)}")
+	sub.add_parser("rebuild", help="VACUUM into the profile's page size with incremental auto-vacuum")
+	args = parser.parse_args()
+
+	migrate()
+	if args.command == "report":
+		print(json.dumps(maintenance.report(), indent=2))
+	elif args.command == "run":
+		unknown = [t for t in args.tasks if t not in maintenance.TASK_RUNNERS]
+		if unknown:
+			parser.error(f"unknown task(s): {', '.join(unknown)}")
+		if args.tasks:
+			results = {task: maintenance.TASK_RUNNERS[task]() for task in args.tasks}
+		else:
+			results = maintenance.maintenance_scheduler.run_due()
+		print(json.dumps(results, indent=2))
+	elif args.command == "rebuild":
+		print(json.dumps(maintenance.rebuild(), indent=2))
+	else:
+		parser.print_help()
+
+
+if __name__ == "__main__":
+	main()
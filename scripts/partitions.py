@@ -0,0 +1,56 @@
+"""
+Monthly partitions of pool_snapshots.
+
+Usage:
+    python -m scripts.partitions status
+    python -m scripts.partitions run                  # seal due months, drop expired ones
+    python -m scripts.partitions seal 2025-09
+    python -m scripts.partitions drop 2025-01
+    python -m scripts.partitions verify
+
+The maintenance scheduler runs `run` on its own (see app/maintenance.py). Months are
+sealed oldest first and only once they have left the hot window
+(ASRSV_PARTITION_HOT_MONTHS). `drop` deletes a partition's file for good; the month
+keeps counting towards all-time fees and volume.
+"""
+import argparse
+import json
+import sys
+
+from app import partitions
+from app.db import migrate
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	sub = parser.add_subparsers(dest="command")
+	sub.add_parser("status", help="registry, hot window and months due")
+	sub.add_parser("run", help="seal every due month and drop partitions past retention")
+	p_seal = sub.add_parser("seal", help="seal one month (must be the oldest due)")
+	p_seal.add_argument("month", help="YYYY-MM")
+	p_drop = sub.add_parser("drop", help="delete a sealed partition's file")
+	p_drop.add_argument("month", help="YYYY-MM")
+	sub.add_parser("verify", help="check every partition's sha256 and integrity")
+	args = parser.parse_args()
+
+	if args.command is None:
+		parser.print_help()
+		return
+	migrate()
+	if args.command == "status":
+		print(json.dumps(partitions.status(), indent=2))
+	elif args.command == "run":
+		print(json.dumps(partitions.run(), indent=2))
+	elif args.command == "seal":
+		print(json.dumps(partitions.seal_month(args.month), indent=2))
+	elif args.command == "drop":
+		print(json.dumps(partitions.drop_partition(args.month), indent=2))
+	elif args.command == "verify":
+		results = partitions.verify()
+		print(json.dumps(results, indent=2))
+		if not all(r["ok"] for r in results):
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
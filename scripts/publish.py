@@ -0,0 +1,47 @@
+"""
+Published dashboard pages.
+
+Usage:
+    python -m scripts.publish status
+    python -m scripts.publish run [--asset asset]     # all enabled assets by default
+    python -m scripts.publish clear --asset asset     # serve the asset dynamically again
+
+Snapshots republish their asset on their own (see app/publish.py); `run` is for the
+first deploy and after editing the dashboard template. `clear` only removes the
+`current` link, so the next snapshot publishes the asset again unless ASRSV_PUBLISH=0.
+"""
+import argparse
+import json
+import sys
+
+from app import publish
+from app.db import migrate
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	sub = parser.add_subparsers(dest="command")
+	sub.add_parser("status", help="current and kept versions per asset")
+	p_run = sub.add_parser("run", help="render and publish now")
+	p_run.add_argument("--asset", default=None)
+	p_clear = sub.add_parser("clear", help="unpublish one asset")
+	p_clear.add_argument("--asset", required=True)
+	args = parser.parse_args()
+
+	if args.command is None:
+		parser.print_help()
+		return
+	if args.command == "status":
+		print(json.dumps(publish.status(), indent=2))
+	elif args.command == "run":
+		migrate()
+		results = [publish.publish_dashboard(args.asset)] if args.asset else publish.publish_all()
+		print(json.dumps(results, indent=2))
+		if any("error" in r for r in results):
+			sys.exit(1)
+	elif args.command == "clear":
+		publish.unpublish(args.asset)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,389 @@
+"""
+Recompute stored fee/yield columns after a fee policy change.
+
+Usage:
+    python -m scripts.recompute_fees add-policy --effective-from 2025-11-01T00:00:00Z \\
+        --default-fee-rate 0.008 --usdc-fee-rate 0.0025 --meteora-protocol-cut 0.2
+    python -m scripts.recompute_fees run [--chunk-size 5000] [--pause-ms 50] [--restart]
+    python -m scripts.recompute_fees status
+
+`run` streams pool_snapshots in (ts_utc, pool_address, asset_key) order, applies the policy
+in force at each row's timestamp, and rewrites fee_rate, protocol_cut, the fee
+columns, daily_yield and the APYs in short transactions, one writer job
+(app/writer.py) per batch. Sealed months (app/partitions.py) come first, each
+recomputed into a replacement partition file; dropped ones keep the totals they
+were sealed with. It then rederives the portfolio yield columns of
+metrics_snapshots and rebuilds family_totals.
+Progress (cursor plus running family totals) is committed with every batch, so an
+interrupted run resumes where it stopped; rerun with --restart to start over.
+"""
+import argparse
+import bisect
+import json
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from app import partitions, publish
+from app.db import DEFAULT_ASSET_KEY, _connect, hot_floor, migrate, pool_snapshot_sources
+from app.writer import db_writer
+from core.compute import pool_metrics, portfolio_metrics
+from core.fee_policy import add_policy, fee_rate_for_pair, load_policies, protocol_cut_for_source
+
+JOB_ID = "fee_recompute"
+
+
+def _load_job(conn, restart: bool) -> Dict[str, Any]:
+	row = conn.execute("SELECT * FROM fee_recompute_jobs WHERE job_id = ?", (JOB_ID,)).fetchone()
+	if row is None or restart or row["status"] == "done":
+		return {
+			"job_id": JOB_ID, "status": "running", "phase": "partitions",
+			"cursor_ts": "", "cursor_pool": "", "cursor_asset": "", "rows_done": 0,
+			"state": {"last_volume": {}, "families": {}, "partition_month": ""},
+			"started_at": time.time(),
+		}
+	job = dict(row)
+	job["cursor_asset"] = job.get("cursor_asset") or ""
+	job["state"] = json.loads(job["state"] or "{}")
+	families = job["state"].get("families", {})
+	if any(isinstance(v, list) for v in families.values()):
+		# Progress saved before totals were kept per asset
+		job["state"]["families"] = {DEFAULT_ASSET_KEY: families}
+		job["state"]["last_volume"] = {f"{DEFAULT_ASSET_KEY}:{k}": v for k, v in job["state"].get("last_volume", {}).items()}
+	return job
+
+
+def _save_job(conn, job: Dict[str, Any]) -> None:
+	conn.execute(
+		"""
+		INSERT INTO fee_recompute_jobs
+		(job_id, status, phase, cursor_ts, cursor_pool, cursor_asset, rows_done, state, started_at, updated_at)
+		VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+		ON CONFLICT(job_id) DO UPDATE SET
+		  status = excluded.status, phase = excluded.phase,
+		  cursor_ts = excluded.cursor_ts, cursor_pool = excluded.cursor_pool, cursor_asset = excluded.cursor_asset,
+		  rows_done = excluded.rows_done, state = excluded.state,
+		  started_at = excluded.started_at, updated_at = excluded.updated_at
+		""",
+		(
+			job["job_id"], job["status"], job["phase"], job["cursor_ts"], job["cursor_pool"], job["cursor_asset"],
+			job["rows_done"], json.dumps(job["state"]), job["started_at"], time.time(),
+		),
+	)
+
+
+def _read_pool_chunk(conn, cursor_ts: str, cursor_pool: str, cursor_asset: str, limit: int) -> List[Any]:
+	# Keyset in primary key order; a pool shared by two assets has a row for each
+	return conn.execute(
+		"""
+		SELECT ts_utc, pool_address, asset_key, family, quote_symbol, source, liquidity_usd, volume_24h_usd
+		FROM pool_snapshots
+		WHERE ts_utc > ? OR (ts_utc = ? AND (pool_address > ? OR (pool_address = ? AND asset_key > ?)))
+		ORDER BY ts_utc, pool_address, asset_key
+		LIMIT ?
+		""",
+		(cursor_ts, cursor_ts, cursor_pool, cursor_pool, cursor_asset, limit),
+	).fetchall()
+
+
+def _recompute_pool_chunk(rows: List[Any], policies: List[Dict[str, Any]],
+		state: Dict[str, Any]) -> List[Tuple]:
+	"""UPDATE parameters for a chunk; advances the per-pool volume pointer and family totals in `state`."""
+	starts = [p["effective_from"] for p in policies]
+	row_policies = [policies[max(bisect.bisect_right(starts, r["ts_utc"]) - 1, 0)] for r in rows]
+	rates = [fee_rate_for_pair(r["family"], r["quote_symbol"], p) for r, p in zip(rows, row_policies)]
+	cuts = [protocol_cut_for_source(r["source"], p) for r, p in zip(rows, row_policies)]
+	volumes = [float(r["volume_24h_usd"] or 0.0) for r in rows]
+	m = pool_metrics([r["liquidity_usd"] or 0.0 for r in rows], volumes, rates, cuts)
+	cols = {k: v.tolist() for k, v in m.items()}
+
+	last_volume = state["last_volume"]
+	families = state["families"]
+	params = []
+	for i, r in enumerate(rows):
+		# Same delta rule as snapshot_once: a 24h volume drop means the window reset
+		key = f"{r['asset_key']}:{r['pool_address']}"
+		last = last_volume.get(key, 0.0)
+		curr = volumes[i]
+		delta = max(curr - last if curr >= last else curr, 0.0)
+		last_volume[key] = curr
+		fam = families.setdefault(r["asset_key"], {}).setdefault(r["family"] or "", [0.0, 0.0])
+		fam[0] += delta
+		fam[1] += delta * rates[i] * (1.0 - cuts[i])
+
+		params.append((
+			rates[i], cuts[i], cols["gross_fee_24h_usd"][i], cols["protocol_fee_24h_usd"][i],
+			cols["fee_24h_usd"][i], cols["daily_yield"][i], cols["apy_simple"][i], cols["apy_compound"][i],
+			row_policies[i]["version"], r["ts_utc"], r["pool_address"], r["asset_key"],
+		))
+	return params
+
+
+def _write_pool_chunk(conn, params: List[Tuple]) -> None:
+	conn.executemany(
+		"""
+		UPDATE pool_snapshots
+		SET fee_rate = ?, protocol_cut = ?, gross_fee_24h_usd = ?, protocol_fee_24h_usd = ?,
+		    fee_24h_usd = ?, daily_yield = ?, apy_simple = ?, apy_compound = ?, fee_policy_version = ?
+		WHERE ts_utc = ? AND pool_address = ? AND asset_key = ?
+		""",
+		params,
+	)
+
+
+def _carry_dropped(state: Dict[str, Any], stats: Dict[str, Any]) -> None:
+	"""Take a dropped partition's family totals as sealed and continue from its last pool volumes."""
+	for asset_key, asset in stats["assets"].items():
+		for family, (volume, fees) in asset["families"].items():
+			fam = state["families"].setdefault(asset_key, {}).setdefault(family, [0.0, 0.0])
+			fam[0] += volume
+			fam[1] += fees
+	for asset_key, pools in stats["pool_last"].items():
+		for pool, volume in pools.items():
+			state["last_volume"][f"{asset_key}:{pool}"] = volume
+
+
+def _partitions_phase(job: Dict[str, Any], policies: List[Dict[str, Any]], chunk_size: int) -> None:
+	"""Recompute sealed months oldest first, each into a copy that replaces its partition file."""
+	conn = _connect()
+	try:
+		parts = conn.execute(
+			"SELECT month, rows, stats, dropped_at FROM pool_partitions WHERE month > ? ORDER BY month",
+			(job["state"].get("partition_month", ""),),
+		).fetchall()
+	finally:
+		conn.close()
+	for part in parts:
+		month = part["month"]
+
+		def recompute(dst) -> None:
+			cursor_ts, cursor_pool, cursor_asset = "", "", ""
+			while True:
+				rows = _read_pool_chunk(dst, cursor_ts, cursor_pool, cursor_asset, chunk_size)
+				if not rows:
+					return
+				_write_pool_chunk(dst, _recompute_pool_chunk(rows, policies, job["state"]))
+				cursor_ts, cursor_pool, cursor_asset = rows[-1]["ts_utc"], rows[-1]["pool_address"], rows[-1]["asset_key"]
+				job["rows_done"] += len(rows)
+
+		def save(c) -> None:
+			job["state"]["partition_month"] = month
+			_save_job(c, job)
+
+		# Progress is saved with the registry switch, so a resumed run never applies a month twice
+		if part["dropped_at"] is not None:
+			_carry_dropped(job["state"], json.loads(part["stats"]))
+			db_writer.run(save)
+		else:
+			partitions.rewrite(month, recompute, then=save)
+		print(f"  partitions: {month} ({part['rows']} rows{', dropped' if part['dropped_at'] else ''})", file=sys.stderr)
+
+
+def _pools_phase(job: Dict[str, Any], policies: List[Dict[str, Any]], chunk_size: int,
+		pause: float, total: int) -> None:
+	started = time.time()
+	done_at_start = job["rows_done"]
+
+	def step(conn) -> bool:
+		rows = _read_pool_chunk(conn, job["cursor_ts"], job["cursor_pool"], job["cursor_asset"], chunk_size)
+		if not rows:
+			return False
+		params = _recompute_pool_chunk(rows, policies, job["state"])
+		job["cursor_ts"], job["cursor_pool"], job["cursor_asset"] = rows[-1]["ts_utc"], rows[-1]["pool_address"], rows[-1]["asset_key"]
+		job["rows_done"] += len(rows)
+		_write_pool_chunk(conn, params)
+		_save_job(conn, job)
+		return True
+
+	# A failed chunk rolls back but has already advanced `job`, so the error ends the
+	# run and the next one resumes from the saved progress
+	while db_writer.run(step):
+		rate = (job["rows_done"] - done_at_start) / max(time.time() - started, 1e-6)
+		remaining = max(total - job["rows_done"], 0)
+		print(f"  pools: {job['rows_done']}/{total} rows at {job['cursor_ts']} "
+			f"({rate:.0f} rows/s, ~{remaining / max(rate, 1e-6):.0f}s left)", file=sys.stderr)
+		if pause:
+			time.sleep(pause)
+
+
+def _sealed_fees() -> Tuple[str, Dict[Tuple[str, str], float]]:
+	"""The live table's floor and fee sums per (asset, snapshot) in sealed partitions.
+
+	Writer jobs run inside a transaction, where partitions cannot be attached.
+	"""
+	conn = _connect()
+	try:
+		fees: Dict[Tuple[str, str], float] = {}
+		for table, sealed in pool_snapshot_sources(conn):
+			if sealed:
+				fees.update({(r[0], r[1]): r[2] for r in conn.execute(
+					f"SELECT asset_key, ts_utc, COALESCE(SUM(fee_24h_usd), 0) FROM {table} GROUP BY asset_key, ts_utc"
+				)})
+		return hot_floor(conn) or "", fees
+	finally:
+		conn.close()
+
+
+def _metrics_phase(job: Dict[str, Any], chunk_size: int, pause: float) -> None:
+	"""Rederive portfolio yield/APY per snapshot from the recomputed pool fees."""
+	floor, sealed_fees = _sealed_fees()
+
+	def step(conn) -> bool:
+		# Keyset over (ts_utc, asset_key); cursor_pool holds the asset key in this phase
+		snaps = conn.execute(
+			"""
+			SELECT asset_key, ts_utc, real_tvl_total_usd FROM metrics_snapshots
+			WHERE ts_utc > ? OR (ts_utc = ? AND asset_key > ?)
+			ORDER BY ts_utc, asset_key LIMIT ?
+			""",
+			(job["cursor_ts"], job["cursor_ts"], job["cursor_pool"], chunk_size),
+		).fetchall()
+		if not snaps:
+			return False
+		first, last = snaps[0]["ts_utc"], snaps[-1]["ts_utc"]
+		fees = {(r[0], r[1]): r[2] for r in conn.execute(
+			"""
+			SELECT asset_key, ts_utc, COALESCE(SUM(fee_24h_usd), 0)
+			FROM pool_snapshots
+			WHERE ts_utc BETWEEN ? AND ? AND ts_utc >= ?
+			GROUP BY asset_key, ts_utc
+			""",
+			(first, last, floor),
+		)}
+		params = []
+		for s in snaps:
+			key = (s["asset_key"], s["ts_utc"])
+			p = portfolio_metrics(float(fees.get(key, sealed_fees.get(key, 0.0))), float(s["real_tvl_total_usd"] or 0.0))
+			params.append((p["real_yield_daily"], p["apy_simple"], p["apy_compound"], s["asset_key"], s["ts_utc"]))
+		job["cursor_ts"], job["cursor_pool"] = last, snaps[-1]["asset_key"]
+		conn.executemany(
+			"""
+			UPDATE metrics_snapshots SET real_yield_daily = ?, apy_simple = ?, apy_compound = ?
+			WHERE asset_key = ? AND ts_utc = ?
+			""",
+			params,
+		)
+		_save_job(conn, job)
+		return True
+
+	while db_writer.run(step):
+		print(f"  metrics: through {job['cursor_ts']}", file=sys.stderr)
+		if pause:
+			time.sleep(pause)
+
+
+def _finalize(job: Dict[str, Any], policies: List[Dict[str, Any]], chunk_size: int) -> None:
+	"""Catch up on snapshots written during the run and swap in the rebuilt family_totals atomically."""
+	def finish(conn) -> None:
+		while True:
+			rows = _read_pool_chunk(conn, job["pool_cursor_ts"], job["pool_cursor_pool"], job["pool_cursor_asset"], chunk_size)
+			if not rows:
+				break
+			_write_pool_chunk(conn, _recompute_pool_chunk(rows, policies, job["state"]))
+			job["pool_cursor_ts"], job["pool_cursor_pool"], job["pool_cursor_asset"] = (
+				rows[-1]["ts_utc"], rows[-1]["pool_address"], rows[-1]["asset_key"])
+			job["rows_done"] += len(rows)
+		conn.execute("DELETE FROM family_totals")
+		conn.executemany(
+			"INSERT INTO family_totals (asset_key, family, all_time_volume_usd, all_time_fees_usd) VALUES (?, ?, ?, ?)",
+			[
+				(asset_key, fam, v[0], v[1])
+				for asset_key, families in job["state"]["families"].items()
+				for fam, v in families.items()
+			],
+		)
+		job["status"], job["phase"] = "done", "done"
+		_save_job(conn, job)
+
+	db_writer.run(finish)
+
+
+def run(chunk_size: int, pause_ms: int, restart: bool) -> Dict[str, Any]:
+	migrate()
+	policies = load_policies()
+	conn = _connect()
+	try:
+		job = _load_job(conn, restart)
+		floor = hot_floor(conn) or ""
+		total = conn.execute("SELECT COUNT(*) FROM pool_snapshots WHERE ts_utc >= ?", (floor,)).fetchone()[0]
+		total += conn.execute("SELECT COALESCE(SUM(rows), 0) FROM pool_partitions WHERE dropped_at IS NULL").fetchone()[0]
+	finally:
+		conn.close()
+	pause = pause_ms / 1000.0
+	if job["phase"] == "partitions":
+		# Mark the job running first: app.partitions does not seal while a recompute runs
+		db_writer.run(lambda c: _save_job(c, job))
+		_partitions_phase(job, policies, chunk_size)
+		# The live table starts after the last sealed month
+		job["phase"], job["cursor_ts"], job["cursor_pool"], job["cursor_asset"] = "pools", floor, "", ""
+		db_writer.run(lambda c: _save_job(c, job))
+	if job["phase"] == "pools":
+		_pools_phase(job, policies, chunk_size, pause, total)
+		# Remember where the pool scan ended; the metrics phase reuses cursor_ts
+		job["state"]["pool_cursor"] = [job["cursor_ts"], job["cursor_pool"], job["cursor_asset"]]
+		job["phase"], job["cursor_ts"], job["cursor_pool"], job["cursor_asset"] = "metrics", "", "", ""
+		db_writer.run(lambda c: _save_job(c, job))
+	if job["phase"] == "metrics":
+		_metrics_phase(job, chunk_size, pause)
+		job["phase"] = "finalize"
+		db_writer.run(lambda c: _save_job(c, job))
+	# Cursors saved before the key included asset_key have two parts
+	pool_cursor = job["state"].get("pool_cursor", [])
+	job["pool_cursor_ts"], job["pool_cursor_pool"], job["pool_cursor_asset"] = (pool_cursor + ["", "", ""])[:3]
+	_finalize(job, policies, chunk_size)
+	# The published pages still show the old fees and all-time totals
+	publish.publish_all()
+	return {"rows_done": job["rows_done"], "families": sum(len(f) for f in job["state"]["families"].values())}
+
+
+def status() -> Dict[str, Any]:
+	migrate()
+	conn = _connect()
+	try:
+		row = conn.execute(
+			"SELECT job_id, status, phase, cursor_ts, rows_done, started_at, updated_at FROM fee_recompute_jobs WHERE job_id = ?",
+			(JOB_ID,),
+		).fetchone()
+		return dict(row) if row else {"job_id": JOB_ID, "status": "never run"}
+	finally:
+		conn.close()
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	sub = parser.add_subparsers(dest="command")
+	p_run = sub.add_parser("run", help="recompute (resumes an interrupted run)")
+	p_run.add_argument("--chunk-size", type=int, default=5000)
+	p_run.add_argument("--pause-ms", type=int, default=50, help="sleep between batches to leave room for other writers")
+	p_run.add_argument("--restart", action="store_true")
+	sub.add_parser("status", help="show progress of the last run")
+	sub.add_parser("policies", help="list fee policy versions")
+	p_add = sub.add_parser("add-policy", help="add a fee policy version")
+	p_add.add_argument("--effective-from", required=True, help="ISO UTC, e.g. 2025-11-01T00:00:00Z")
+	p_add.add_argument("--default-fee-rate", type=float, required=True)
+	p_add.add_argument("--usdc-fee-rate", type=float, required=True)
+	p_add.add_argument("--meteora-protocol-cut", type=float, required=True)
+	p_add.add_argument("--note", default="")
+	args = parser.parse_args()
+
+	if args.command == "add-policy":
+		migrate()
+		version = add_policy(args.effective_from, args.default_fee_rate, args.usdc_fee_rate,
+			args.meteora_protocol_cut, args.note)
+		print(f"Added fee policy v{version}; run `python -m scripts.recompute_fees run` to apply it to history")
+	elif args.command == "policies":
+		migrate()
+		for p in load_policies():
+			print(p)
+	elif args.command == "status":
+		print(status())
+	elif args.command == "run":
+		started = time.perf_counter()
+		result = run(args.chunk_size, args.pause_ms, args.restart)
+		print(f"Recompute finished in {time.perf_counter() - started:.1f}s: {result}")
+	else:
+		parser.print_help()
+
+
+if __name__ == "__main__":
+	main()
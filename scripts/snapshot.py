@@ -1,18 +1,34 @@
 import sys
-from core.snapshot import snapshot_once
+from app.db import migrate
+from app.leader import SchedulerLease
+from core.snapshot import snapshot_all
 
 if __name__ == "__main__":
+	migrate()
+	lease = SchedulerLease()
+	if not lease.acquire():
+		holder = (lease.current_holder() or {}).get("holder")
+		print(f"Skipping snapshot: scheduler lease is held by {holder}")
+		sys.exit(0)
+	lease.start_heartbeat()
 	try:
 		print("Starting snapshot...")
-		res = snapshot_once()
+		out = snapshot_all()
+		for asset_key, res in out["assets"].items():
+			print(asset_key, {
+				"ts": res.get("ts_utc"),
+				"fees24h_total_usd_est": round(res.get("fees24h_total_usd_est", 0.0), 4),
+				"real_yield_daily": round(res.get("real_yield_daily", 0.0), 6),
+				"apy_simple": round(res.get("apy_simple", 0.0), 6),
+				"apy_compound": round(res.get("apy_compound", 0.0), 6),
+			})
+		for asset_key, err in out["errors"].items():
+			print(f"Snapshot of {asset_key} failed: {err}")
+		if out["errors"]:
+			sys.exit(1)
 		print("Snapshot completed successfully!")
-		print({
-			"ts": res.get("ts_utc"),
-			"fees24h_total_usd_est": round(res.get("fees24h_total_usd_est", 0.0), 4),
-			"real_yield_daily": round(res.get("real_yield_daily", 0.0), 6),
-			"apy_simple": round(res.get("apy_simple", 0.0), 6),
-			"apy_compound": round(res.get("apy_compound", 0.0), 6),
-		})
 	except Exception as e:
 		print(f"Snapshot failed: {e}")
 		sys.exit(1)
+	finally:
+		lease.stop_heartbeat(release=True)
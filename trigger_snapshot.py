@@ -13,10 +13,11 @@ def trigger_snapshot():
         
         if result.get("success"):
             print("✅ Snapshot triggered successfully!")
-            print(f"📅 Timestamp: {result.get('timestamp')}")
+            for asset, ts in (result.get("timestamps") or {}).items():
+                print(f"📅 {asset}: {ts}")
         else:
             print("❌ Snapshot failed!")
-            print(f"Error: {result.get('error')}")
+            print(f"Error: {result.get('error') or result.get('errors')}")
             
     except Exception as e:
         print(f"❌ Failed to trigger snapshot: {e}")